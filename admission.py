@@ -0,0 +1,158 @@
+"""
+Admission control for the identify pipeline: degrade quality, then shed load.
+
+The inference pool only refuses work once its queue is full, so during a
+burst every request still runs the full-cost pipeline and waits behind all
+the others; latency grows with the queue. ``AdmissionController`` predicts
+how long a new request would take - the waves of work ahead of it in the
+pool times the recent per-image cost of a quality tier - and serves it at
+the best tier predicted to finish within the latency target. Cheaper tiers
+detect on a smaller frame with fewer upsamples, decode large JPEGs at a
+reduced size and keep a smaller dashboard thumbnail. When even the cheapest
+tier would miss the target, the request is refused with ``Overloaded``
+before it costs anything, so latency stays bounded at any offered load.
+
+Tier costs are moving averages of the decode, detect and encode times the
+scans report, so they follow the hardware and the images being sent. A tier
+not measured yet is estimated from a measured one by the tiers' relative
+costs. An idle server always serves the best tier, which keeps its cost
+current once a burst is over.
+
+A request with nothing to degrade, such as face crops that skip detection,
+is admitted or shed like any other but always served at full quality.
+"""
+import math
+import threading
+from collections import namedtuple
+
+# A quality level: detection frame's longer side (None = as requested), most
+# upsamples, dashboard thumbnail's longer side, and the expected cost
+# relative to full quality, used until the tier has been measured
+QualityTier = namedtuple("QualityTier", ["name", "max_side", "upsample", "thumbnail_side", "cost"])
+QUALITY_TIERS = (
+    QualityTier("full", None, None, None, 1.0),
+    QualityTier("reduced", 960, 1, 240, 0.4),
+    QualityTier("minimal", 480, 0, 160, 0.1),
+)
+
+# Scan timings that are spent in the inference pool
+POOL_STAGES = ("decode", "convert", "resize", "detect", "encode", "thumbnail")
+
+
+class Overloaded(Exception):
+    """Raised when no quality tier would meet the latency target; retry_after is in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__("Server overloaded, try again later")
+        self.retry_after = retry_after
+
+
+def degrade(options, thumbnail, tier):
+    """Return (detect options, thumbnail options) capped at a quality tier"""
+    if tier.max_side is None:
+        return options, thumbnail
+    options = options._replace(
+        max_side=min(options.max_side or tier.max_side, tier.max_side),
+        upsample=min(options.upsample, tier.upsample),
+        # Decoding below the detection size wastes nothing the tier uses
+        decode_side=min(options.decode_side or tier.max_side, tier.max_side),
+    )
+    thumbnail = thumbnail._replace(max_side=min(thumbnail.max_side, tier.thumbnail_side))
+    return options, thumbnail
+
+
+class Ticket:
+    """An admitted request: the tier it is served at and what its scans cost"""
+
+    __slots__ = ("tier", "index", "images", "seconds", "scanned", "_controller")
+
+    def __init__(self, controller, index, images):
+        self._controller = controller
+        self.index = index
+        self.tier = controller.tiers[index]
+        self.images = images
+        self.seconds = 0.0
+        self.scanned = 0
+
+    def observe(self, scans):
+        """Record the cost of freshly made scans (not cache hits or errors)"""
+        for scan in scans:
+            if isinstance(scan, Exception) or scan.shape is None:
+                continue
+            self.seconds += sum(scan.timings.get(stage, 0.0) for stage in POOL_STAGES) / 1000
+            self.scanned += 1
+
+    def release(self):
+        self._controller._release(self)
+
+
+class AdmissionController:
+    """Chooses each request's quality tier from the pool's backlog and recent costs"""
+
+    def __init__(self, concurrency, target_seconds, tiers=QUALITY_TIERS, smoothing=0.2):
+        self.concurrency = max(1, concurrency)
+        self.target_seconds = target_seconds
+        self.tiers = tiers
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._pending = 0
+        # Moving average of seconds per image, per tier (None until measured)
+        self._costs = [None] * len(tiers)
+
+    def admit(self, images=1, degradable=True):
+        """Admit a request of images; returns its Ticket or raises Overloaded"""
+        with self._lock:
+            index = self._choose(images)
+            if index is None:
+                raise Overloaded(self._retry_after())
+            if not degradable:
+                index = 0
+            self._pending += images
+        return Ticket(self, index, images)
+
+    def stats(self):
+        """Return a snapshot of the backlog and the tier costs"""
+        with self._lock:
+            return {
+                "pending_images": self._pending,
+                "target_seconds": self.target_seconds,
+                "tier_seconds": {
+                    tier.name: None if cost is None else round(cost, 4)
+                    for tier, cost in zip(self.tiers, self._costs)
+                },
+            }
+
+    def _choose(self, images):
+        if not self.target_seconds or not self._pending:
+            return 0
+        waves = math.ceil((self._pending + images) / self.concurrency)
+        for index in range(len(self.tiers)):
+            cost = self._estimate(index)
+            if cost is None or waves * cost <= self.target_seconds:
+                return index
+        return None
+
+    def _estimate(self, index):
+        if self._costs[index] is not None:
+            return self._costs[index]
+        # Scale the nearest measured tier's cost
+        measured = [i for i, cost in enumerate(self._costs) if cost is not None]
+        if not measured:
+            return None
+        nearest = min(measured, key=lambda i: abs(i - index))
+        return self._costs[nearest] * self.tiers[index].cost / self.tiers[nearest].cost
+
+    def _retry_after(self):
+        # Time for the backlog to drain at the cheapest tier
+        cost = self._estimate(len(self.tiers) - 1) or 1.0
+        return max(1, math.ceil(self._pending / self.concurrency * cost))
+
+    def _release(self, ticket):
+        with self._lock:
+            self._pending -= ticket.images
+            if ticket.scanned:
+                cost = ticket.seconds / ticket.scanned
+                previous = self._costs[ticket.index]
+                self._costs[ticket.index] = (
+                    cost if previous is None else (1 - self.smoothing) * previous + self.smoothing * cost
+                )
@@ -0,0 +1,463 @@
+"""
+ASGI entry point: the identify API on asyncio, for many idle or slow clients.
+
+Under ``gunicorn server:app`` every connection holds a worker thread for as
+long as its client takes to send the request body or read the response, so
+a few slow cameras or idle keep-alive connections can use up the threads.
+Here the event loop does all socket I/O: a connection waiting on its client
+costs a coroutine and its buffers, not a thread.
+
+Nothing CPU-bound runs on the loop. Detection and encoding go to the
+inference pool as with Flask, awaited rather than waited on; parsing
+uploads, hashing, matching, enrollment, result-log queries and encoding
+large JSON responses run on CPU_THREADS threads.
+
+POST /identify, POST /add_face, GET /api/results, GET /api/results/<id>/image
+and GET /health are served here, with the same parameters and responses as
+the Flask views, whose state and helpers they share. Every other route is
+handed to the Flask app on one of FLASK_THREADS threads, so the dashboard,
+its live updates and the rest of the API keep working on the same port.
+server.py is unchanged as a WSGI app: ``gunicorn server:app`` still serves
+everything.
+
+Run with ``uvicorn asgi:app --host 0.0.0.0 --port 5000``.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import CombinedMultiDict, MultiDict
+from werkzeug.formparser import parse_form_data
+from werkzeug.http import parse_etags, parse_options_header
+
+import admission
+import encoding_store
+import inference
+import server
+from admission import Overloaded
+from inference import InferenceTimeout, PoolBusy
+from result_log import parse_time
+
+# Threads for CPU work off the event loop, and for routes handed to the
+# Flask app (each open dashboard event stream holds one of those)
+CPU_THREADS = int(os.environ.get("FACE_ASGI_CPU_THREADS", "4"))
+FLASK_THREADS = int(os.environ.get("FACE_ASGI_FLASK_THREADS", "16"))
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_THREADS, thread_name_prefix="asgi-cpu")
+flask_executor = ThreadPoolExecutor(max_workers=FLASK_THREADS, thread_name_prefix="asgi-flask")
+
+# Response bodies are sent in chunks of this size, so a large image waits
+# on the client's socket instead of being buffered whole
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+
+class HTTPError(Exception):
+    """An error response with a status code and message"""
+
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.headers = list(headers)
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client goes away before its request body is complete"""
+
+
+class Request:
+    """The parts of an HTTP request the native routes use"""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = MultiDict(parse_qsl(scope["query_string"].decode('latin-1'), keep_blank_values=True))
+        self.headers = {}
+        for name, value in scope["headers"]:
+            self.headers[name.decode('latin-1').lower()] = value.decode('latin-1')
+        self.mimetype = parse_options_header(self.headers.get('content-type', ''))[0]
+        self.body = b''
+
+
+async def run_cpu(fn, *args):
+    """Run fn(*args) on a CPU thread"""
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor, fn, *args)
+
+
+def json_response(status, payload, headers=()):
+    return status, [("Content-Type", "application/json")] + list(headers), json.dumps(payload).encode('utf-8')
+
+
+def error_response(error):
+    """Map an exception from a route to its response, as the Flask views do"""
+    if isinstance(error, HTTPError):
+        return json_response(error.status, {"status": "error", "message": str(error)}, error.headers)
+    if isinstance(error, Overloaded):
+        return json_response(503, {"status": "error", "message": str(error), "quality": "shed"}, [
+            ("Retry-After", str(error.retry_after)), ("X-Quality-Tier", "shed")
+        ])
+    if isinstance(error, PoolBusy):
+        return json_response(429, {"status": "error", "message": str(error)}, [
+            ("Retry-After", str(error.retry_after)), ("X-Quality-Tier", "shed")
+        ])
+    if isinstance(error, InferenceTimeout):
+        return json_response(504, {"status": "error", "message": str(error)})
+    print(f"Error processing request: {error}")
+    return json_response(500, {"status": "error", "message": str(error)})
+
+
+def too_large(limit):
+    return HTTPError(413, f"Request body too large (limit {limit // (1024 * 1024)} MB)")
+
+
+async def read_body(request, receive, limit=None):
+    """Read the request body without blocking, refusing it with 413 past limit"""
+    limit = server.MAX_UPLOAD_BYTES if limit is None else limit
+    length = request.headers.get('content-length')
+    if length is not None and int(length) > limit:
+        raise too_large(limit)
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        body += message.get("body", b"")
+        if len(body) > limit:
+            raise too_large(limit)
+        if not message.get("more_body"):
+            break
+    request.body = memoryview(body)
+
+
+def parse_image_upload(request):
+    """
+    Return (image bytes, params) of a request body, like server.read_image_upload.
+
+    Runs on a CPU thread: multipart parsing and base64 decoding are not free.
+    """
+    if request.mimetype in server.RAW_IMAGE_TYPES:
+        return request.body or None, request.args
+
+    if request.mimetype == 'multipart/form-data':
+        _, form, files = parse_form_data({
+            "REQUEST_METHOD": request.method,
+            "CONTENT_TYPE": request.headers.get('content-type', ''),
+            "CONTENT_LENGTH": str(len(request.body)),
+            "wsgi.input": io.BytesIO(request.body),
+        })
+        upload = files.get('image')
+        return upload.read() if upload else None, CombinedMultiDict([request.args, form])
+
+    try:
+        data = json.loads(bytes(request.body)) if request.body else None
+    except ValueError:
+        raise HTTPError(400, "Invalid JSON body")
+    if not isinstance(data, dict) or 'image' not in data:
+        return None, data if isinstance(data, dict) else {}
+    start = time.perf_counter()
+    img_bytes = server.base64.b64decode(data['image'])
+    server.observe_stage("base64", time.perf_counter() - start)
+    return img_bytes, data
+
+
+def identify_result(scan, entry, img_bytes, top_k, nprobe):
+    """Match, store and describe one scan; runs on a CPU thread"""
+    result = server.identify_scans([scan], top_k=top_k, nprobe=nprobe, entries=[entry])[0]
+    server.store_result(result, scan, img_bytes)
+    print(f"Processed image: {result['result']}")
+    return server.result_response(result, top_k)
+
+
+async def identify(request, receive):
+    """POST /identify, as server.identify"""
+    start = time.perf_counter()
+    await read_body(request, receive)
+    img_bytes, params = await run_cpu(parse_image_upload, request)
+    server.observe_stage("parse", time.perf_counter() - start)
+    if img_bytes is None:
+        raise HTTPError(400, "No image provided")
+    try:
+        options = server.detect_options(params)
+        top_k, nprobe = server.match_params(params)
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+
+    ticket = server.admit_request()
+    try:
+        options, thumbnail = admission.degrade(options, server.THUMBNAIL_OPTIONS, ticket.tier)
+        probe, entry, hash_ms = await run_cpu(server.lookup_scan, img_bytes, options, thumbnail)
+        if entry is None:
+            scan = await server.inference_pool.run_async(inference.analyze, img_bytes, options, False, thumbnail)
+            ticket.observe([scan])
+            scan, entry = server.cache_scan(probe, scan, hash_ms)
+        else:
+            scan = server.cached_scan(entry, hash_ms)
+
+        if scan.shape is None:
+            raise HTTPError(400, "Failed to decode image", [("X-Quality-Tier", ticket.tier.name)])
+
+        response = await run_cpu(identify_result, scan, entry, img_bytes, top_k, nprobe)
+        response["quality"] = ticket.tier.name
+        return json_response(200, response, [("X-Quality-Tier", ticket.tier.name)])
+    finally:
+        ticket.release()
+
+
+async def add_face(request, receive):
+    """POST /add_face, as server.add_face"""
+    await read_body(request, receive)
+    img_bytes, params = await run_cpu(parse_image_upload, request)
+    if img_bytes is None or 'name' not in params:
+        raise HTTPError(400, "Image and name required")
+
+    name = params['name'].strip()
+    if not encoding_store.is_valid_name(name):
+        raise HTTPError(400, "Invalid name")
+
+    scan = await server.inference_pool.run_async(inference.analyze, img_bytes, inference.DEFAULT_OPTIONS, True)
+    if scan.shape is None:
+        raise HTTPError(400, "Failed to decode image")
+    if len(scan.encodings) == 0:
+        raise HTTPError(400, "No face detected in image")
+    if len(scan.encodings) > 1:
+        raise HTTPError(400, "Multiple faces detected. Please use image with single face")
+
+    replace = str(params.get('replace', False)).lower() in ('true', '1')
+    samples = await run_cpu(server.enroll_scan, name, scan, replace)
+    print(f"Added face sample {samples} for: {name}")
+    return json_response(200, {
+        "status": "success",
+        "message": f"Face '{name}' added successfully",
+        "samples": samples
+    })
+
+
+def results_page(args):
+    """Query the result log and encode the page; runs on a CPU thread"""
+    try:
+        since = args.get('since')
+        until = args.get('until')
+        limit = int(args.get('limit', server.DASHBOARD_RESULTS))
+        cursor = args.get('cursor')
+        if cursor is not None:
+            int(cursor)
+        if not 1 <= limit <= server.MAX_RESULTS_PAGE:
+            raise ValueError(f"limit must be between 1 and {server.MAX_RESULTS_PAGE}")
+        results, next_cursor = server.result_log.query(
+            since=parse_time(since) if since else None,
+            until=parse_time(until) if until else None,
+            name=args.get('name'),
+            cursor=cursor,
+            limit=limit
+        )
+    except ValueError as e:
+        raise HTTPError(400, f"Invalid query: {e}")
+    return json_response(200, server.dashboard_snapshot(results, next_cursor))
+
+
+async def get_results(request, receive):
+    """GET /api/results, as server.get_results"""
+    return await run_cpu(results_page, request.args)
+
+
+async def get_result_image(request, receive, result_id):
+    """GET /api/results/<id>/image, as server.get_result_image"""
+    image = server.result_images.image(result_id)
+    if image is None:
+        raise HTTPError(404, "Image not available")
+    img_bytes, content_type = image
+    headers = [
+        ("Content-Type", content_type),
+        ("ETag", f'"{result_id}"'),
+        ("Cache-Control", f"private, max-age={server.RESULT_IMAGE_MAX_AGE}, immutable"),
+    ]
+    if parse_etags(request.headers.get('if-none-match')).contains(result_id):
+        return 304, headers, b''
+    return 200, headers, img_bytes
+
+
+async def health(request, receive):
+    """GET /health, as server.health"""
+    return json_response(200, {
+        "status": "ok",
+        "known_faces": len(server.gallery),
+        "inference": server.inference_pool.stats(),
+        "admission": server.admission_control.stats()
+    })
+
+
+# (method, path) -> (endpoint name for metrics, handler)
+ROUTES = {
+    ("POST", "/identify"): ("identify", identify),
+    ("POST", "/add_face"): ("add_face", add_face),
+    ("GET", "/api/results"): ("get_results", get_results),
+    ("GET", "/health"): ("health", health),
+}
+RESULT_IMAGE_PREFIX, RESULT_IMAGE_SUFFIX = "/api/results/", "/image"
+
+
+def find_route(method, path):
+    """Return (endpoint, handler) for a natively served route, or None"""
+    route = ROUTES.get((method, path))
+    if route is not None:
+        return route
+    if method == "GET" and path.startswith(RESULT_IMAGE_PREFIX) and path.endswith(RESULT_IMAGE_SUFFIX):
+        result_id = path[len(RESULT_IMAGE_PREFIX):-len(RESULT_IMAGE_SUFFIX)]
+        if result_id and '/' not in result_id:
+            return "get_result_image", lambda request, receive: get_result_image(request, receive, result_id)
+    return None
+
+
+async def send_response(send, status, headers, body):
+    headers = headers + [("Content-Length", str(len(body)))]
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers],
+    })
+    view = memoryview(body)
+    for offset in range(0, len(view), RESPONSE_CHUNK_SIZE):
+        await send({"type": "http.response.body", "body": bytes(view[offset:offset + RESPONSE_CHUNK_SIZE]),
+                    "more_body": True})
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def serve_native(endpoint, handler, scope, receive, send):
+    start = time.perf_counter()
+    try:
+        status, headers, body = await handler(Request(scope), receive)
+    except ClientDisconnected:
+        return
+    except Exception as e:
+        status, headers, body = error_response(e)
+    await send_response(send, status, headers, body)
+    server.REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+    server.REQUESTS_TOTAL.labels(endpoint, str(status)).inc()
+
+
+class BodyStream(io.RawIOBase):
+    """Blocking reader of an ASGI request body, for the Flask app on a thread"""
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = b''
+        self._more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and self._more:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message["type"] == "http.disconnect":
+                self._more = False
+                break
+            self._buffer = message.get("body", b"")
+            self._more = message.get("more_body", False)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def wsgi_environ(scope, stream):
+    """A WSGI environ for an ASGI HTTP scope, reading the body from stream"""
+    host, port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode('utf-8').decode('latin-1'),
+        "PATH_INFO": scope["path"].encode('utf-8').decode('latin-1'),
+        "QUERY_STRING": scope["query_string"].decode('latin-1'),
+        "SERVER_NAME": host,
+        "SERVER_PORT": str(port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": stream,
+        # The stream ends with the body, so Flask may read bodies without a
+        # Content-Length, like chunked video uploads
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def call_flask(scope, receive, send):
+    """Serve a request with the Flask app on a thread, streaming its response"""
+    loop = asyncio.get_running_loop()
+    environ = wsgi_environ(scope, io.BufferedReader(BodyStream(receive, loop)))
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(' ', 1)[0])
+        started["headers"] = headers
+
+    def first_chunk():
+        result = server.app(environ, start_response)
+        chunks = iter(result)
+        return result, chunks, next(chunks, None)
+
+    result, chunks, chunk = await loop.run_in_executor(flask_executor, first_chunk)
+    # The app has read what it wanted of the body by now; watch for the
+    # client leaving, so endless responses like /api/stream stop at their
+    # next chunk (a keep-alive at the latest), as under gunicorn
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": started["status"],
+            "headers": [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in started["headers"]],
+        })
+        while chunk is not None and not disconnected.done():
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            chunk = await loop.run_in_executor(flask_executor, next, chunks, None)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        disconnected.cancel()
+        if hasattr(result, 'close'):
+            await loop.run_in_executor(flask_executor, result.close)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            cpu_executor.shutdown(wait=False)
+            flask_executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    route = find_route(scope["method"], scope["path"])
+    if route is None:
+        return await call_flask(scope, receive, send)
+    endpoint, handler = route
+    return await serve_native(endpoint, handler, scope, receive, send)
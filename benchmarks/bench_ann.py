@@ -0,0 +1,76 @@
+"""
+Benchmark the IVF matcher against exact search: recall@1 and latency per nprobe.
+
+Probes are noisy copies of enrolled encodings (the case that matters for a
+deployed gallery), so exact search always finds a match within tolerance;
+recall@1 is the fraction of probes for which the IVF matcher returns the
+same top-1 row as exact search.
+
+Usage: python benchmarks/bench_ann.py [--gallery N] [--probes P] [--nlist L]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gallery import Gallery  # noqa: E402
+from matchers import ExactMatcher, IVFMatcher  # noqa: E402
+
+TOLERANCE = 0.6
+NPROBES = (1, 2, 4, 8, 16, 32, 64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--gallery', type=int, default=100000)
+    parser.add_argument('--probes', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=20, help="probe batches per nprobe setting")
+    parser.add_argument('--nlist', type=int, default=0, help="0 picks 4 * sqrt(gallery)")
+    parser.add_argument('--noise', type=float, default=0.02)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    encodings = rng.normal(size=(args.gallery, 128))
+    encodings *= 0.5 / np.linalg.norm(encodings, axis=1, keepdims=True)
+
+    gallery = Gallery()
+    gallery.replace([f"person_{i}" for i in range(args.gallery)], encodings)
+    snapshot = gallery.snapshot()
+
+    batches = []
+    for _ in range(args.queries):
+        rows = rng.choice(args.gallery, args.probes, replace=False)
+        batches.append(encodings[rows] + rng.normal(scale=args.noise, size=(args.probes, 128)))
+
+    exact = ExactMatcher()
+    start = time.perf_counter()
+    truth = [exact.search(snapshot, b, TOLERANCE)[0][:, 0] for b in batches]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(batches)
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        ivf = IVFMatcher(store_dir, nlist=args.nlist)
+        start = time.perf_counter()
+        ivf.rebuild(snapshot)
+        build_s = time.perf_counter() - start
+
+        nlist = len(ivf._state.centroids)
+        print(f"gallery={args.gallery} probes/batch={args.probes} nlist={nlist} "
+              f"build={build_s:.2f}s exact={exact_ms:.2f}ms/batch")
+        print(f"{'nprobe':>6} {'ms/batch':>9} {'speedup':>8} {'recall@1':>9}")
+        for nprobe in NPROBES:
+            if nprobe > nlist:
+                break
+            start = time.perf_counter()
+            found = [ivf.search(snapshot, b, TOLERANCE, nprobe=nprobe)[0][:, 0] for b in batches]
+            ivf_ms = (time.perf_counter() - start) * 1000 / len(batches)
+            recall = np.mean(np.concatenate(found) == np.concatenate(truth))
+            print(f"{nprobe:>6} {ivf_ms:>9.2f} {exact_ms / ivf_ms:>7.1f}x {recall:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
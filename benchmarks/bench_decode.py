@@ -0,0 +1,89 @@
+"""
+Benchmark image decoding: full BGR decode + RGB conversion vs reduced RGB decode.
+
+"full" is what analyze() used to do for every upload: cv2.imdecode at full
+resolution, then a full-frame cvtColor to RGB. "reduced" reads the JPEG
+header, decodes at 1/2, 1/4 or 1/8 size in the DCT for the given
+--decode-side and straight into RGB order where OpenCV supports it.
+
+Each variant runs in its own process, so peak RSS is the variant's own.
+Reported per variant: the decode reduction, median milliseconds per image and
+peak RSS growth while decoding.
+
+Usage: python benchmarks/bench_decode.py [--megapixels MP] [--decode-side N] [--runs N]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_suite import rss_mb  # noqa: E402
+
+
+def synthetic_jpeg(path, megapixels):
+    """A 4:3 photo-like JPEG (smooth noise) of about the given size"""
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+    rng = np.random.default_rng(0)
+    image = cv2.resize(rng.integers(0, 255, (height // 16, width // 16, 3), dtype=np.uint8),
+                       (width, height), interpolation=cv2.INTER_CUBIC)
+    cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+
+def worker(variant, path, decode_side, runs, queue):
+    import inference
+
+    with open(path, 'rb') as f:
+        jpeg = f.read()
+    options = inference.DEFAULT_OPTIONS._replace(decode_side=decode_side)
+    # VmHWM, not ru_maxrss: on Linux the latter survives exec, so a spawned
+    # child would inherit this process's peak
+    _, peak_before = rss_mb()
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        if variant == "full":
+            image = cv2.cvtColor(inference.decode_image(jpeg), cv2.COLOR_BGR2RGB)
+        else:
+            reduction = inference.decode_reduction(inference.jpeg_size(jpeg), options)
+            image = inference.decode_rgb(jpeg, reduction)
+        times.append((time.perf_counter() - start) * 1000)
+        del image
+    queue.put((variant, reduction if variant == "reduced" else 1, float(np.median(times)),
+               rss_mb()[1] - peak_before))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--megapixels', type=float, default=12)
+    parser.add_argument('--decode-side', type=int, default=1920)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "photo.jpg")
+        synthetic_jpeg(path, args.megapixels)
+        height, width = cv2.imread(path).shape[:2]
+        print(f"{width}x{height} JPEG, {os.path.getsize(path) / 1024:.0f} KB, decode_side {args.decode_side}")
+        print(f"{'variant':>8} {'reduction':>9} {'ms':>8} {'peak MB':>8}")
+        for variant in ("full", "reduced"):
+            queue = ctx.Queue()
+            proc = ctx.Process(target=worker, args=(variant, path, args.decode_side, args.runs, queue))
+            proc.start()
+            name, reduction, ms, peak = queue.get()
+            proc.join()
+            print(f"{name:>8} {'1/' + str(reduction):>9} {ms:>8.1f} {peak:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Benchmark edge uploads: whole base64 frames vs EdgeClient's gated face uploads.
+
+A synthetic clip pans a known face across a noisy scene and then holds it
+still, as a doorway camera sees someone walk up and stop. Each variant sends
+the clip to a local server, run in a subprocess with the threaded development
+server speaking HTTP/1.1:
+
+* "json_frames": what edge devices do today - every frame as base64 JSON to
+  /identify, on a new connection each time,
+* "frames": EdgeClient posting motion-gated whole JPEG frames,
+* "crops": EdgeClient posting motion-gated Haar face crops to /identify/crops,
+* "encodings": EdgeClient posting face encodings to /identify/encodings
+  (only when face_recognition is installed on this side).
+
+Reported per variant: requests, KB uploaded in total and per frame, frames
+per second through the client, and the names the server recognized.
+
+Usage: python benchmarks/bench_edge.py [--frames N] [--hold N] [--face PATH]
+"""
+import argparse
+import base64
+import http.client
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_stream import synthetic_clip  # noqa: E402
+from bench_suite import free_port  # noqa: E402
+from edge_client import DEFAULT_EDGE_OPTIONS, EdgeClient  # noqa: E402
+from encoding_store import list_face_images  # noqa: E402
+
+SERVER_SCRIPT = """
+import sys
+from werkzeug.serving import WSGIRequestHandler, run_simple
+from server import app
+WSGIRequestHandler.protocol_version = "HTTP/1.1"
+run_simple("127.0.0.1", int(sys.argv[1]), app, threaded=True)
+"""
+
+
+def start_server(port, tmp_dir, **env):
+    """Start the server on port with its state in tmp_dir; env overrides its settings"""
+    env = dict(os.environ,
+               FACE_RESULT_DB=os.path.join(tmp_dir, "results.db"),
+               FACE_GALLERY_DIR=os.path.join(tmp_dir, "gallery"),
+               FACE_PROBE_CACHE_SIZE="0", **env)
+    proc = subprocess.Popen([sys.executable, '-c', SERVER_SCRIPT, str(port)], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 120
+    while True:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            if time.time() > deadline:
+                proc.kill()
+                raise
+        time.sleep(0.5)
+
+
+def default_face_path():
+    """The first image in known_faces/"""
+    known = os.path.join(ROOT, "known_faces")
+    return os.path.join(known, list_face_images(known)[0])
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def clip_frames(face_path, frames, hold):
+    """The pan, then the last frame held with a little sensor noise"""
+    clip = synthetic_clip(face_path, frames)
+    rng = np.random.default_rng(1)
+    last = clip[-1].astype(np.int16)
+    for _ in range(hold):
+        noise = rng.integers(-3, 4, size=last.shape, dtype=np.int16)
+        clip.append(np.clip(last + noise, 0, 255).astype(np.uint8))
+    return clip
+
+
+def recognized(response, names):
+    names.update(name for name in response.get("faces") or [] if name != "Unknown")
+
+
+def run_json_frames(port, clip):
+    names = set()
+    sent = 0
+    start = time.perf_counter()
+    for frame in clip:
+        jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, DEFAULT_EDGE_OPTIONS.jpeg_quality])[1]
+        body = json.dumps({"image": base64.b64encode(jpeg.tobytes()).decode('ascii')}).encode('utf-8')
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.request('POST', '/identify', body=body, headers={"Content-Type": "application/json"})
+        recognized(json.loads(conn.getresponse().read()), names)
+        conn.close()
+        sent += len(body)
+    seconds = time.perf_counter() - start
+    return {"requests": len(clip), "upload_bytes": sent, "seconds": seconds, "names": names}
+
+
+def run_client(port, clip, mode):
+    client = EdgeClient(f"http://127.0.0.1:{port}", DEFAULT_EDGE_OPTIONS._replace(mode=mode))
+    names = set()
+    start = time.perf_counter()
+    try:
+        for frame in clip:
+            response = client.process(frame)
+            if response is not None:
+                recognized(response, names)
+    finally:
+        client.close()
+    seconds = time.perf_counter() - start
+    return {"requests": client.stats["uploads"], "upload_bytes": client.stats["upload_bytes"],
+            "seconds": seconds, "names": names}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--frames', type=int, default=60, help="frames of the pan")
+    parser.add_argument('--hold', type=int, default=60, help="still frames after the pan")
+    parser.add_argument('--face', default=None, help="image of a known face (default: first in known_faces/)")
+    args = parser.parse_args()
+
+    clip = clip_frames(args.face or default_face_path(), args.frames, args.hold)
+
+    variants = ["json_frames", "frames", "crops"]
+    if importlib.util.find_spec("face_recognition") is not None:
+        variants.append("encodings")
+    else:
+        print("face_recognition is not installed; skipping the encodings variant")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        port = free_port()
+        proc = start_server(port, tmp_dir)
+        try:
+            print(f"{len(clip)} frames ({args.frames} moving, {args.hold} still)")
+            print(f"{'variant':>12} {'requests':>9} {'KB':>9} {'KB/frame':>9} {'fps':>7}  recognized")
+            for variant in variants:
+                if variant == "json_frames":
+                    result = run_json_frames(port, clip)
+                else:
+                    result = run_client(port, clip, variant)
+                kb = result["upload_bytes"] / 1024
+                print(f"{variant:>12} {result['requests']:>9} {kb:>9.0f} {kb / len(clip):>9.1f} "
+                      f"{len(clip) / result['seconds']:>7.1f}  {', '.join(sorted(result['names'])) or '-'}")
+        finally:
+            stop_server(proc)
+
+
+if __name__ == '__main__':
+    main()
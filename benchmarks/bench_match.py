@@ -0,0 +1,91 @@
+"""
+Micro-benchmark: per-face gallery matching vs one batched match() call.
+
+The "loop" variant reproduces what identify_image() used to do for every
+detected face: face_recognition.compare_faces() plus face_distance() against
+a Python list of float64 encodings, each of which converts the list to an
+array and computes every distance again.
+
+Usage: python benchmarks/bench_match.py [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gallery import Gallery, match  # noqa: E402
+
+GALLERY_SIZES = (1000, 10000, 100000)
+PROBE_COUNTS = (1, 10, 50)
+TOLERANCE = 0.6
+
+
+def random_encodings(rng, n):
+    """Unit-ish 128-d vectors spread like real dlib encodings"""
+    encodings = rng.normal(size=(n, 128))
+    encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+    return encodings * 0.5
+
+
+def face_distance(face_encodings, face_to_compare):
+    # Same computation as face_recognition.face_distance
+    if len(face_encodings) == 0:
+        return np.empty((0))
+    return np.linalg.norm(face_encodings - face_to_compare, axis=1)
+
+
+def match_loop(known_face_encodings, probes):
+    best = []
+    for face_encoding in probes:
+        matches = list(face_distance(np.array(known_face_encodings), face_encoding) <= TOLERANCE)
+        face_distances = face_distance(np.array(known_face_encodings), face_encoding)
+        best_match_index = np.argmin(face_distances)
+        best.append(best_match_index if matches[best_match_index] else -1)
+    return best
+
+
+def best_of(repeat, fn, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'gallery':>8} {'probes':>6} {'loop ms':>10} {'batched ms':>11} {'speedup':>8}")
+    for size in GALLERY_SIZES:
+        encodings = random_encodings(rng, size)
+        known_face_encodings = list(encodings)
+        gallery = Gallery()
+        gallery.replace([f"person_{i}" for i in range(size)], encodings)
+        snapshot = gallery.snapshot()
+
+        for count in PROBE_COUNTS:
+            # Half the probes are noisy copies of enrolled faces
+            probes = random_encodings(rng, count)
+            probes[::2] = encodings[:count:2] + rng.normal(scale=0.02, size=(len(probes[::2]), 128))
+
+            loop = best_of(args.repeat, match_loop, known_face_encodings, probes)
+            batched = best_of(args.repeat, match, snapshot, probes, TOLERANCE)
+
+            expected = match_loop(known_face_encodings, probes)
+            got = list(match(snapshot, probes, TOLERANCE)[0][:, 0])
+            assert got == expected, "batched match disagrees with the loop"
+
+            print(f"{size:>8} {count:>6} {loop * 1000:>10.2f} {batched * 1000:>11.3f} "
+                  f"{loop / batched:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
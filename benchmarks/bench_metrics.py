@@ -0,0 +1,87 @@
+"""
+Micro-benchmark: cost of recording metrics on the request path.
+
+Measures a bare perf_counter() pair, a counter increment, a histogram
+observe(), and one stage timing as server.observe_stage() records it, from
+one thread and from several threads at once, and the time to render a
+scrape with every pipeline stage populated.
+
+Usage: python benchmarks/bench_metrics.py [--iterations N] [--threads N]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+
+STAGES = ("parse", "base64", "decode", "convert", "resize", "detect", "encode", "match", "store")
+
+
+def per_call_us(fn, iterations):
+    start = time.perf_counter()
+    fn(iterations)
+    return (time.perf_counter() - start) * 1e6 / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    registry = metrics.Registry()
+    counter = registry.counter("bench_total", "Benchmark counter").labels()
+    stage_seconds = registry.histogram("bench_stage_seconds", "Benchmark stages", ["stage"])
+    histograms = {stage: stage_seconds.labels(stage) for stage in STAGES}
+    histogram = histograms["detect"]
+
+    def timer_pair(n):
+        for _ in range(n):
+            start = time.perf_counter()
+            time.perf_counter() - start
+
+    def counter_inc(n):
+        for _ in range(n):
+            counter.inc()
+
+    def histogram_observe(n):
+        for i in range(n):
+            histogram.observe(i * 1e-6)
+
+    def timed_stage(n):
+        for _ in range(n):
+            start = time.perf_counter()
+            histograms["match"].observe(time.perf_counter() - start)
+
+    cases = [
+        ("perf_counter pair", timer_pair),
+        ("counter inc", counter_inc),
+        ("histogram observe", histogram_observe),
+        ("timed stage", timed_stage),
+    ]
+    print(f"{'operation':<20} {'1 thread us':>12} {f'{args.threads} threads us':>14}")
+    for label, fn in cases:
+        single = per_call_us(fn, args.iterations)
+
+        # Wall time per call across all threads; contention would show here
+        per_thread = args.iterations // args.threads
+        threads = [threading.Thread(target=fn, args=(per_thread,)) for _ in range(args.threads)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        multi = (time.perf_counter() - start) * 1e6 / (per_thread * args.threads)
+        print(f"{label:<20} {single:>12.3f} {multi:>14.3f}")
+
+    start = time.perf_counter()
+    body = registry.render()
+    print(f"render: {(time.perf_counter() - start) * 1000:.2f} ms, {len(body)} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Load test: latency of /identify at rising offered load, with and without admission control.
+
+Requests arrive open-loop at each --rates value (requests/s) for --duration
+seconds, whatever the server's pace, and latency is measured from when each
+request was due, so a backed-up server can't hide its queue. A server with
+FACE_LATENCY_TARGET=0 serves everything at full quality, as before admission
+control; one with --target degrades quality and then sheds (see
+admission.py).
+
+Reported per server and rate: requests served (200), refused by the full
+inference queue (429) and shed by admission control (503), latency p50/p99/max of the served ones and of all responses, and the
+quality tiers served.
+
+Usage: python benchmarks/bench_overload.py [--rates R ...] [--duration S] [--target S]
+"""
+import argparse
+import http.client
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_edge import default_face_path, start_server, stop_server  # noqa: E402
+from bench_stream import synthetic_clip  # noqa: E402
+from bench_suite import free_port  # noqa: E402
+
+CLIENT_THREADS = 64
+
+
+def offered_load(port, body, rate, duration):
+    """Send body to /identify at rate per second; returns [(status, tier, seconds)]"""
+    local = threading.local()
+    results = []
+    lock = threading.Lock()
+
+    def send(due):
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        try:
+            conn.request('POST', '/identify', body=body, headers={'Content-Type': 'image/jpeg'})
+            response = conn.getresponse()
+            response.read()
+            status, tier = response.status, response.getheader('X-Quality-Tier', 'full')
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            local.conn = None
+            status, tier = 0, "error"
+        with lock:
+            results.append((status, tier, time.perf_counter() - due))
+
+    with ThreadPoolExecutor(max_workers=CLIENT_THREADS) as executor:
+        start = time.perf_counter()
+        for i in range(int(rate * duration)):
+            due = start + i / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, due)
+    return results
+
+
+def summary(seconds):
+    if not seconds:
+        return "       -        -        -"
+    ms = np.asarray(seconds) * 1000
+    return f"{np.percentile(ms, 50):>8.0f} {np.percentile(ms, 99):>8.0f} {ms.max():>8.0f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rates', type=float, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--target', type=float, default=2.0, help="FACE_LATENCY_TARGET of the controlled server")
+    parser.add_argument('--size', default="1920x1080", help="frame size, WxH")
+    parser.add_argument('--face', default=None, help="image of a known face (default: first in known_faces/)")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.split('x'))
+    frame = synthetic_clip(args.face or default_face_path(), 1, size=(width, height))[0]
+    body = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+    print(f"{width}x{height} frames, {args.duration:.0f} s per rate")
+    print(f"{'target':>7} {'rate':>5} {'served':>7} {'429':>5} {'503':>5} "
+          f"{'ok p50':>8} {'ok p99':>8} {'ok max':>8} {'all p50':>8} {'all p99':>8} {'all max':>8}  tiers")
+    for target in (0, args.target):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            port = free_port()
+            proc = start_server(port, tmp_dir, FACE_LATENCY_TARGET=str(target))
+            try:
+                for rate in args.rates:
+                    results = offered_load(port, body, rate, args.duration)
+                    served = [seconds for status, _, seconds in results if status == 200]
+                    statuses = Counter(status for status, _, _ in results)
+                    tiers = Counter(tier for status, tier, _ in results if status == 200)
+                    print(f"{target or 'off':>7} {rate:>5g} {len(served):>7} {statuses[429]:>5} {statuses[503]:>5} "
+                          f"{summary(served)} "
+                          f"{summary([seconds for _, _, seconds in results])}  "
+                          f"{' '.join(f'{name}={count}' for name, count in sorted(tiers.items()))}")
+            finally:
+                stop_server(proc)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark gallery representations: float64 list vs float32 matrix vs int8 codes.
+
+"list" is how identify_image() used to hold the gallery: a Python list of
+float64 arrays, compared one probe at a time with face_recognition's
+face_distance(). "float32" is Gallery with ExactMatcher, and "int8" is
+QuantizedMatcher, which scans int8 codes and re-ranks the closest --rerank
+rows exactly against the float32 rows.
+
+Memory per identity counts what each representation holds per row; int8's
+figure is the codes it scans, on top of the float32 rows kept for
+re-ranking. Match decisions (best row within tolerance 0.6, or none) of
+every variant are compared with float32's on probes whose distances
+straddle the tolerance; the script exits non-zero if any differ.
+
+Usage: python benchmarks/bench_quantized.py [--gallery N ...] [--probes P] [--rerank R]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gallery import Gallery  # noqa: E402
+from matchers import ExactMatcher, QuantizedMatcher  # noqa: E402
+
+TOLERANCE = 0.6
+
+
+def random_encodings(rng, n):
+    """Unit-ish 128-d vectors spread like real dlib encodings"""
+    encodings = rng.normal(size=(n, 128))
+    encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+    return encodings * 0.5
+
+
+def test_probes(rng, encodings, count):
+    """Copies of enrolled rows moved 0.3-0.9 away, plus strangers"""
+    rows = rng.choice(len(encodings), count, replace=False)
+    noise = rng.normal(size=(count, 128))
+    noise *= rng.uniform(0.3, 0.9, size=(count, 1)) / np.linalg.norm(noise, axis=1, keepdims=True)
+    probes = encodings[rows] + noise
+    probes[::4] = random_encodings(rng, len(probes[::4]))
+    return probes
+
+
+def match_list(known_face_encodings, probes):
+    # What identify_image() used to do for every face
+    decisions = []
+    for probe in probes:
+        face_distances = np.linalg.norm(np.array(known_face_encodings) - probe, axis=1)
+        best = int(np.argmin(face_distances))
+        decisions.append(best if face_distances[best] <= TOLERANCE else -1)
+    return np.array(decisions)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--gallery', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--probes', type=int, default=200)
+    parser.add_argument('--rerank', type=int, default=32)
+    parser.add_argument('--list-probes', type=int, default=20, help="probes timed on the slow list variant")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    mismatches = 0
+    print(f"{'gallery':>8} {'variant':>8} {'bytes/id':>9} {'probes/s':>9} {'decisions':>14}")
+    for size in args.gallery:
+        encodings = random_encodings(rng, size)
+        gallery = Gallery()
+        gallery.replace([f"person_{i}" for i in range(size)], encodings)
+        snapshot = gallery.snapshot()
+        probes = test_probes(rng, encodings, min(args.probes, size))
+
+        exact = ExactMatcher()
+        quantized = QuantizedMatcher(rerank=args.rerank)
+        quantized.rebuild(snapshot)
+        # Warm up both before timing
+        exact.search(snapshot, probes[:1], TOLERANCE)
+        quantized.search(snapshot, probes[:1], TOLERANCE)
+
+        (truth, _), exact_s = timed(exact.search, snapshot, probes, TOLERANCE)
+        truth = truth[:, 0]
+        (found, _), quantized_s = timed(quantized.search, snapshot, probes, TOLERANCE)
+        found = found[:, 0]
+
+        known_face_encodings = [e.copy() for e in encodings]
+        list_probes = probes[:args.list_probes]
+        list_found, list_s = timed(match_list, known_face_encodings, list_probes)
+
+        row_arrays = (snapshot.encodings, snapshot.sq_norms, snapshot.active, snapshot.person_ids)
+        rows = [
+            ("list", sum(sys.getsizeof(e) for e in known_face_encodings) / size + 8,
+             len(list_probes) / list_s, list_found, truth[:len(list_probes)]),
+            ("float32", sum(a.nbytes for a in row_arrays) / size, len(probes) / exact_s, truth, truth),
+            ("int8", quantized.memory_bytes() / size, len(probes) / quantized_s, found, truth),
+        ]
+        for variant, per_id, rate, decisions, expected in rows:
+            differ = int(np.sum(decisions != expected))
+            mismatches += differ
+            matched = int(np.sum(decisions >= 0))
+            print(f"{size:>8} {variant:>8} {per_id:>9.0f} {rate:>9.0f} "
+                  f"{matched:>4}/{len(decisions):<4} {'same' if not differ else f'{differ} differ':>5}")
+
+    if mismatches:
+        print(f"{mismatches} match decisions differ from float32")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark stream ingest: identify_image() on every frame vs StreamProcessor.
+
+A synthetic clip pans a known face across a noisy background. Both variants
+see the same decoded frames; throughput is reported per wall-clock second
+and per CPU second (frames/sec per core). Uses whatever face_recognition is
+installed, so run it on the target device for meaningful numbers.
+
+Usage: python benchmarks/bench_stream.py [--frames N] [--detect-every N] [--face PATH]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def synthetic_clip(face_path, frames, size=(1280, 720)):
+    """Frames of a face drifting across a static noisy scene"""
+    width, height = size
+    rng = np.random.default_rng(0)
+    background = rng.integers(60, 120, size=(height, width, 3), dtype=np.uint8)
+    face = cv2.imread(face_path)
+    scale = min(1.0, (height * 0.6) / face.shape[0])
+    face = cv2.resize(face, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    fh, fw = face.shape[:2]
+    clip = []
+    for i in range(frames):
+        frame = background.copy()
+        x = int((width - fw) * (0.2 + 0.6 * i / max(1, frames - 1)))
+        y = (height - fh) // 2
+        frame[y:y + fh, x:x + fw] = face
+        clip.append(frame)
+    return clip
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--frames', type=int, default=120)
+    parser.add_argument('--detect-every', type=int, default=10)
+    parser.add_argument('--face', default=None, help="image of a known face (default: first in known_faces/)")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    os.environ["FACE_INFERENCE_WORKERS"] = "0"
+    os.environ["FACE_SHARED_GALLERY"] = "0"
+    # Keep the benchmark's results out of the real result log
+    os.environ["FACE_RESULT_DB"] = os.path.join(tempfile.mkdtemp(), "results.db")
+    import server
+    from stream import DEFAULT_STREAM_OPTIONS, StreamProcessor
+
+    face_path = args.face or os.path.join(
+        server.KNOWN_FACES_DIR, server.encoding_store.list_face_images(server.KNOWN_FACES_DIR)[0]
+    )
+    clip = synthetic_clip(face_path, args.frames)
+
+    rows = []
+    start, cpu_start = time.perf_counter(), time.process_time()
+    names = set()
+    encodes = 0
+    for frame in clip:
+        result = server.identify_image(frame)
+        names.update(result["faces"])
+        encodes += result["face_count"]
+    rows.append(("identify_image", len(clip), time.perf_counter() - start,
+                 time.process_time() - cpu_start, encodes, sorted(names)))
+
+    options = DEFAULT_STREAM_OPTIONS._replace(detect_every=args.detect_every)
+    processor = StreamProcessor(server.match_stream_faces, options, server.detect_options())
+    for frame in clip:
+        processor.process(frame)
+    stats = processor.stats.report()
+    rows.append(("stream", stats["frames"], stats["seconds"], stats["cpu_seconds"], stats["encodes"],
+                 sorted({track["name"] for track in processor.summary()})))
+
+    print(f"{'variant':>15} {'frames':>7} {'fps':>8} {'fps/core':>9} {'encodes':>8}  names")
+    for variant, frames, seconds, cpu_seconds, encodes, seen in rows:
+        print(f"{variant:>15} {frames:>7} {frames / seconds:>8.1f} {frames / cpu_seconds:>9.1f} "
+              f"{encodes:>8}  {', '.join(seen)}")
+    print(f"stream: {stats['detect_frames']} detected frames, {stats['tracked_frames']} tracked; "
+          f"speedup {rows[0][2] / rows[1][2]:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
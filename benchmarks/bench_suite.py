@@ -0,0 +1,409 @@
+"""
+Benchmark suite for the server: stages, matching, endpoints and memory, as JSON.
+
+Everything runs on synthetic inputs so two runs are comparable:
+
+* images  - the faces in known_faces/ pasted onto a noisy background at
+  several resolutions and face counts
+* gallery - the known faces plus --gallery random 128-d encodings, so matching
+  costs what it would against a deployed gallery
+
+and measures
+
+* stages   - pipeline stage timings (median ms) per image, from decoding
+  the JPEG through identify_image()'s scan and match
+* match    - match_known_faces() latency against galleries of growing size
+* endpoints - /identify and /api/results latency percentiles and throughput
+  through the Flask test client, and through a local gunicorn (as in the
+  Procfile, serving the known_faces/ gallery) driven by --concurrency clients
+* memory   - resident set growth over the endpoint runs
+
+The probe cache is disabled so every request runs the whole pipeline. The
+report is written to --output; --compare prints the change of every metric
+against an earlier report.
+
+Usage: python benchmarks/bench_suite.py [--output FILE] [--compare BASELINE] [--quick] [--no-gunicorn]
+"""
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESOLUTIONS = {"480p": (640, 480), "720p": (1280, 720), "1080p": (1920, 1080)}
+FACE_COUNTS = (1, 2, 4)
+MATCH_GALLERY_SIZES = (1000, 10000, 100000)
+MATCH_PROBE_COUNTS = (1, 10)
+
+
+def random_encodings(rng, n):
+    """Unit-ish 128-d vectors spread like real dlib encodings"""
+    encodings = rng.normal(size=(n, 128))
+    encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+    return encodings * 0.5
+
+
+def synthetic_image(faces, size, count):
+    """A noisy frame with count of the given face images in a row across it"""
+    width, height = size
+    rng = np.random.default_rng(count)
+    frame = rng.integers(60, 120, size=(height, width, 3), dtype=np.uint8)
+    cell = width // count
+    for i in range(count):
+        face = faces[i % len(faces)]
+        scale = min((cell * 0.9) / face.shape[1], (height * 0.8) / face.shape[0])
+        face = cv2.resize(face, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        fh, fw = face.shape[:2]
+        x = i * cell + (cell - fw) // 2
+        y = (height - fh) // 2
+        frame[y:y + fh, x:x + fw] = face
+    return frame
+
+
+def percentiles(seconds):
+    """Latency summary of a list of request durations"""
+    ms = np.asarray(seconds) * 1000
+    return {
+        "requests": len(ms),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def rss_mb(pid="self"):
+    """Current and peak resident set size of a process, in MB"""
+    values = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                values[line.split(':')[0]] = int(line.split()[1]) / 1024
+    return values.get('VmRSS', 0.0), values.get('VmHWM', 0.0)
+
+
+def process_tree_rss_mb(pid):
+    """Resident set size of a process and its children (gunicorn master and workers)"""
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    return sum(rss_mb(p)[0] for p in pids)
+
+
+def bench_stages(server, jpegs, repeat):
+    results = {}
+    for label, jpeg in jpegs.items():
+        timings = {}
+        for _ in range(repeat):
+            start = time.perf_counter()
+            image = server.inference.decode_image(jpeg)
+            decode_ms = (time.perf_counter() - start) * 1000
+            scans = server.inference.scan_images([image], server.detect_options(), [decode_ms])
+            start = time.perf_counter()
+            result = server.identify_scans(scans)[0]
+            match_ms = (time.perf_counter() - start) * 1000
+            for stage, ms in dict(scans[0].timings, match=match_ms).items():
+                timings.setdefault(stage, []).append(ms)
+        results[label] = {
+            "faces_found": result["face_count"],
+            **{f"{stage}_ms": float(np.median(ms)) for stage, ms in timings.items()},
+            "total_ms": float(np.median([sum(run) for run in zip(*timings.values())])),
+        }
+    return results
+
+
+def bench_match(server, rng, sizes, repeat):
+    results = {}
+    for size in sizes:
+        encodings = random_encodings(rng, size)
+        server.gallery.replace([f"person_{i}" for i in range(size)], encodings)
+        server.matcher.rebuild(server.gallery.snapshot())
+        known = server.gallery.snapshot()
+        for count in MATCH_PROBE_COUNTS:
+            # Half the probes are noisy copies of enrolled faces
+            probes = random_encodings(rng, count)
+            probes[::2] = encodings[:count:2] + rng.normal(scale=0.02, size=(len(probes[::2]), 128))
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                server.match_known_faces(known, probes)
+                timings.append(time.perf_counter() - start)
+            results[f"gallery_{size}_probes_{count}"] = {
+                "gallery": size, "probes": count, **percentiles(timings)
+            }
+    return results
+
+
+def drive_client(client, bodies, requests):
+    """Run requests through the Flask test client; returns (latencies, seconds)"""
+    latencies = []
+    start = time.perf_counter()
+    for i in range(requests):
+        method, path, body = bodies[i % len(bodies)]
+        began = time.perf_counter()
+        if method == 'POST':
+            response = client.post(path, data=body, content_type='image/jpeg')
+        else:
+            response = client.get(path)
+        latencies.append(time.perf_counter() - began)
+        assert response.status_code == 200, response.get_json()
+    return latencies, time.perf_counter() - start
+
+
+def drive_http(port, bodies, requests, concurrency):
+    """Run requests against a server with keep-alive clients; returns (latencies, seconds)"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(worker):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        mine = []
+        for i in range(worker, requests, concurrency):
+            method, path, body = bodies[i % len(bodies)]
+            began = time.perf_counter()
+            headers = {'Content-Type': 'image/jpeg'} if body is not None else {}
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            mine.append(time.perf_counter() - began)
+            if response.status != 200:
+                errors.append(response.status)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(w,)) for w in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise RuntimeError(f"{len(errors)} requests failed, e.g. HTTP {errors[0]}")
+    return latencies, elapsed
+
+
+def endpoint_report(latencies, seconds):
+    return {**percentiles(latencies), "requests_per_s": len(latencies) / seconds}
+
+
+def bench_test_client(server, bodies, requests):
+    client = server.app.test_client()
+    rss_before, _ = rss_mb()
+    results = {}
+    latencies, seconds = drive_client(client, bodies["identify"], requests)
+    results["identify"] = endpoint_report(latencies, seconds)
+    # Let the result log catch up so /api/results reads a full history
+    while server.result_log.queued():
+        time.sleep(0.05)
+    latencies, seconds = drive_client(client, bodies["results"], requests)
+    results["results"] = endpoint_report(latencies, seconds)
+    rss_after, peak = rss_mb()
+    results["memory"] = {"rss_before_mb": rss_before, "rss_after_mb": rss_after,
+                         "rss_growth_mb": rss_after - rss_before, "peak_rss_mb": peak}
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def bench_gunicorn(bodies, requests, concurrency, workers, tmp_dir):
+    if importlib.util.find_spec("gunicorn") is None:
+        return {"skipped": "gunicorn is not installed"}
+
+    port = free_port()
+    env = dict(os.environ,
+               FACE_RESULT_DB=os.path.join(tmp_dir, "gunicorn-results.db"),
+               FACE_GALLERY_DIR=os.path.join(tmp_dir, "gunicorn-gallery"))
+    cmd = [sys.executable, '-m', 'gunicorn', 'server:app', '--worker-class', 'gthread',
+           '--threads', '8', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+           '--graceful-timeout', '5']
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 120
+        while True:
+            if proc.poll() is not None:
+                return {"skipped": f"gunicorn exited with {proc.returncode}"}
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                conn.request('GET', '/health')
+                if conn.getresponse().status == 200:
+                    break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+            time.sleep(0.5)
+
+        rss_before = process_tree_rss_mb(proc.pid)
+        results = {"workers": workers, "concurrency": concurrency}
+        latencies, seconds = drive_http(port, bodies["identify"], requests, concurrency)
+        results["identify"] = endpoint_report(latencies, seconds)
+        latencies, seconds = drive_http(port, bodies["results"], requests, concurrency)
+        results["results"] = endpoint_report(latencies, seconds)
+        rss_after = process_tree_rss_mb(proc.pid)
+        results["memory"] = {"rss_before_mb": rss_before, "rss_after_mb": rss_after,
+                             "rss_growth_mb": rss_after - rss_before}
+        return results
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def flatten(report, prefix=""):
+    """Numeric leaves of a report as {"a.b.c": value}"""
+    values = {}
+    for key, value in report.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+def compare(report, baseline, threshold):
+    """Print every metric of report next to the baseline's, flagging regressions"""
+    current, before = flatten(report), flatten(baseline)
+    print(f"{'metric':<60} {'baseline':>10} {'current':>10} {'change':>8}")
+    for key in sorted(current.keys() & before.keys()):
+        old, new = before[key], current[key]
+        if not key.endswith(("_ms", "_mb", "_per_s")) or old == 0:
+            continue
+        change = new / old - 1
+        # Latency and memory should go down, throughput up
+        worse = change < -threshold if key.endswith("_per_s") else change > threshold
+        flag = "  REGRESSION" if worse else ""
+        print(f"{key:<60} {old:>10.2f} {new:>10.2f} {change:>+7.0%}{flag}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--output', default=None, help="report path (default: bench-<timestamp>.json)")
+    parser.add_argument('--compare', default=None, help="earlier report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative change flagged as a regression")
+    parser.add_argument('--gallery', type=int, default=1000, help="random encodings added to the known faces")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn workers")
+    parser.add_argument('--no-gunicorn', action='store_true')
+    parser.add_argument('--quick', action='store_true', help="fewer sizes and requests, for a smoke run")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output or f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    match_sizes = MATCH_GALLERY_SIZES
+    if args.quick:
+        args.repeat, args.requests = 2, 20
+        match_sizes = MATCH_GALLERY_SIZES[:2]
+
+    os.chdir(ROOT)
+    tmp_dir = tempfile.mkdtemp()
+    os.environ["FACE_INFERENCE_WORKERS"] = "0"
+    os.environ["FACE_SHARED_GALLERY"] = "0"
+    os.environ["FACE_PROBE_CACHE_SIZE"] = "0"
+    # Keep the benchmark's results out of the real result log
+    os.environ["FACE_RESULT_DB"] = os.path.join(tmp_dir, "results.db")
+    import server
+
+    rng = np.random.default_rng(0)
+    face_files = server.encoding_store.list_face_images(server.KNOWN_FACES_DIR)
+    faces = [cv2.imread(os.path.join(server.KNOWN_FACES_DIR, f)) for f in face_files]
+    jpegs = {
+        f"{resolution}_{count}_faces": cv2.imencode(
+            '.jpg', synthetic_image(faces, size, count), [cv2.IMWRITE_JPEG_QUALITY, 90]
+        )[1].tobytes()
+        for resolution, size in RESOLUTIONS.items() for count in FACE_COUNTS
+    }
+    bodies = {
+        "identify": [('POST', '/identify', jpeg) for jpeg in jpegs.values()],
+        "results": [('GET', '/api/results?limit=20', None),
+                    ('GET', '/api/results?limit=20&name=Unknown', None)],
+    }
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "commit": git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+        },
+        "options": {
+            "gallery": args.gallery, "repeat": args.repeat, "requests": args.requests,
+            "concurrency": args.concurrency, "workers": args.workers,
+            "matcher": server.MATCHER, "match_strategy": server.MATCH_STRATEGY,
+            "detection_model": server.DETECTION_MODEL,
+        },
+    }
+
+    known = server.gallery.snapshot()
+    names = [known.names[i] for i in range(known.count) if known.active[i]]
+    encodings = known.encodings[:known.count][known.active[:known.count]].copy()
+
+    print("Timing match scaling...")
+    report["match"] = bench_match(server, rng, match_sizes, args.repeat * 4)
+
+    # Known faces plus random identities for the pipeline and endpoint runs
+    server.gallery.replace(names + [f"person_{i}" for i in range(args.gallery)],
+                           np.vstack([encodings, random_encodings(rng, args.gallery)]))
+    server.matcher.rebuild(server.gallery.snapshot())
+
+    print("Timing identify_image() stages...")
+    report["stages"] = bench_stages(server, jpegs, args.repeat)
+    print("Timing endpoints through the test client...")
+    report["test_client"] = bench_test_client(server, bodies, args.requests)
+    if not args.no_gunicorn:
+        print("Timing endpoints through gunicorn...")
+        report["gunicorn"] = bench_gunicorn(bodies, args.requests, args.concurrency, args.workers, tmp_dir)
+    server.result_log.close()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+    if baseline:
+        with open(baseline) as f:
+            compare(report, json.load(f), args.threshold)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark /identify upload formats: JSON base64 vs raw image/jpeg vs multipart.
+
+Each (resolution, format) pair runs in its own subprocess so peak RSS
+(VmHWM) is attributable to it. By default face detection is skipped so
+the numbers isolate body parsing and decoding; pass --full to time the whole
+pipeline.
+
+Usage: python benchmarks/bench_upload.py [--requests N] [--full]
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESOLUTIONS = {"1080p": (1920, 1080), "4K": (3840, 2160)}
+FORMATS = ("json", "raw", "multipart")
+
+
+def synthetic_jpeg(width, height):
+    """A camera-like frame: smooth gradients plus sensor noise"""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.dstack([x + 0 * y, y + 0 * x, (x + y) / 2])
+    frame += rng.normal(scale=12, size=frame.shape)
+    ok, jpeg = cv2.imencode('.jpg', np.clip(frame, 0, 255).astype(np.uint8),
+                            [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return jpeg.tobytes()
+
+
+def peak_rss_mb():
+    """High-water RSS of this process; unlike ru_maxrss it isn't inherited over exec"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def worker(resolution, fmt, jpeg_path, requests, full):
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    if not full:
+        # In-process inference, so the detection-free analyze below is used
+        os.environ["FACE_INFERENCE_WORKERS"] = "0"
+    # Keep the benchmark's results out of the real result log
+    os.environ["FACE_RESULT_DB"] = os.path.join(os.path.dirname(jpeg_path), f"results-{resolution}-{fmt}.db")
+    import server
+
+    if not full:
+        def analyze_without_detection(img_bytes, options=None, keep_jpeg=False, thumbnail=None):
+            image = server.inference.decode_image(img_bytes)
+            return server.inference.empty_scan()._replace(shape=None if image is None else image.shape)
+        server.inference.analyze = analyze_without_detection
+
+    with open(jpeg_path, 'rb') as f:
+        jpeg = f.read()
+    client = server.app.test_client()
+    body_b64 = base64.b64encode(jpeg).decode('utf-8') if fmt == "json" else None
+    rss_before = peak_rss_mb()
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        if fmt == "json":
+            response = client.post('/identify', json={"image": body_b64})
+        elif fmt == "raw":
+            response = client.post('/identify', data=jpeg, content_type='image/jpeg')
+        else:
+            response = client.post('/identify', data={"image": (io.BytesIO(jpeg), "frame.jpg")},
+                                   content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_json()
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        "resolution": resolution,
+        "format": fmt,
+        "jpeg_bytes": len(jpeg),
+        "requests_per_s": requests / elapsed,
+        "ms_per_request": elapsed * 1000 / requests,
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_growth_mb": peak_rss_mb() - rss_before,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=30)
+    parser.add_argument('--full', action='store_true', help="include face detection and encoding")
+    parser.add_argument('--worker', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(*args.worker, args.requests, args.full)
+        return
+
+    # Frames are generated here so the workers' peak RSS only reflects serving
+    tmp_dir = tempfile.mkdtemp()
+    jpeg_paths = {}
+    for resolution, size in RESOLUTIONS.items():
+        jpeg_paths[resolution] = os.path.join(tmp_dir, f"{resolution}.jpg")
+        with open(jpeg_paths[resolution], 'wb') as f:
+            f.write(synthetic_jpeg(*size))
+
+    print(f"{'res':>6} {'format':>10} {'KB':>7} {'req/s':>8} {'ms/req':>8} {'peak MB':>8} {'growth MB':>10}")
+    for resolution in RESOLUTIONS:
+        for fmt in FORMATS:
+            cmd = [sys.executable, __file__, '--worker', resolution, fmt, jpeg_paths[resolution],
+                   '--requests', str(args.requests)]
+            if args.full:
+                cmd.append('--full')
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            r = json.loads(out.strip().splitlines()[-1])
+            print(f"{resolution:>6} {fmt:>10} {r['jpeg_bytes'] / 1024:>7.0f} {r['requests_per_s']:>8.1f} "
+                  f"{r['ms_per_request']:>8.2f} {r['peak_rss_mb']:>8.1f} {r['rss_growth_mb']:>10.1f}")
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+"""
+Bulk enrollment of a directory or archive of face photos.
+
+``python bulk_import.py SOURCE`` imports every image under SOURCE (a
+directory, .zip or .tar[.gz] archive) into the known faces directory. People
+are named as in known_faces/: ``<name>.jpg`` at the top level, or any image
+below a ``<name>/`` directory. In an archive made by zipping a folder, the
+top-level directory named like the archive (``faces.zip`` -> ``faces/``) is
+skipped.
+
+Images are decoded and encoded across a process pool, a chunk at a time. An
+image is rejected, and listed in the report with the reason, when it can't
+be decoded, holds no face or several, has an invalid person name, or its
+encoding is within ``dedupe_distance`` of a face already enrolled (earlier in
+the import or before it). Accepted images are written to the faces
+directory and journaled in its encoding cache, so the server picks them up
+on its next start without encoding them again. POST /faces/import runs the
+same import inside the server and enrolls the faces live.
+
+Every image's outcome is appended to ``.encodings/imports/<id>.jsonl``, where
+the id is derived from the source (a directory's path, an archive's
+contents). Running the same import again after an interruption skips the
+images already recorded there; failed images are not recorded and are
+retried. The final report is written next to it as ``<id>.report.json``; an
+import that fails part way gets a report with its error instead, and
+running it again resumes it.
+"""
+import argparse
+import hashlib
+import json
+import os
+import tarfile
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+
+import numpy as np
+
+import encoding_store
+import inference
+from gallery import Gallery, match
+
+IMPORTS_DIRNAME = "imports"
+# Encodings this close to an enrolled face are taken to be the same photo
+DEDUPE_DISTANCE = 0.1
+CHUNK_IMAGES = 32
+PROGRESS_SECONDS = 5.0
+
+
+class ImportSource:
+    """
+    The images of a directory or archive, keyed by their relative path.
+
+    ``filename`` is the archive's original name when path is a copy of it.
+    """
+
+    def __init__(self, path, filename=None):
+        self.path = path
+        self._archive = None
+        self._root = ""
+        if os.path.isdir(path):
+            paths = [
+                os.path.relpath(os.path.join(directory, filename), path).replace(os.sep, '/')
+                for directory, _, filenames in os.walk(path) for filename in filenames
+            ]
+        elif zipfile.is_zipfile(path):
+            self._archive = zipfile.ZipFile(path)
+            paths = [info.filename for info in self._archive.infolist() if not info.is_dir()]
+        elif tarfile.is_tarfile(path):
+            self._archive = tarfile.open(path)
+            self._members = {member.name: member for member in self._archive.getmembers() if member.isfile()}
+            paths = list(self._members)
+        else:
+            raise ValueError(f"Not a directory, zip or tar archive: {path}")
+
+        self.images = sorted(
+            p for p in paths
+            if p.lower().endswith(encoding_store.IMAGE_EXTENSIONS)
+            and not any(part.startswith('.') for part in p.split('/'))
+        )
+        if self._archive is not None:
+            stem = os.path.basename(filename or path).split('.')[0]
+            if self.images and all(p.startswith(stem + '/') for p in self.images):
+                self._root = stem + '/'
+
+    def name_for(self, image):
+        """The person an image belongs to"""
+        top, _, rest = image[len(self._root):].partition('/')
+        return top if rest else os.path.splitext(top)[0]
+
+    def read(self, image):
+        if self._archive is None:
+            with open(os.path.join(self.path, image), 'rb') as f:
+                return f.read()
+        if isinstance(self._archive, zipfile.ZipFile):
+            return self._archive.read(image)
+        return self._archive.extractfile(self._members[image]).read()
+
+    def import_id(self):
+        """Same id for the same directory, or for an archive with the same contents"""
+        digest = hashlib.sha1()
+        if self._archive is None:
+            digest.update(os.path.abspath(self.path).encode('utf-8'))
+        else:
+            with open(self.path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+        return digest.hexdigest()[:16]
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
+
+
+def import_paths(faces_dir, import_id):
+    """Return (progress, report) file paths of an import"""
+    base = os.path.join(faces_dir, encoding_store.STORE_DIRNAME, IMPORTS_DIRNAME, import_id)
+    return base + ".jsonl", base + ".report.json"
+
+
+def begin_import(faces_dir, import_id):
+    """Mark an import as running, dropping an earlier report; returns import_paths()"""
+    progress_path, report_path = import_paths(faces_dir, import_id)
+    os.makedirs(os.path.dirname(progress_path), exist_ok=True)
+    open(progress_path, 'a').close()
+    if os.path.exists(report_path):
+        os.remove(report_path)
+    return progress_path, report_path
+
+
+def read_progress(path):
+    """Return (image count, {image: record}) from a progress file"""
+    images = 0
+    done = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-append
+                    break
+                if "image" in record:
+                    done[record["image"]] = record
+                else:
+                    images = record.get("images", images)
+    except OSError:
+        pass
+    return images, done
+
+
+def write_report(report_path, report):
+    """Replace an import's report atomically"""
+    tmp_path = report_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, report_path)
+
+
+def import_status(faces_dir, import_id):
+    """Progress or final report of an import, or None if there is none"""
+    progress_path, report_path = import_paths(faces_dir, import_id)
+    try:
+        with open(report_path) as f:
+            report = json.load(f)
+        # "done" or "failed"
+        return {"state": report.get("status", "done"), "report": report}
+    except OSError:
+        pass
+    if not os.path.exists(progress_path):
+        return None
+    images, done = read_progress(progress_path)
+    outcomes = Counter(record["outcome"] for record in done.values())
+    return {
+        "state": "running",
+        "images": images,
+        "processed": len(done),
+        "enrolled": outcomes.pop("enrolled", 0),
+        "rejected": dict(outcomes),
+        "updated": datetime.fromtimestamp(os.path.getmtime(progress_path)).isoformat(),
+    }
+
+
+class BulkImporter:
+    """
+    Imports ImportSources into a faces directory.
+
+    ``scan_images(buffers)`` returns a Scan (as from ``inference.analyze``
+    with keep_jpeg) or an exception per buffer. Files and the encoding cache
+    are written while holding ``lock``; ``on_enroll(items)`` is called under
+    it with the (filename, name, encoding) of each chunk's enrolled images.
+    """
+
+    def __init__(self, faces_dir, scan_images, dedupe_distance=DEDUPE_DISTANCE, lock=None,
+                 on_enroll=None, chunk_size=CHUNK_IMAGES):
+        self.faces_dir = faces_dir
+        self.scan_images = scan_images
+        self.dedupe_distance = dedupe_distance
+        self.lock = lock or nullcontext()
+        self.on_enroll = on_enroll
+        self.chunk_size = chunk_size
+
+    def run(self, source):
+        """
+        Import every image of source not imported before; returns the report.
+
+        If the import raises, a report with status "failed" and the error is
+        written before the exception propagates, so it doesn't look like it
+        is still running.
+        """
+        import_id = source.import_id()
+        try:
+            return self._run(source, import_id)
+        except Exception as e:
+            progress_path, report_path = import_paths(self.faces_dir, import_id)
+            _, done = read_progress(progress_path)
+            write_report(report_path, {
+                "import_id": import_id,
+                "source": source.path,
+                "status": "failed",
+                "error": str(e) or type(e).__name__,
+                "images": len(source.images),
+                "processed": len(done),
+            })
+            raise
+
+    def _run(self, source, import_id):
+        start = time.perf_counter()
+        progress_path, report_path = begin_import(self.faces_dir, import_id)
+        _, done = read_progress(progress_path)
+        resumed = len(done)
+        pending = [image for image in source.images if image not in done]
+        if resumed:
+            print(f"Resuming import {import_id}: {resumed} of {len(source.images)} images already done")
+
+        store = encoding_store.EncodingStore(self.faces_dir)
+        self._load_known(store)
+        failed = []
+        last_report = time.perf_counter()
+        with open(progress_path, 'a') as progress:
+            progress.write(json.dumps({"images": len(source.images), "started": datetime.now().isoformat()}) + "\n")
+            for offset in range(0, len(pending), self.chunk_size):
+                chunk = pending[offset:offset + self.chunk_size]
+                records = self._import_chunk(source, chunk, store)
+                failed.extend(r for r in records if r["outcome"] == "error")
+                # Failures are left out so that a rerun retries them
+                progress.write("".join(json.dumps(r) + "\n" for r in records if r["outcome"] != "error"))
+                progress.flush()
+                os.fsync(progress.fileno())
+                done.update((r["image"], r) for r in records if r["outcome"] != "error")
+
+                if time.perf_counter() - last_report >= PROGRESS_SECONDS or offset + len(chunk) == len(pending):
+                    last_report = time.perf_counter()
+                    rate = (offset + len(chunk)) / (last_report - start)
+                    enrolled = sum(1 for r in done.values() if r["outcome"] == "enrolled")
+                    print(f"Import {import_id}: {len(done) + len(failed)}/{len(source.images)} images, "
+                          f"{enrolled} enrolled, {rate:.1f} images/s")
+
+        records = list(done.values()) + failed
+        outcomes = Counter(r["outcome"] for r in records)
+        report = {
+            "import_id": import_id,
+            "source": source.path,
+            "status": "done",
+            "images": len(source.images),
+            "enrolled": outcomes.pop("enrolled", 0),
+            "rejected": dict(outcomes),
+            "resumed": resumed,
+            "seconds": round(time.perf_counter() - start, 2),
+            "rejections": sorted((r for r in records if r["outcome"] != "enrolled"), key=lambda r: r["image"]),
+        }
+        write_report(report_path, report)
+        return report
+
+    def _load_known(self, store):
+        """Index the faces already enrolled, for dedupe"""
+        entries, matrix = store.load()
+        enrolled = sorted((e["row"], filename, e["name"]) for filename, e in entries.items() if e["row"] >= 0)
+        self._known = Gallery()
+        self._known.replace([name for _, _, name in enrolled], np.asarray(matrix)[[row for row, _, _ in enrolled]])
+        # Row i of the gallery was enrolled from self._files[i]
+        self._files = [filename for _, filename, _ in enrolled]
+        self._taken = set(encoding_store.list_face_images(self.faces_dir))
+
+    def _import_chunk(self, source, chunk, store):
+        records = [{"image": image, "name": source.name_for(image)} for image in chunk]
+        for record in records:
+            if not encoding_store.is_valid_name(record["name"]):
+                record["outcome"] = "invalid_name"
+        to_scan = [r for r in records if "outcome" not in r]
+        scans = self.scan_images([source.read(r["image"]) for r in to_scan]) if to_scan else []
+
+        enrolled = []
+        with self.lock:
+            for record, scan in zip(to_scan, scans):
+                if isinstance(scan, Exception):
+                    record.update(outcome="error", error=str(scan))
+                elif scan.shape is None:
+                    record["outcome"] = "undecodable"
+                elif len(scan.encodings) != 1:
+                    record["outcome"] = "no_face" if not scan.encodings else "multiple_faces"
+                else:
+                    encoding = scan.encodings[0]
+                    indices, _ = match(self._known.snapshot(), [encoding], tolerance=self.dedupe_distance)
+                    if indices[0, 0] >= 0:
+                        record.update(outcome="duplicate", duplicate_of=self._files[indices[0, 0]])
+                        continue
+                    filename = self._write_image(record["name"], record["image"], scan.jpeg)
+                    record.update(outcome="enrolled", file=filename)
+                    self._known.add(record["name"], encoding)
+                    self._files.append(filename)
+                    enrolled.append((filename, record["name"], encoding))
+            if enrolled:
+                store.put_many(enrolled)
+                if self.on_enroll:
+                    self.on_enroll(enrolled)
+        return records
+
+    def _write_image(self, name, image, jpeg):
+        """Save an enrolled image as <name>.jpg, or in <name>/ if that is taken"""
+        filename = f"{name}.jpg"
+        if filename in self._taken:
+            stem = os.path.splitext(os.path.basename(image))[0]
+            filename = f"{name}/{stem}.jpg"
+            suffix = 1
+            while filename in self._taken:
+                filename = f"{name}/{stem}_{suffix}.jpg"
+                suffix += 1
+            os.makedirs(os.path.join(self.faces_dir, name), exist_ok=True)
+        with open(os.path.join(self.faces_dir, filename), 'wb') as f:
+            f.write(jpeg)
+        self._taken.add(filename)
+        return filename
+
+
+def pool_scanner(executor, options=inference.DEFAULT_OPTIONS):
+    """scan_images for BulkImporter that runs inference.analyze on executor"""
+    def scan_images(buffers):
+        futures = [executor.submit(inference.analyze, buf, options, True) for buf in buffers]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+    return scan_images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("source", help="directory, .zip or .tar[.gz] of face photos")
+    parser.add_argument("--faces-dir", default="known_faces")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--dedupe-distance", type=float, default=DEDUPE_DISTANCE)
+    args = parser.parse_args()
+
+    source = ImportSource(args.source)
+    print(f"Importing {len(source.images)} images from {args.source} with {args.workers} workers")
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            importer = BulkImporter(args.faces_dir, pool_scanner(executor), args.dedupe_distance,
+                                    chunk_size=args.workers * 4)
+            report = importer.run(source)
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume")
+        return
+    finally:
+        source.close()
+
+    print(f"Enrolled {report['enrolled']} of {report['images']} images in {report['seconds']}s; "
+          f"rejected: {report['rejected'] or 'none'}")
+    print(f"Report: {import_paths(args.faces_dir, report['import_id'])[1]}")
+
+
+if __name__ == '__main__':
+    main()
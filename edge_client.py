@@ -0,0 +1,305 @@
+"""
+Edge client: upload only frames in which something moved, and only their faces.
+
+Posting every whole frame to /identify spends the uplink, and the server's
+detector, on frames in which nothing happened. ``EdgeClient``
+
+* gates frames on motion: a frame goes on only when enough pixels of a small
+  grey copy changed since the last frame that did,
+* finds faces on the device (an OpenCV Haar cascade, or face_recognition's
+  HOG detector) and uploads just the face crops to /identify/crops, or -
+  with face_recognition installed - their 128-d encodings to
+  /identify/encodings, 512 bytes per face; frames without a face are not
+  uploaded at all,
+* sends all faces of a frame in one request, over one kept-alive HTTP/1.1
+  connection, reconnecting and retrying when it drops and honouring
+  Retry-After when the server answers 429 or 503.
+
+Mode "frames" uploads whole (motion-gated) frames to /identify instead.
+Only OpenCV and NumPy are needed, plus face_recognition for the "hog"
+detector and "encodings" mode.
+
+``python edge_client.py SOURCE --server http://host:5000`` runs a camera
+index, video file or stream URL through the client and prints each result.
+"""
+import argparse
+import email.utils
+import http.client
+import json
+import math
+import os
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+
+# How frames are filtered and uploaded:
+# - mode: "frames" (whole frames to /identify), "crops" or "encodings"
+# - detector: on-device face detector for crops/encodings, "haar" or "hog"
+# - motion_threshold: fraction of pixels that must change since the last
+#   uploaded frame (0 uploads every frame)
+# - motion_side: longer side of the grey frame compared for motion
+# - crop_margin: context kept around each face, as a fraction of its size,
+#   so the server's landmark model sees the whole face
+# - jpeg_quality: quality of uploaded frames and crops
+# - min_face: smallest face to detect, in frame pixels
+# - max_side: longer side of the frame the detector runs on
+EdgeOptions = namedtuple("EdgeOptions", [
+    "mode", "detector", "motion_threshold", "motion_side", "crop_margin", "jpeg_quality",
+    "min_face", "max_side",
+])
+DEFAULT_EDGE_OPTIONS = EdgeOptions("crops", "haar", 0.01, 160, 0.25, 85, 40, 640)
+
+# Grey level change that counts a pixel as moved
+MOTION_PIXEL_DELTA = 25
+HAAR_CASCADE = "haarcascade_frontalface_default.xml"
+RETRY_BACKOFF_SECONDS = 0.5
+UPLOAD_PATHS = {"frames": "/identify", "crops": "/identify/crops", "encodings": "/identify/encodings"}
+
+
+def camera_frames(source):
+    """Yield BGR frames from a camera index, video file or stream URL"""
+    capture = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video source {source!r}")
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            yield frame
+    finally:
+        capture.release()
+
+
+class MotionGate:
+    """Passes a frame when it differs enough from the last frame it passed"""
+
+    def __init__(self, threshold, side):
+        self.threshold = threshold
+        self.side = side
+        self._reference = None
+
+    def moved(self, frame):
+        if not self.threshold:
+            return True
+        scale = min(1.0, self.side / max(frame.shape[:2]))
+        gray = cv2.cvtColor(cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA),
+                            cv2.COLOR_BGR2GRAY)
+        # Blur away sensor noise, which would otherwise count as motion
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        if self._reference is not None and self._reference.shape == gray.shape:
+            changed = np.count_nonzero(cv2.absdiff(gray, self._reference) > MOTION_PIXEL_DELTA)
+            if changed <= self.threshold * gray.size:
+                return False
+        self._reference = gray
+        return True
+
+
+class FaceDetector:
+    """Finds faces on the device; boxes are (top, right, bottom, left) frame pixels"""
+
+    def __init__(self, kind="haar", min_face=40, max_side=640):
+        self.kind = kind
+        self.min_face = min_face
+        self.max_side = max_side
+        if kind == "haar":
+            self._cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, HAAR_CASCADE))
+        elif kind == "hog":
+            import face_recognition
+            self._face_recognition = face_recognition
+        else:
+            raise ValueError(f"Unknown detector: {kind}")
+
+    def detect(self, frame):
+        scale = min(1.0, self.max_side / max(frame.shape[:2]))
+        small = frame if scale == 1.0 else cv2.resize(frame, None, fx=scale, fy=scale,
+                                                      interpolation=cv2.INTER_AREA)
+        if self.kind == "haar":
+            side = max(1, int(self.min_face * scale))
+            found = self._cascade.detectMultiScale(
+                cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), scaleFactor=1.1, minNeighbors=5, minSize=(side, side)
+            )
+            boxes = [(y, x + w, y + h, x) for x, y, w, h in found]
+        else:
+            boxes = self._face_recognition.face_locations(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        return [tuple(int(round(v / scale)) for v in box) for box in boxes]
+
+
+def crop_face(frame, box, margin):
+    """Return (crop, box within the crop) of a face with margin around it"""
+    top, right, bottom, left = box
+    pad_y = int((bottom - top) * margin)
+    pad_x = int((right - left) * margin)
+    height, width = frame.shape[:2]
+    y0, x0 = max(0, top - pad_y), max(0, left - pad_x)
+    y1, x1 = min(height, bottom + pad_y), min(width, right + pad_x)
+    return frame[y0:y1, x0:x1], [top - y0, right - x0, bottom - y0, left - x0]
+
+
+def multipart_body(files, fields):
+    """Encode (name, filename, bytes) files and name -> str fields as multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+                     .encode('utf-8'))
+    for name, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                     f'filename="{filename}"\r\nContent-Type: image/jpeg\r\n\r\n'.encode('utf-8'))
+        parts.append(data)
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def retry_after_seconds(value):
+    """Return the wait a Retry-After header asks for (delay seconds or an HTTP-date), or None"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        pass
+    else:
+        return max(0.0, seconds) if math.isfinite(seconds) else None
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class EdgeClient:
+    """Motion-gated, face-only uploads to one server over a kept-alive connection"""
+
+    def __init__(self, server_url, options=DEFAULT_EDGE_OPTIONS, timeout=10.0, max_retries=3):
+        if options.mode not in UPLOAD_PATHS:
+            raise ValueError(f"Unknown mode: {options.mode}")
+        url = urlsplit(server_url)
+        self._connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self._host = url.hostname
+        self._port = url.port
+        self._prefix = url.path.rstrip('/')
+        self.options = options
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.gate = MotionGate(options.motion_threshold, options.motion_side)
+        self.detector = None
+        if options.mode != "frames":
+            self.detector = FaceDetector(options.detector, options.min_face, options.max_side)
+        if options.mode == "encodings":
+            import face_recognition
+            self._face_recognition = face_recognition
+        self._conn = None
+        self.stats = {
+            "frames": 0, "skipped_still": 0, "skipped_no_face": 0, "uploads": 0, "faces": 0,
+            "retries": 0, "upload_bytes": 0, "upload_seconds": 0.0,
+        }
+
+    def process(self, frame):
+        """Upload what the frame calls for; returns the server's response, or None if skipped"""
+        self.stats["frames"] += 1
+        if not self.gate.moved(frame):
+            self.stats["skipped_still"] += 1
+            return None
+
+        options = self.options
+        params = [cv2.IMWRITE_JPEG_QUALITY, options.jpeg_quality]
+        if options.mode == "frames":
+            return self._upload(cv2.imencode('.jpg', frame, params)[1].tobytes(), 'image/jpeg')
+
+        boxes = self.detector.detect(frame)
+        if not boxes:
+            self.stats["skipped_no_face"] += 1
+            return None
+        self.stats["faces"] += len(boxes)
+        if options.mode == "encodings":
+            encodings = self._face_recognition.face_encodings(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), boxes)
+            return self._upload(np.asarray(encodings, dtype='<f4').tobytes(), 'application/octet-stream')
+
+        files = []
+        crop_boxes = []
+        for i, box in enumerate(boxes):
+            crop, crop_box = crop_face(frame, box, options.crop_margin)
+            files.append(("crop", f"face{i}.jpg", cv2.imencode('.jpg', crop, params)[1].tobytes()))
+            crop_boxes.append(crop_box)
+        body, content_type = multipart_body(files, {"boxes": json.dumps(crop_boxes)})
+        return self._upload(body, content_type)
+
+    def _upload(self, body, content_type):
+        start = time.perf_counter()
+        status, response = self.post(UPLOAD_PATHS[self.options.mode], body, content_type)
+        self.stats["uploads"] += 1
+        self.stats["upload_bytes"] += len(body)
+        self.stats["upload_seconds"] += time.perf_counter() - start
+        return dict(response, http_status=status)
+
+    def post(self, path, body, content_type):
+        """POST body, retrying dropped connections and 429/503; returns (status, JSON)"""
+        headers = {"Content-Type": content_type, "Content-Length": str(len(body))}
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self._conn is None:
+                    self._conn = self._connection_class(self._host, self._port, timeout=self.timeout)
+                self._conn.request('POST', self._prefix + path, body=body, headers=headers)
+                response = self._conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                self.close()
+                if attempt == self.max_retries:
+                    raise
+                self.stats["retries"] += 1
+                time.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+                continue
+            if response.will_close:
+                self.close()
+            if response.status in (429, 503) and attempt < self.max_retries:
+                self.stats["retries"] += 1
+                delay = retry_after_seconds(response.getheader('Retry-After'))
+                time.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt if delay is None else delay)
+                continue
+            try:
+                return response.status, json.loads(data)
+            except ValueError:
+                return response.status, {"status": "error", "message": data.decode('utf-8', 'replace')}
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("source", help="camera index, video file or stream URL")
+    parser.add_argument("--server", default="http://localhost:5000")
+    parser.add_argument("--mode", choices=sorted(UPLOAD_PATHS), default=DEFAULT_EDGE_OPTIONS.mode)
+    parser.add_argument("--detector", choices=("haar", "hog"), default=DEFAULT_EDGE_OPTIONS.detector)
+    parser.add_argument("--motion-threshold", type=float, default=DEFAULT_EDGE_OPTIONS.motion_threshold)
+    args = parser.parse_args()
+
+    options = DEFAULT_EDGE_OPTIONS._replace(
+        mode=args.mode, detector=args.detector, motion_threshold=args.motion_threshold
+    )
+    client = EdgeClient(args.server, options)
+    try:
+        for index, frame in enumerate(camera_frames(args.source)):
+            response = client.process(frame)
+            if response is not None:
+                print(f"frame {index}: {response.get('result') or response.get('message')}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+    print(client.stats)
+
+
+if __name__ == '__main__':
+    main()
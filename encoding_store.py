@@ -0,0 +1,250 @@
+"""
+Persistent on-disk cache of face encodings for the known faces directory.
+
+The cache lives in ``<faces_dir>/.encodings/`` and holds three files:
+
+* ``encodings.npy`` - an (N, 128) float64 matrix, opened memory-mapped
+* ``index.json``    - one entry per image file, keyed by its file name and
+  recording its size, mtime and the matrix row holding its encoding
+* ``journal.jsonl`` - puts and deletes recorded since the last full save, so
+  enrolling one face appends a line instead of rewriting the matrix
+
+Only images that are new or whose size/mtime changed are re-encoded, so
+startup cost scales with the number of changed files, not the gallery size.
+The journal is folded into the matrix on the next ``sync()``.
+"""
+import json
+import os
+
+import numpy as np
+
+STORE_DIRNAME = ".encodings"
+MATRIX_FILE = "encodings.npy"
+INDEX_FILE = "index.json"
+JOURNAL_FILE = "journal.jsonl"
+STORE_VERSION = 1
+ENCODING_DIM = 128
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+class EncodingStore:
+    """Reads and atomically writes the encoding cache of one faces directory"""
+
+    def __init__(self, faces_dir):
+        self.faces_dir = faces_dir
+        self.store_dir = os.path.join(faces_dir, STORE_DIRNAME)
+        self.matrix_path = os.path.join(self.store_dir, MATRIX_FILE)
+        self.index_path = os.path.join(self.store_dir, INDEX_FILE)
+        self.journal_path = os.path.join(self.store_dir, JOURNAL_FILE)
+
+    def load(self):
+        """
+        Return (entries, matrix) from disk with the journal applied.
+
+        ``entries`` maps file name -> {"size", "mtime_ns", "name", "row"}
+        (``row`` is -1 for images without a detectable face). ``matrix`` is
+        a read-only memory map unless journaled encodings had to be appended.
+        A missing or corrupt cache yields ({}, empty).
+        """
+        entries, matrix = self._load_saved()
+        journal = self._read_journal()
+        if not journal:
+            return entries, matrix
+
+        extra = []
+        for record in journal:
+            entry = entries.pop(record["file"], None)
+            if record["op"] == "rename":
+                if entry is not None:
+                    entry["name"] = record["name"]
+                    entries[record["to"]] = entry
+                continue
+            if record["op"] != "put":
+                continue
+            entry = {k: record[k] for k in ("size", "mtime_ns", "name")}
+            entry["row"] = -1
+            if record.get("encoding") is not None:
+                entry["row"] = len(matrix) + len(extra)
+                extra.append(record["encoding"])
+            entries[record["file"]] = entry
+        if extra:
+            matrix = np.concatenate([matrix, np.asarray(extra, dtype=np.float64)])
+        return entries, matrix
+
+    def _load_saved(self):
+        empty = np.empty((0, ENCODING_DIM), dtype=np.float64)
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            if index.get("version") != STORE_VERSION:
+                return {}, empty
+            entries = index["entries"]
+            if not any(e["row"] >= 0 for e in entries.values()):
+                return entries, empty
+            matrix = np.load(self.matrix_path, mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            return {}, empty
+
+        if matrix.ndim != 2 or matrix.shape[1] != ENCODING_DIM:
+            return {}, empty
+        if any(e["row"] >= len(matrix) for e in entries.values()):
+            return {}, empty
+        return entries, matrix
+
+    def _read_journal(self):
+        records = []
+        try:
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # A torn final line from a crash mid-append
+                        break
+        except OSError:
+            pass
+        return records
+
+    def put(self, filename, name, encoding):
+        """Journal the encoding of a file that was just written to faces_dir"""
+        self.put_many([(filename, name, encoding)])
+
+    def put_many(self, items):
+        """Journal several (filename, name, encoding) puts with one fsync"""
+        records = []
+        for filename, name, encoding in items:
+            st = os.stat(os.path.join(self.faces_dir, filename))
+            records.append({
+                "op": "put",
+                "file": filename,
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "name": name,
+                "encoding": None if encoding is None else [float(x) for x in encoding],
+            })
+        self._append_journal(*records)
+
+    def delete(self, filename):
+        """Journal the removal of a file from faces_dir"""
+        self._append_journal({"op": "delete", "file": filename})
+
+    def rename(self, filename, new_filename, new_name):
+        """Journal a file in faces_dir being renamed to new_filename"""
+        self._append_journal({"op": "rename", "file": filename, "to": new_filename, "name": new_name})
+
+    def _append_journal(self, *records):
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(self.journal_path, 'a') as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save(self, entries, matrix):
+        """Write entries and matrix, replacing the previous cache atomically"""
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        tmp_matrix = self.matrix_path + ".tmp.npy"
+        np.save(tmp_matrix, np.ascontiguousarray(matrix, dtype=np.float64))
+        os.replace(tmp_matrix, self.matrix_path)
+
+        tmp_index = self.index_path + ".tmp"
+        with open(tmp_index, 'w') as f:
+            json.dump({"version": STORE_VERSION, "entries": entries}, f)
+        os.replace(tmp_index, self.index_path)
+
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+
+def list_face_images(faces_dir):
+    """
+    Return the sorted image paths in faces_dir, relative to it.
+
+    A person's images are either ``<name>.jpg`` at the top level or any
+    number of files inside a ``<name>/`` subdirectory.
+    """
+    filenames = []
+    for entry in os.listdir(faces_dir):
+        path = os.path.join(faces_dir, entry)
+        if entry.startswith('.'):
+            continue
+        if os.path.isdir(path):
+            filenames.extend(
+                f"{entry}/{filename}" for filename in os.listdir(path)
+                if filename.lower().endswith(IMAGE_EXTENSIONS)
+                and os.path.isfile(os.path.join(path, filename))
+            )
+        elif entry.lower().endswith(IMAGE_EXTENSIONS):
+            filenames.append(entry)
+    return sorted(filenames)
+
+
+def is_valid_name(name):
+    """Names become file names in faces_dir, so keep them to one plain path component"""
+    return bool(name) and not name.startswith('.') and os.path.basename(name) == name and '\\' not in name
+
+
+def name_for_file(filename):
+    """Return the person a relative image path belongs to"""
+    directory, basename = os.path.split(filename)
+    return directory or os.path.splitext(basename)[0]
+
+
+def sync(faces_dir, encode_file):
+    """
+    Bring the encoding cache of faces_dir up to date.
+
+    ``encode_file(path)`` must return a 128-d encoding or None when the image
+    has no face; it is only called for new or changed files. Returns
+    (names, matrix, stats) where ``matrix`` row i belongs to ``names[i]`` and
+    ``stats`` counts "reused", "encoded" and "removed" files.
+    """
+    store = EncodingStore(faces_dir)
+    cached, cached_matrix = store.load()
+    journaled = os.path.exists(store.journal_path)
+
+    entries = {}
+    rows = []
+    stats = {"reused": 0, "encoded": 0, "removed": 0}
+    changed = False
+
+    for filename in list_face_images(faces_dir):
+        st = os.stat(os.path.join(faces_dir, filename))
+        old = cached.get(filename)
+
+        if old is not None and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+            encoding = cached_matrix[old["row"]] if old["row"] >= 0 else None
+            stats["reused"] += 1
+        else:
+            encoding = encode_file(os.path.join(faces_dir, filename))
+            stats["encoded"] += 1
+            changed = True
+
+        entry = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "name": name_for_file(filename),
+            "row": -1,
+        }
+        if encoding is not None:
+            entry["row"] = len(rows)
+            rows.append(encoding)
+        entries[filename] = entry
+
+    stats["removed"] = len(set(cached) - set(entries))
+    changed = changed or stats["removed"] > 0 or journaled
+
+    if changed:
+        if rows:
+            matrix = np.stack([np.asarray(r, dtype=np.float64) for r in rows])
+        else:
+            matrix = np.empty((0, ENCODING_DIM), dtype=np.float64)
+        store.save(entries, matrix)
+        _, matrix = store.load()
+    else:
+        # Same files in the same sorted order with no journal, so the
+        # cached rows line up
+        matrix = cached_matrix
+
+    names = [e["name"] for e in sorted(entries.values(), key=lambda e: e["row"]) if e["row"] >= 0]
+    return names, matrix, stats
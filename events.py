@@ -0,0 +1,110 @@
+"""
+Fan-out of live dashboard events to Server-Sent Events clients.
+
+``EventBroker.publish()`` serialises an event once and appends it to every
+subscriber's buffer. Buffers are bounded: a client that falls behind loses
+its oldest events and is told to resynchronise from a fresh snapshot instead
+of growing memory without limit. The broker also keeps a short history so a
+client reconnecting with ``Last-Event-ID`` gets exactly the events it missed.
+
+Each gunicorn worker process has its own broker, so a dashboard sees the
+events of the worker its stream is connected to.
+"""
+import json
+import threading
+from collections import deque
+
+HISTORY_SIZE = 64
+
+
+def format_event(event_type, data, event_id=None):
+    """Encode one event in the text/event-stream wire format"""
+    payload = json.dumps(data, separators=(',', ':'))
+    id_line = "" if event_id is None else f"id: {event_id}\n"
+    return f"{id_line}event: {event_type}\ndata: {payload}\n\n"
+
+
+class Subscription:
+    """One client's bounded queue of encoded events"""
+
+    def __init__(self, max_pending):
+        self._events = deque(maxlen=max_pending)
+        self._cond = threading.Condition()
+        self.dropped = 0
+        self._resync = False
+
+    def push(self, message):
+        with self._cond:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+                self._resync = True
+            self._events.append(message)
+            self._cond.notify()
+
+    def drain(self, timeout):
+        """
+        Wait up to timeout seconds and return (messages, resync).
+
+        ``resync`` is True when events were dropped since the last drain;
+        the pending messages are then discarded as well.
+        """
+        with self._cond:
+            if not self._events:
+                self._cond.wait(timeout)
+            messages = list(self._events)
+            self._events.clear()
+            resync, self._resync = self._resync, False
+        return ([] if resync else messages), resync
+
+
+class EventBroker:
+    """Publishes events to every subscribed client"""
+
+    def __init__(self, max_pending=32, max_clients=16):
+        self.max_pending = max_pending
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._next_id = 1
+        self._dropped = 0
+
+    def publish(self, event_type, data):
+        with self._lock:
+            event_id = self._next_id
+            self._next_id += 1
+            message = format_event(event_type, data, event_id)
+            self._history.append((event_id, message))
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(message)
+        return event_id
+
+    def subscribe(self, last_event_id=None):
+        """
+        Register a client; returns (subscription, missed) or None when full.
+
+        ``missed`` lists the encoded events after last_event_id, or is None
+        if the client must start from a snapshot.
+        """
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            subscription = Subscription(self.max_pending)
+            self._subscribers.add(subscription)
+            missed = None
+            if last_event_id is not None and self._history and last_event_id >= self._history[0][0] - 1:
+                missed = [message for event_id, message in self._history if event_id > last_event_id]
+            return subscription, missed
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            self._dropped += subscription.dropped
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._subscribers),
+                "dropped": self._dropped + sum(s.dropped for s in self._subscribers),
+            }
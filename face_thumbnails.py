@@ -0,0 +1,88 @@
+"""
+Cached listing of known people with a small thumbnail each, for the dashboard.
+
+The listing is rebuilt only when the gallery version changes. Thumbnails are
+cached per image file (keyed by its size and mtime), so a rebuild after one
+enrollment only reads and shrinks the new image. Each listing carries an
+ETag derived from the files it shows, so clients polling an unchanged gallery
+can be answered 304 - also by another worker process with a different
+gallery version but the same faces.
+"""
+import base64
+import hashlib
+import os
+import threading
+
+import cv2
+
+import encoding_store
+
+THUMBNAIL_SIDE = 160
+THUMBNAIL_QUALITY = 80
+
+
+def make_face_thumbnail(path, max_side=THUMBNAIL_SIDE, quality=THUMBNAIL_QUALITY):
+    """Return a data URI of a small JPEG of the image at path, or None"""
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    scale = min(1.0, max_side / max(image.shape[:2]))
+    if scale < 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1]
+    return "data:image/jpeg;base64," + base64.b64encode(jpeg.tobytes()).decode('ascii')
+
+
+class KnownFaceThumbnails:
+    """Known-faces listing, rebuilt when the gallery version changes"""
+
+    def __init__(self, faces_dir):
+        self.faces_dir = faces_dir
+        self._lock = threading.Lock()
+        # filename -> (size, mtime_ns, data URI)
+        self._thumbnails = {}
+        self._version = None
+        self._listing = []
+        self._etag = None
+
+    def listing(self, names, version):
+        """Return (faces, etag) for the people in names at gallery version"""
+        with self._lock:
+            if version != self._version:
+                self._rebuild(names)
+                self._version = version
+            return self._listing, self._etag
+
+    def _rebuild(self, names):
+        # First image of each person; {name}.jpg sorts before {name}/...
+        first_files = {}
+        for filename in encoding_store.list_face_images(self.faces_dir):
+            first_files.setdefault(encoding_store.name_for_file(filename), filename)
+
+        listing = []
+        thumbnails = {}
+        digest = hashlib.sha1()
+        for name in names:
+            filename = first_files.get(name)
+            if filename is None:
+                continue
+            path = os.path.join(self.faces_dir, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            cached = self._thumbnails.get(filename)
+            if cached is not None and cached[:2] == (st.st_size, st.st_mtime_ns):
+                image = cached[2]
+            else:
+                image = make_face_thumbnail(path)
+                if image is None:
+                    continue
+            thumbnails[filename] = (st.st_size, st.st_mtime_ns, image)
+            listing.append({"name": name, "image": image})
+            digest.update(f"{name}\0{filename}\0{st.st_size}\0{st.st_mtime_ns}\n".encode('utf-8'))
+
+        # Dropping entries for files no longer listed bounds the cache
+        self._thumbnails = thumbnails
+        self._listing = listing
+        self._etag = digest.hexdigest()[:20]
@@ -0,0 +1,379 @@
+"""
+In-memory gallery of known face encodings with incremental updates.
+
+Readers take a ``GallerySnapshot`` once per request and match against it
+without locking. Writers serialise on a lock and never mutate anything a
+published snapshot can observe, except for two single-element writes that
+are atomic from a reader's point of view:
+
+* appending a row past the end of every published snapshot, and
+* clearing a row's ``active`` flag and setting its squared norm to inf (a
+  deleted row simply stops matching).
+
+Enrollment therefore costs O(1) amortised, while deletes leave tombstones
+that are compacted away once they outnumber the live rows.
+
+Encodings are held as one contiguous (N, 128) float32 matrix together with
+their precomputed squared norms, so ``match()`` can compare every probe face
+of an image against the whole gallery with a single matrix product.
+
+A person may have several encodings (samples). Alongside the rows the
+gallery keeps, per person, the list of their rows and the centroid of their
+live samples. Centroids are updated in place on enrollment; a reader may see
+a row mid-update, which is harmless because centroids only shortlist people
+for ``match_centroids()``, and final distances always come from the samples.
+"""
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+ENCODING_DIM = 128
+INITIAL_CAPACITY = 64
+
+GallerySnapshot = namedtuple("GallerySnapshot", [
+    "names", "encodings", "sq_norms", "active", "count", "generation",
+    "person_ids", "person_names", "person_rows", "centroids", "centroid_sq_norms",
+    "person_count", "max_samples", "version",
+])
+
+
+class Gallery:
+    """Known faces: one encoding row per enrolled image, grouped by person name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = 0
+        # Bumped on every published change, unlike the generation
+        self._version = 0
+        # Set while applying a change another process already wrote to the
+        # (shared) arrays: only the Python-side bookkeeping is updated
+        self._replaying = False
+        self._reset([], np.empty((0, ENCODING_DIM)))
+
+    def _reset(self, names, encodings):
+        count = len(names)
+        self._names = list(names)
+
+        self._person_index = {}
+        self._person_names = []
+        self._person_rows = []
+        person_ids = np.empty(count, dtype=np.intp)
+        for i, name in enumerate(self._names):
+            pid = self._person_index.get(name)
+            if pid is None:
+                pid = self._person_index[name] = len(self._person_names)
+                self._person_names.append(name)
+                self._person_rows.append([])
+            person_ids[i] = pid
+            self._person_rows[pid].append(i)
+        people = len(self._person_names)
+
+        if not self._replaying:
+            self._allocate(max(INITIAL_CAPACITY, count * 2), max(INITIAL_CAPACITY, people * 2))
+            self._buffer[:count] = encodings
+            self._sq_norms[:count] = np.einsum('ij,ij->i', self._buffer[:count], self._buffer[:count])
+            self._active[:count] = True
+            self._person_ids[:count] = person_ids
+            self._sample_counts[:people] = np.bincount(person_ids, minlength=people)
+            if count:
+                order = np.argsort(person_ids, kind='stable')
+                starts = np.concatenate([[0], np.cumsum(self._sample_counts[:people])[:-1]])
+                self._centroid_sums[:people] = np.add.reduceat(
+                    self._buffer[order].astype(np.float64), starts
+                )
+            self._centroids[:people] = self._centroid_sums[:people] / np.maximum(self._sample_counts[:people, None], 1)
+            self._centroid_sq_norms[:people] = np.einsum(
+                'ij,ij->i', self._centroids[:people], self._centroids[:people]
+            )
+        self._max_samples = int(self._sample_counts[:people].max()) if people else 0
+
+        self._dead = 0
+        # Row numbers are only stable within one generation
+        self._generation += 1
+        self._publish()
+
+    def _allocate(self, capacity, person_capacity):
+        """Create empty row and person arrays with room for the given counts"""
+        self._buffer = np.empty((capacity, ENCODING_DIM), dtype=np.float32)
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+        self._active = np.zeros(capacity, dtype=bool)
+        self._person_ids = np.empty(capacity, dtype=np.intp)
+        self._sample_counts = np.zeros(person_capacity, dtype=np.intp)
+        self._centroid_sums = np.zeros((person_capacity, ENCODING_DIM), dtype=np.float64)
+        self._centroids = np.empty((person_capacity, ENCODING_DIM), dtype=np.float32)
+        self._centroid_sq_norms = np.empty(person_capacity, dtype=np.float32)
+
+    def _publish(self):
+        self._version += 1
+        count = len(self._names)
+        people = len(self._person_names)
+        self._snapshot = GallerySnapshot(
+            self._names, self._buffer[:count], self._sq_norms[:count],
+            self._active[:count], count, self._generation,
+            self._person_ids[:count], self._person_names, self._person_rows,
+            self._centroids[:people], self._centroid_sq_norms[:people],
+            people, self._max_samples, self._version
+        )
+
+    def snapshot(self):
+        """Return the current immutable view; rows >= snapshot.count are never read"""
+        return self._snapshot
+
+    @property
+    def version(self):
+        """Counter that changes whenever the gallery's contents change"""
+        return self.snapshot().version
+
+    def names(self):
+        """Return the distinct enrolled names in enrollment order"""
+        return list(self._person_index)
+
+    def sample_count(self, name):
+        """Return how many live encodings name has"""
+        pid = self._person_index.get(name)
+        return 0 if pid is None else int(self._sample_counts[pid])
+
+    def __len__(self):
+        snap = self.snapshot()
+        return int(np.count_nonzero(snap.active))
+
+    def __contains__(self, name):
+        return name in self._person_index
+
+    def replace(self, names, encodings):
+        """Swap in a fully loaded gallery in one step"""
+        with self._lock:
+            self._reset(names, np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM))
+
+    def add(self, name, encoding):
+        """Append one encoding (sample) for name"""
+        with self._lock:
+            self._append(name, encoding)
+            self._publish()
+
+    def update(self, name, encoding):
+        """Replace every encoding of name with a single new one"""
+        with self._lock:
+            self._deactivate(name)
+            self._append(name, encoding)
+            self._maybe_compact()
+            self._publish()
+
+    def remove(self, name):
+        """Delete name; returns the number of encodings removed"""
+        with self._lock:
+            removed = self._deactivate(name)
+            self._maybe_compact()
+            self._publish()
+            return removed
+
+    def rename(self, old_name, new_name):
+        """Rename every encoding of old_name; returns the number renamed"""
+        with self._lock:
+            pid = self._rename(old_name, new_name)
+            if pid is None:
+                return 0
+            self._publish()
+            return int(self._sample_counts[pid])
+
+    def _rename(self, old_name, new_name):
+        pid = self._person_index.pop(old_name, None)
+        if pid is None:
+            return None
+        self._person_index[new_name] = pid
+        self._person_names[pid] = new_name
+        for i in self._person_rows[pid]:
+            self._names[i] = new_name
+        return pid
+
+    def _append(self, name, encoding):
+        count = len(self._names)
+        if count == len(self._buffer) and not self._replaying:
+            # Grow into fresh arrays; published snapshots keep the old ones
+            self._grow_rows(count)
+            self._names = list(self._names)
+
+        pid = self._person_index.get(name)
+        if pid is None:
+            pid = self._add_person(name)
+
+        if not self._replaying:
+            self._buffer[count] = encoding
+            self._sq_norms[count] = np.dot(self._buffer[count], self._buffer[count])
+            self._person_ids[count] = pid
+            self._active[count] = True
+        self._names.append(name)
+        self._person_rows[pid].append(count)
+
+        if not self._replaying:
+            self._sample_counts[pid] += 1
+            self._centroid_sums[pid] += self._buffer[count]
+            self._update_centroid(pid)
+        self._max_samples = max(self._max_samples, int(self._sample_counts[pid]))
+
+    def _grow_rows(self, count):
+        self._buffer = _grow(self._buffer, count)
+        self._sq_norms = _grow(self._sq_norms, count)
+        self._active = _grow(self._active, count, fill=False)
+        self._person_ids = _grow(self._person_ids, count)
+
+    def _add_person(self, name):
+        pid = len(self._person_names)
+        if pid == len(self._centroids) and not self._replaying:
+            self._grow_people(pid)
+            self._person_names = list(self._person_names)
+            self._person_rows = list(self._person_rows)
+        self._person_index[name] = pid
+        self._person_names.append(name)
+        self._person_rows.append([])
+        return pid
+
+    def _grow_people(self, people):
+        self._centroids = _grow(self._centroids, people)
+        self._centroid_sq_norms = _grow(self._centroid_sq_norms, people)
+        self._centroid_sums = _grow(self._centroid_sums, people, fill=0)
+        self._sample_counts = _grow(self._sample_counts, people, fill=0)
+
+    def _update_centroid(self, pid):
+        if self._sample_counts[pid] == 0:
+            # Nobody left to shortlist; inf keeps the person out of matches
+            self._centroid_sq_norms[pid] = np.inf
+            return
+        centroid = (self._centroid_sums[pid] / self._sample_counts[pid]).astype(np.float32)
+        self._centroids[pid] = centroid
+        self._centroid_sq_norms[pid] = np.dot(centroid, centroid)
+
+    def _deactivate(self, name):
+        pid = self._person_index.get(name)
+        if pid is None:
+            return 0
+        # A person's rows stay live until the person is deactivated
+        removed = len(self._person_rows[pid])
+        if not self._replaying:
+            for i in self._person_rows[pid]:
+                self._sq_norms[i] = np.inf
+                self._active[i] = False
+            self._sample_counts[pid] = 0
+            self._centroid_sums[pid] = 0
+            self._update_centroid(pid)
+        del self._person_index[name]
+        self._dead += removed
+        return removed
+
+    def _maybe_compact(self):
+        if self._dead <= INITIAL_CAPACITY or self._dead * 2 <= len(self._names):
+            return
+        keep = np.flatnonzero(self._active[:len(self._names)])
+        self._reset([self._names[i] for i in keep], self._buffer[keep])
+
+
+def _grow(array, count, fill=None):
+    """Return a copy of array with twice the rows, keeping the first count"""
+    grown = np.empty((max(count * 2, INITIAL_CAPACITY),) + array.shape[1:], dtype=array.dtype)
+    if fill is not None:
+        grown[count:] = fill
+    grown[:count] = array[:count]
+    return grown
+
+
+def match(snapshot, probes, tolerance=0.6, top_k=1):
+    """
+    Match every probe encoding against the gallery in one batched pass.
+
+    Returns (indices, distances), both shaped (len(probes), top_k) and sorted
+    by ascending distance per probe. Candidates farther than tolerance, and
+    slots beyond the gallery size, have index -1 and distance inf.
+    """
+    probes = np.asarray(probes, dtype=np.float32).reshape(-1, ENCODING_DIM)
+    indices = np.full((len(probes), top_k), -1, dtype=np.intp)
+    distances = np.full((len(probes), top_k), np.inf, dtype=np.float32)
+    if len(probes) == 0 or snapshot.count == 0:
+        return indices, distances
+
+    # |p - g|^2 = |p|^2 - 2 p.g + |g|^2, with |g|^2 precomputed per row
+    sq_dist = probes @ snapshot.encodings.T
+    sq_dist *= -2
+    sq_dist += snapshot.sq_norms
+    sq_dist += np.einsum('ij,ij->i', probes, probes)[:, None]
+
+    k = min(top_k, snapshot.count)
+    if k < snapshot.count:
+        candidates = np.argpartition(sq_dist, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(snapshot.count), (len(probes), k))
+    candidate_sq = np.take_along_axis(sq_dist, candidates, axis=1)
+    order = np.argsort(candidate_sq, axis=1)
+    candidates = np.take_along_axis(candidates, order, axis=1)
+    candidate_dist = np.sqrt(np.maximum(np.take_along_axis(candidate_sq, order, axis=1), 0))
+
+    within = candidate_dist <= tolerance
+    indices[:, :k] = np.where(within, candidates, -1)
+    distances[:, :k] = np.where(within, candidate_dist, np.inf)
+    return indices, distances
+
+
+def best_per_person(snapshot, indices, distances, top_k):
+    """
+    Collapse row candidates from match() to the best sample of each person.
+
+    indices/distances must be sorted per probe, as match() returns them.
+    Returns (indices, distances) shaped (len(indices), top_k), one row per
+    distinct person, padded with -1/inf.
+    """
+    out_indices = np.full((len(indices), top_k), -1, dtype=np.intp)
+    out_distances = np.full((len(indices), top_k), np.inf, dtype=np.float32)
+    for p, (rows, dists) in enumerate(zip(indices, distances)):
+        seen = set()
+        for row, dist in zip(rows, dists):
+            if row < 0 or len(seen) == top_k:
+                break
+            pid = snapshot.person_ids[row]
+            if pid not in seen:
+                out_indices[p, len(seen)] = row
+                out_distances[p, len(seen)] = dist
+                seen.add(pid)
+    return out_indices, out_distances
+
+
+def match_centroids(snapshot, probes, tolerance=0.6, top_k=1, shortlist=8):
+    """
+    Match probes by shortlisting people on their centroid, then re-ranking.
+
+    The first pass costs O(people) instead of O(samples); the shortlist of
+    closest centroids is then scored exactly on every sample of those people.
+    Returns the same (indices, distances) as best_per_person().
+    """
+    probes = np.asarray(probes, dtype=np.float32).reshape(-1, ENCODING_DIM)
+    indices = np.full((len(probes), top_k), -1, dtype=np.intp)
+    distances = np.full((len(probes), top_k), np.inf, dtype=np.float32)
+    people = snapshot.person_count
+    if len(probes) == 0 or people == 0:
+        return indices, distances
+
+    # Probe norms are the same for every candidate, so they don't affect the ranking
+    coarse = snapshot.centroid_sq_norms - 2 * (probes @ snapshot.centroids.T)
+    shortlist = min(max(shortlist, top_k), people)
+    if shortlist < people:
+        nearest = np.argpartition(coarse, shortlist - 1, axis=1)[:, :shortlist]
+    else:
+        nearest = np.broadcast_to(np.arange(people), (len(probes), people))
+
+    for p, probe in enumerate(probes):
+        pids = [pid for pid in nearest[p] if np.isfinite(snapshot.centroid_sq_norms[pid])]
+        if not pids:
+            continue
+        rows = np.concatenate([snapshot.person_rows[pid] for pid in pids]).astype(np.intp)
+        rows = rows[rows < snapshot.count]
+        if len(rows) == 0:
+            continue
+        sq_dist = snapshot.sq_norms[rows] - 2 * (snapshot.encodings[rows] @ probe)
+        sq_dist += np.dot(probe, probe)
+        order = np.argsort(sq_dist)
+        dists = np.sqrt(np.maximum(sq_dist[order], 0))
+        within = dists <= tolerance
+        best_rows, best_dists = best_per_person(
+            snapshot, rows[order][within][None, :], dists[within][None, :], top_k
+        )
+        indices[p], distances[p] = best_rows[0], best_dists[0]
+    return indices, distances
@@ -0,0 +1,492 @@
+"""
+Face detection and encoding, run off the request thread.
+
+The functions here are what an inference worker executes: they take encoded
+image bytes, decode them, and return a ``Scan`` with the face locations and
+128-d encodings. Matching against the gallery stays in the web process (it
+is a single vectorised pass), so workers never need a copy of the gallery
+and enrollments are visible to the next match immediately.
+
+``InferencePool`` runs these functions either in a pool of worker processes
+or, with ``workers=0``, in threads of the web process. It admits at most
+``workers + max_queue`` tasks at once; beyond that ``PoolBusy`` is raised so
+the caller can answer 429 instead of queueing without bound, and a task that
+takes longer than ``timeout`` raises ``InferenceTimeout``.
+"""
+import asyncio
+import math
+import multiprocessing
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import face_recognition
+import numpy as np
+
+# shape is None when the bytes could not be decoded, and for crops, which
+# have no frame (see encode_crops); jpeg is only filled in
+# when asked for and exactly one face was found (for enrollment), thumbnail
+# only when asked for. timings holds milliseconds per stage and scale the
+# detection scale that was used.
+Scan = namedtuple("Scan", ["shape", "locations", "encodings", "jpeg", "timings", "scale", "thumbnail"])
+
+# How to detect faces:
+# - model: "hog" (CPU) or "cnn" (GPU)
+# - upsample: number_of_times_to_upsample passed to the detector
+# - scale: fixed factor (0, 1] to shrink the frame by before detection
+# - min_face: smallest face, in original pixels, that must still be found;
+#   the frame is shrunk as far as the detector allows for that face size
+# - max_side: shrink the frame so its longer side is at most this many pixels
+# - decode_side: decode JPEGs at 1/2, 1/4 or 1/8 size (downscaled in the DCT,
+#   so the full frame is never held in memory) as long as the longer side
+#   stays at least this many pixels and min_face stays detectable
+# Without scale, the strongest of min_face/max_side wins. Boxes are mapped
+# back to full resolution and faces are encoded at the decoded resolution,
+# which is the full one unless decode_side allowed a reduced decode.
+DetectOptions = namedtuple("DetectOptions", ["model", "upsample", "scale", "min_face", "max_side", "decode_side"])
+DEFAULT_OPTIONS = DetectOptions("hog", 1, None, None, None, None)
+
+# Smallest face (pixels) each detector finds without upsampling
+DETECTOR_MIN_FACE = {"hog": 80, "cnn": 80}
+
+# imdecode flags for each JPEG reduction; OpenCV 4.10+ can also decode
+# straight into the RGB order face_recognition wants, saving a full-frame
+# conversion copy
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+RGB_DECODE_FLAG = getattr(cv2, "IMREAD_COLOR_RGB", None)
+
+# JPEG start-of-frame markers, which carry the image size
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Dashboard thumbnail: longest side in pixels, JPEG quality, and whether to
+# outline the detected faces
+ThumbnailOptions = namedtuple("ThumbnailOptions", ["max_side", "quality", "boxes"])
+BOX_COLOR = (0, 200, 0)
+
+
+def empty_scan():
+    return Scan(None, [], [], None, {}, 1.0, None)
+
+
+def decode_image(img_bytes):
+    """Decode JPEG/PNG bytes (any buffer, not copied) to a BGR image, or None"""
+    nparr = np.frombuffer(img_bytes, np.uint8)
+    if nparr.size == 0:
+        return None
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+
+def jpeg_size(img_bytes):
+    """Return (height, width) from a JPEG's frame header, or None if it isn't a JPEG"""
+    data = memoryview(img_bytes).cast('B')
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+            continue
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            # Markers without a length
+            i += 2
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            return (data[i + 5] << 8) | data[i + 6], (data[i + 7] << 8) | data[i + 8]
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    return None
+
+
+def decode_reduction(size, options):
+    """Return the largest JPEG reduction (1, 2, 4 or 8) options allow for an image of size"""
+    if not options.decode_side or size is None:
+        return 1
+    detectable = DETECTOR_MIN_FACE[options.model] / (2 ** options.upsample)
+    for reduction in (8, 4, 2):
+        if max(size) / reduction < options.decode_side:
+            continue
+        if options.min_face and options.min_face / reduction < detectable:
+            continue
+        return reduction
+    return 1
+
+
+def decode_rgb(img_bytes, reduction=1):
+    """Decode image bytes to an RGB image, JPEGs at 1/reduction size, or None"""
+    nparr = np.frombuffer(img_bytes, np.uint8)
+    if nparr.size == 0:
+        return None
+    flags = REDUCED_DECODE_FLAGS[reduction]
+    if RGB_DECODE_FLAG is not None:
+        return cv2.imdecode(nparr, (flags & ~cv2.IMREAD_COLOR) | RGB_DECODE_FLAG)
+    image = cv2.imdecode(nparr, flags)
+    return None if image is None else cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def detection_scale(shape, options, reduction=1):
+    """
+    Return the factor (<= 1) to shrink an image by before detection.
+
+    reduction is how much smaller than the original the image was decoded;
+    scale and min_face refer to the original.
+    """
+    if options.scale:
+        return min(1.0, float(options.scale) * reduction)
+    scale = 1.0
+    if options.min_face:
+        detectable = DETECTOR_MIN_FACE[options.model] / (2 ** options.upsample)
+        scale = min(scale, detectable * reduction / options.min_face)
+    if options.max_side:
+        scale = min(scale, options.max_side / max(shape[:2]))
+    return scale
+
+
+def scale_locations(face_locations, scale, shape):
+    """Map (top, right, bottom, left) boxes from a scaled image back to full size"""
+    if scale == 1.0:
+        return face_locations
+    height, width = shape[:2]
+    return [
+        (max(0, int(round(top / scale))), min(width, int(round(right / scale))),
+         min(height, int(round(bottom / scale))), max(0, int(round(left / scale))))
+        for top, right, bottom, left in face_locations
+    ]
+
+
+def scan_images(images, options=DEFAULT_OPTIONS, decode_ms=None, rgb=False, reductions=None):
+    """
+    Detect and encode faces in BGR (or, with rgb, RGB) images, batching on
+    the CNN detector when possible. reductions are how much smaller than
+    their originals the images were decoded (see decode_reduction).
+    """
+    decode_ms = decode_ms or [0.0] * len(images)
+    reductions = reductions or [1] * len(images)
+
+    # Convert BGR to RGB (face_recognition uses RGB)
+    start = time.perf_counter()
+    rgb_images = images if rgb else [cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in images]
+    convert_ms = (time.perf_counter() - start) * 1000 / max(1, len(images))
+
+    # Detect on downscaled copies; full-resolution frames mostly cost time
+    start = time.perf_counter()
+    scales = [detection_scale(image.shape, options, r) for image, r in zip(images, reductions)]
+    small_images = [
+        rgb if scale == 1.0 else cv2.resize(rgb, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        for rgb, scale in zip(rgb_images, scales)
+    ]
+    resize_ms = (time.perf_counter() - start) * 1000 / max(1, len(images))
+
+    if options.model == "cnn" and len(small_images) > 1 and len({img.shape for img in small_images}) == 1:
+        start = time.perf_counter()
+        all_locations = face_recognition.batch_face_locations(
+            small_images, number_of_times_to_upsample=options.upsample
+        )
+        detect_ms = [(time.perf_counter() - start) * 1000 / len(small_images)] * len(small_images)
+    else:
+        all_locations = []
+        detect_ms = []
+        for small in small_images:
+            start = time.perf_counter()
+            all_locations.append(face_recognition.face_locations(
+                small, number_of_times_to_upsample=options.upsample, model=options.model
+            ))
+            detect_ms.append((time.perf_counter() - start) * 1000)
+
+    scans = []
+    for i, (image, rgb_image) in enumerate(zip(images, rgb_images)):
+        face_locations = scale_locations(all_locations[i], scales[i], image.shape)
+        start = time.perf_counter()
+        face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
+        encode_ms = (time.perf_counter() - start) * 1000
+        timings = {
+            "decode": decode_ms[i],
+            "convert": convert_ms,
+            "resize": resize_ms,
+            "detect": detect_ms[i],
+            "encode": encode_ms,
+        }
+        scans.append(Scan(image.shape, face_locations, face_encodings, None, timings, scales[i], None))
+    return scans
+
+
+def encode_crops(buffers, boxes=None):
+    """
+    Encode tight face crops without running detection.
+
+    The face in crop i is boxes[i] as (top, right, bottom, left) crop pixels,
+    or the whole crop when that is None. Returns one Scan for all crops, with
+    no shape; raises ValueError for a crop that can't be decoded.
+    """
+    boxes = boxes or [None] * len(buffers)
+    timings = {"decode": 0.0, "encode": 0.0}
+    locations = []
+    encodings = []
+    for i, (buf, box) in enumerate(zip(buffers, boxes)):
+        image, _, _, decode_ms = _decode_timed(buf)
+        if image is None:
+            raise ValueError(f"Failed to decode crop {i}")
+        timings["decode"] += decode_ms
+
+        height, width = image.shape[:2]
+        box = (0, width, height, 0) if box is None else tuple(box)
+        start = time.perf_counter()
+        encodings.extend(face_recognition.face_encodings(image, [box]))
+        timings["encode"] += (time.perf_counter() - start) * 1000
+        locations.append(box)
+    return Scan(None, locations, encodings, None, timings, 1.0, None)
+
+
+def make_thumbnail(image, face_locations, thumbnail, rgb=False):
+    """Encode a small JPEG of a BGR (or, with rgb, RGB) image, optionally with face boxes drawn"""
+    scale = min(1.0, thumbnail.max_side / max(image.shape[:2]))
+    small = image if scale == 1.0 else cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if rgb:
+        small = cv2.cvtColor(small, cv2.COLOR_RGB2BGR)
+    if thumbnail.boxes and face_locations:
+        if small is image:
+            small = image.copy()
+        for top, right, bottom, left in face_locations:
+            cv2.rectangle(small, (int(left * scale), int(top * scale)),
+                          (int(right * scale), int(bottom * scale)), BOX_COLOR, 2)
+    return cv2.imencode('.jpg', small, [cv2.IMWRITE_JPEG_QUALITY, thumbnail.quality])[1].tobytes()
+
+
+def _with_thumbnail(scan, image, thumbnail):
+    # Scans from analyze() hold RGB decodes
+    start = time.perf_counter()
+    jpeg = make_thumbnail(image, scan.locations, thumbnail, rgb=True)
+    timings = dict(scan.timings, thumbnail=(time.perf_counter() - start) * 1000)
+    return scan._replace(thumbnail=jpeg, timings=timings)
+
+
+def _decode_timed(img_bytes, options=None):
+    """Return (RGB image or None, reduction, original (height, width) or None, milliseconds)"""
+    start = time.perf_counter()
+    size = jpeg_size(img_bytes) if options is not None and options.decode_side else None
+    reduction = decode_reduction(size, options) if size else 1
+    image = decode_rgb(img_bytes, reduction)
+    return image, reduction, size, (time.perf_counter() - start) * 1000
+
+
+def _full_size(scan, reduction, size):
+    """Map a scan of a reduced decode back to the original image's pixels"""
+    if reduction == 1:
+        return scan
+    shape = (size[0], size[1]) + scan.shape[2:]
+    return scan._replace(
+        shape=shape, locations=scale_locations(scan.locations, 1.0 / reduction, shape),
+        scale=scan.scale / reduction
+    )
+
+
+def analyze(img_bytes, options=DEFAULT_OPTIONS, keep_jpeg=False, thumbnail=None):
+    """Decode one image and scan it for faces"""
+    image, reduction, size, decode_ms = _decode_timed(img_bytes, options)
+    if image is None:
+        return empty_scan()
+    scan = scan_images([image], options, [decode_ms], rgb=True, reductions=[reduction])[0]
+    if keep_jpeg and len(scan.encodings) == 1:
+        scan = scan._replace(jpeg=cv2.imencode('.jpg', cv2.cvtColor(image, cv2.COLOR_RGB2BGR))[1].tobytes())
+    if thumbnail:
+        scan = _with_thumbnail(scan, image, thumbnail)
+    return _full_size(scan, reduction, size)
+
+
+def analyze_batch(buffers, options=DEFAULT_OPTIONS, thumbnail=None):
+    """Decode several images and scan the decodable ones together"""
+    decoded = [_decode_timed(buf, options) for buf in buffers]
+    ok = [d for d in decoded if d[0] is not None]
+    scans = iter(scan_images(
+        [image for image, _, _, _ in ok], options, [ms for _, _, _, ms in ok], rgb=True,
+        reductions=[reduction for _, reduction, _, _ in ok]
+    ))
+    results = []
+    for image, reduction, size, _ in decoded:
+        if image is None:
+            results.append(empty_scan())
+            continue
+        scan = next(scans)
+        if thumbnail:
+            scan = _with_thumbnail(scan, image, thumbnail)
+        results.append(_full_size(scan, reduction, size))
+    return results
+
+
+def _picklable(arg):
+    # Buffers like memoryview can't be pickled for a worker process
+    if isinstance(arg, memoryview):
+        return bytes(arg)
+    if isinstance(arg, list):
+        return [_picklable(a) for a in arg]
+    return arg
+
+
+class PoolBusy(Exception):
+    """Raised when the pool's queue is full; retry_after is a hint in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__("Server busy, try again later")
+        self.retry_after = retry_after
+
+
+class InferenceTimeout(Exception):
+    """Raised when a task doesn't finish within the pool's timeout"""
+
+
+class InferencePool:
+    """Bounded executor for detection/encoding tasks"""
+
+    def __init__(self, workers=2, threads=4, max_queue=16, timeout=30.0):
+        self.workers = workers
+        self.threads = threads
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        # Moving average of task latency, used for Retry-After hints
+        self._avg_seconds = 1.0
+
+    @property
+    def concurrency(self):
+        return self.workers or self.threads
+
+    @property
+    def capacity(self):
+        return self.concurrency + self.max_queue
+
+    def stats(self):
+        """Return a snapshot of pool load"""
+        in_flight = self._in_flight
+        return {
+            "mode": "process" if self.workers else "thread",
+            "concurrency": self.concurrency,
+            "capacity": self.capacity,
+            "in_flight": in_flight,
+            "queued": max(0, in_flight - self.concurrency),
+            "avg_task_seconds": round(self._avg_seconds, 4),
+        }
+
+    def run(self, fn, *args):
+        """Run fn(*args) in the pool and wait for its result"""
+        return self._wait(self._submit(fn, args))
+
+    async def run_async(self, fn, *args):
+        """Run fn(*args) in the pool and await its result without blocking the event loop"""
+        future = self._submit(fn, args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise InferenceTimeout(f"Processing took longer than {self.timeout:g}s")
+        except BrokenProcessPool:
+            self.shutdown()
+            raise
+
+    def run_many(self, fn, args_list):
+        """
+        Run fn over several argument tuples in parallel.
+
+        Admission is all-or-nothing. Returns one result or exception per
+        tuple, in order, so one bad input doesn't fail the rest.
+        """
+        self._reserve(len(args_list))
+        futures = []
+        try:
+            for args in args_list:
+                futures.append(self._submit(fn, args, reserved=True))
+        except Exception:
+            # _submit released the failed task's slot; release the unsubmitted ones
+            with self._lock:
+                self._in_flight -= len(args_list) - len(futures) - 1
+            raise
+        results = []
+        # The timeout covers the whole batch, not each image in turn
+        deadline = time.monotonic() + self.timeout
+        for future in futures:
+            try:
+                results.append(self._wait(future, deadline))
+            except InferenceTimeout:
+                for other in futures:
+                    other.cancel()
+                raise
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _executor_for_submit(self):
+        with self._lock:
+            if self._executor is None:
+                if self.workers:
+                    # spawn: never fork a web process that already runs threads
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.threads, thread_name_prefix="inference"
+                    )
+            return self._executor
+
+    def _reserve(self, n):
+        with self._lock:
+            if self._in_flight + n > self.capacity:
+                raise PoolBusy(self._retry_after())
+            self._in_flight += n
+
+    def _retry_after(self):
+        queued = max(0, self._in_flight - self.concurrency)
+        return max(1, math.ceil(self._avg_seconds * (queued / self.concurrency + 1)))
+
+    def _submit(self, fn, args, reserved=False):
+        if not reserved:
+            self._reserve(1)
+        if self.workers:
+            args = tuple(_picklable(a) for a in args)
+        start = time.monotonic()
+        try:
+            future = self._executor_for_submit().submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start a fresh pool next time
+            self.shutdown()
+            self._done(start)
+            raise
+        except Exception:
+            self._done(start)
+            raise
+        # The slot is freed when the task really finishes, even after a timeout
+        future.add_done_callback(lambda f: self._done(start))
+        return future
+
+    def _done(self, start):
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self._in_flight -= 1
+            self._avg_seconds = 0.9 * self._avg_seconds + 0.1 * elapsed
+
+    def _wait(self, future, deadline=None):
+        timeout = self.timeout if deadline is None else max(0, deadline - time.monotonic())
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise InferenceTimeout(f"Processing took longer than {self.timeout:g}s")
+        except BrokenProcessPool:
+            self.shutdown()
+            raise
@@ -0,0 +1,354 @@
+"""
+Matcher backends that search a gallery snapshot for the nearest known faces.
+
+Every backend exposes ``search(snapshot, probes, tolerance, top_k, **params)``
+returning the same (indices, distances) pair as ``gallery.match()``:
+
+* ``ExactMatcher`` - brute force over every row (``gallery.match()``)
+* ``IVFMatcher``   - inverted-file index: rows are partitioned by k-means and
+  a probe only scans the ``nprobe`` partitions with the closest centroids.
+  Candidates are re-ranked with exact distances, so only recall is traded
+  for speed, never distance accuracy.
+* ``QuantizedMatcher`` - brute force over int8 codes of the rows (a quarter of
+  the float32 matrix, one scale per dimension); the ``rerank`` closest rows
+  are re-ranked with exact distances, so returned distances are exact.
+
+The IVF centroids are persisted next to the encoding cache and reused on
+restart; rows are (re)assigned to partitions in one matrix product, and rows
+enrolled later are appended to their partition incrementally.
+"""
+import os
+import tempfile
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from gallery import ENCODING_DIM, match
+
+IVF_FILE = "ivf.npz"
+# Below this many rows per partition an IVF index is not worth building
+MIN_ROWS_PER_LIST = 8
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+ASSIGN_CHUNK_ROWS = 4096
+# Retrain once the gallery has grown this much since the centroids were fit
+RETRAIN_GROWTH = 4
+# Rows of int8 codes widened to float32 at a time while scanning
+SCAN_CHUNK_ROWS = 8192
+
+IVFState = namedtuple("IVFState", ["generation", "count", "centroids", "centroid_sq_norms", "lists"])
+QuantizedState = namedtuple("QuantizedState", ["generation", "count", "center", "scale", "codes", "code_sq_norms"])
+
+
+class ExactMatcher:
+    """Brute-force search over the whole gallery"""
+
+    name = "exact"
+
+    def rebuild(self, snapshot):
+        pass
+
+    def sync(self, snapshot):
+        pass
+
+    def search(self, snapshot, probes, tolerance=0.6, top_k=1, **params):
+        return match(snapshot, probes, tolerance=tolerance, top_k=top_k)
+
+
+class IVFMatcher:
+    """Approximate search over k-means partitions of the gallery"""
+
+    name = "ivf"
+
+    def __init__(self, store_dir, nlist=0, nprobe=8, seed=0):
+        # nlist=0 picks 4 * sqrt(N) partitions when the index is trained
+        self.path = os.path.join(store_dir, IVF_FILE)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._state = None
+        self._trained_count = 0
+
+    def rebuild(self, snapshot):
+        """Assign every row to a partition, training new centroids if needed"""
+        with self._lock:
+            self._rebuild(snapshot)
+
+    def sync(self, snapshot):
+        """Index rows enrolled since the last call"""
+        with self._lock:
+            state = self._state
+            if state is None or state.generation < snapshot.generation:
+                self._rebuild(snapshot)
+            elif state.generation == snapshot.generation and state.count < snapshot.count:
+                self._append(state, snapshot)
+
+    def search(self, snapshot, probes, tolerance=0.6, top_k=1, nprobe=None, **params):
+        state = self._state
+        if state is None or state.generation != snapshot.generation or state.count < snapshot.count:
+            self.sync(snapshot)
+            state = self._state
+        if state is None or state.generation != snapshot.generation:
+            # Too small to index, or a request still holding an older snapshot
+            return match(snapshot, probes, tolerance=tolerance, top_k=top_k)
+
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        indices = np.full((len(probes), top_k), -1, dtype=np.intp)
+        distances = np.full((len(probes), top_k), np.inf, dtype=np.float32)
+        if len(probes) == 0:
+            return indices, distances
+
+        nlist = len(state.centroids)
+        nprobe = min(max(1, int(nprobe or self.nprobe)), nlist)
+        coarse = state.centroid_sq_norms - 2 * (probes @ state.centroids.T)
+        if nprobe < nlist:
+            nearest_lists = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            nearest_lists = np.broadcast_to(np.arange(nlist), (len(probes), nlist))
+
+        for p, probe in enumerate(probes):
+            rows = np.concatenate([state.lists[l] for l in nearest_lists[p]])
+            # The index may already hold rows enrolled after this snapshot
+            rows = rows[rows < snapshot.count]
+            if len(rows) == 0:
+                continue
+            sq_dist = snapshot.sq_norms[rows] - 2 * (snapshot.encodings[rows] @ probe)
+            sq_dist += np.dot(probe, probe)
+
+            k = min(top_k, len(rows))
+            best = np.argpartition(sq_dist, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+            best = best[np.argsort(sq_dist[best])]
+            best_dist = np.sqrt(np.maximum(sq_dist[best], 0))
+            within = best_dist <= tolerance
+            indices[p, :k] = np.where(within, rows[best], -1)
+            distances[p, :k] = np.where(within, best_dist, np.inf)
+        return indices, distances
+
+    def _rebuild(self, snapshot):
+        live = np.flatnonzero(snapshot.active)
+        nlist = self.nlist or int(4 * np.sqrt(len(live)))
+        if nlist < 2 or len(live) < nlist * MIN_ROWS_PER_LIST:
+            self._state = None
+            return
+
+        centroids = self._load_centroids()
+        if centroids is not None and self.nlist and len(centroids) != self.nlist:
+            centroids = None
+        if centroids is not None and len(live) < len(centroids) * MIN_ROWS_PER_LIST:
+            centroids = None
+        if centroids is None or len(live) > self._trained_count * RETRAIN_GROWTH:
+            centroids = self._train(snapshot.encodings[live], nlist)
+            self._trained_count = len(live)
+            self._save_centroids(centroids)
+
+        centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+        assignment = self._assign(centroids, centroid_sq_norms, snapshot.encodings[live])
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(len(centroids) + 1))
+        lists = [live[order[bounds[i]:bounds[i + 1]]] for i in range(len(centroids))]
+        self._state = IVFState(snapshot.generation, snapshot.count, centroids, centroid_sq_norms, lists)
+
+    def _append(self, state, snapshot):
+        new_rows = np.arange(state.count, snapshot.count)
+        new_rows = new_rows[snapshot.active[new_rows]]
+        # Copy only the touched lists; searches in flight keep the old ones
+        lists = list(state.lists)
+        if len(new_rows):
+            assignment = self._assign(state.centroids, state.centroid_sq_norms, snapshot.encodings[new_rows])
+            for l in np.unique(assignment):
+                lists[l] = np.concatenate([lists[l], new_rows[assignment == l]])
+        self._state = state._replace(count=snapshot.count, lists=lists)
+
+    @staticmethod
+    def _assign(centroids, centroid_sq_norms, encodings):
+        """Return the nearest centroid of each row, in chunks to bound memory"""
+        assignment = np.empty(len(encodings), dtype=np.intp)
+        for start in range(0, len(encodings), ASSIGN_CHUNK_ROWS):
+            chunk = encodings[start:start + ASSIGN_CHUNK_ROWS]
+            assignment[start:start + len(chunk)] = np.argmin(
+                centroid_sq_norms - 2 * (chunk @ centroids.T), axis=1
+            )
+        return assignment
+
+    def _train(self, encodings, nlist):
+        """Plain Lloyd's k-means on a sample of the gallery"""
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(encodings), nlist * KMEANS_SAMPLE_PER_LIST)
+        sample = encodings[rng.choice(len(encodings), sample_size, replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(KMEANS_ITERATIONS):
+            centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+            assignment = self._assign(centroids, centroid_sq_norms, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+            sums = np.stack([
+                np.bincount(assignment, weights=sample[:, d], minlength=nlist)
+                for d in range(ENCODING_DIM)
+            ], axis=1)
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            # Reseed empty partitions from random sample points
+            centroids[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        return centroids.astype(np.float32)
+
+    def _load_centroids(self):
+        try:
+            with np.load(self.path) as data:
+                centroids = data["centroids"]
+                trained_count = int(data["trained_count"])
+        except (OSError, ValueError, KeyError):
+            return None
+        if centroids.ndim != 2 or centroids.shape[1] != ENCODING_DIM:
+            return None
+        self._trained_count = trained_count
+        return centroids.astype(np.float32)
+
+    def _save_centroids(self, centroids):
+        # Every worker may train and save at once, so each writes its own
+        # temporary file. The centroids are only a cache: a failed save
+        # just means training again on the next start.
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, centroids=centroids, trained_count=self._trained_count)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error saving IVF centroids: {e}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class QuantizedMatcher:
+    """Brute-force search on int8 codes, re-ranking the closest rows exactly"""
+
+    name = "int8"
+
+    def __init__(self, rerank=32):
+        self.rerank = rerank
+        self._lock = threading.Lock()
+        self._state = None
+
+    def rebuild(self, snapshot):
+        """Fit the per-dimension scale to the live rows and encode every row"""
+        with self._lock:
+            self._rebuild(snapshot)
+
+    def sync(self, snapshot):
+        """Encode rows enrolled since the last call"""
+        with self._lock:
+            state = self._state
+            if state is None or state.generation < snapshot.generation:
+                self._rebuild(snapshot)
+            elif state.generation == snapshot.generation and state.count < snapshot.count:
+                self._append(state, snapshot)
+
+    def search(self, snapshot, probes, tolerance=0.6, top_k=1, rerank=None, **params):
+        state = self._state
+        if state is None or state.generation != snapshot.generation or state.count < snapshot.count:
+            self.sync(snapshot)
+            state = self._state
+        if state is None or state.generation != snapshot.generation:
+            # Empty gallery, or a request still holding an older snapshot
+            return match(snapshot, probes, tolerance=tolerance, top_k=top_k)
+
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        indices = np.full((len(probes), top_k), -1, dtype=np.intp)
+        distances = np.full((len(probes), top_k), np.inf, dtype=np.float32)
+        count = snapshot.count
+        if len(probes) == 0 or count == 0:
+            return indices, distances
+
+        # |p - g|^2 up to the probe's own norm, with g decoded as center + scale * code
+        scaled = (probes - state.center) * state.scale
+        approx = np.empty((len(probes), count), dtype=np.float32)
+        for start in range(0, count, SCAN_CHUNK_ROWS):
+            codes = state.codes[start:min(start + SCAN_CHUNK_ROWS, count)]
+            approx[:, start:start + len(codes)] = scaled @ codes.T.astype(np.float32)
+        approx *= -2
+        approx += state.code_sq_norms[:count]
+        dead = ~snapshot.active
+        if dead.any():
+            approx[:, dead] = np.inf
+
+        shortlist = min(max(int(rerank or self.rerank), top_k), count)
+        if shortlist < count:
+            candidates = np.argpartition(approx, shortlist - 1, axis=1)[:, :shortlist]
+        else:
+            candidates = np.broadcast_to(np.arange(count), (len(probes), count))
+
+        # Exact distances for the shortlist; deleted rows have an inf norm
+        sq_dist = snapshot.sq_norms[candidates] - 2 * np.einsum(
+            'psd,pd->ps', snapshot.encodings[candidates], probes
+        )
+        sq_dist += np.einsum('ij,ij->i', probes, probes)[:, None]
+        k = min(top_k, shortlist)
+        order = np.argsort(sq_dist, axis=1)[:, :k]
+        best = np.take_along_axis(candidates, order, axis=1)
+        best_dist = np.sqrt(np.maximum(np.take_along_axis(sq_dist, order, axis=1), 0))
+        within = best_dist <= tolerance
+        indices[:, :k] = np.where(within, best, -1)
+        distances[:, :k] = np.where(within, best_dist, np.inf)
+        return indices, distances
+
+    def memory_bytes(self):
+        """Size of the codes and their norms, as held for the current gallery"""
+        state = self._state
+        if state is None:
+            return 0
+        return state.codes[:state.count].nbytes + state.code_sq_norms[:state.count].nbytes
+
+    def _rebuild(self, snapshot):
+        live = snapshot.active
+        if not live.any():
+            self._state = None
+            return
+        encodings = snapshot.encodings[live]
+        center = encodings.mean(axis=0).astype(np.float32)
+        # One step per dimension, so that every live row fits in [-127, 127]
+        scale = (np.abs(encodings - center).max(axis=0) / 127).astype(np.float32)
+        scale = np.maximum(scale, np.finfo(np.float32).tiny)
+
+        capacity = max(snapshot.count * 2, MIN_ROWS_PER_LIST)
+        codes = np.zeros((capacity, ENCODING_DIM), dtype=np.int8)
+        code_sq_norms = np.zeros(capacity, dtype=np.float32)
+        state = QuantizedState(snapshot.generation, 0, center, scale, codes, code_sq_norms)
+        self._state = self._encode(state, snapshot, snapshot.count)
+
+    def _append(self, state, snapshot):
+        if snapshot.count > len(state.codes):
+            # Grow into new arrays; searches in flight keep the old ones
+            capacity = snapshot.count * 2
+            codes = np.zeros((capacity, ENCODING_DIM), dtype=np.int8)
+            code_sq_norms = np.zeros(capacity, dtype=np.float32)
+            codes[:state.count] = state.codes[:state.count]
+            code_sq_norms[:state.count] = state.code_sq_norms[:state.count]
+            state = state._replace(codes=codes, code_sq_norms=code_sq_norms)
+        # Rows past state.count are never read by searches of this state
+        self._state = self._encode(state, snapshot, snapshot.count)
+
+    @staticmethod
+    def _encode(state, snapshot, end):
+        """Write the codes of rows state.count..end and return the state covering them"""
+        rows = slice(state.count, end)
+        # Rows enrolled after the scale was fit may fall outside it; clipping
+        # only costs ranking accuracy, which the exact re-rank makes up for
+        codes = np.clip(np.rint((snapshot.encodings[rows] - state.center) / state.scale), -127, 127)
+        state.codes[rows] = codes
+        decoded = codes * state.scale
+        state.code_sq_norms[rows] = np.einsum('ij,ij->i', decoded, decoded)
+        return state._replace(count=end)
+
+
+def create_matcher(kind, store_dir, **options):
+    """Build the matcher backend called kind ("exact", "ivf" or "int8")"""
+    if kind == ExactMatcher.name:
+        return ExactMatcher()
+    if kind == IVFMatcher.name:
+        return IVFMatcher(store_dir, **options)
+    if kind == QuantizedMatcher.name:
+        return QuantizedMatcher(**options)
+    raise ValueError(f"Unknown matcher: {kind}")
@@ -0,0 +1,178 @@
+"""
+Low-overhead metrics with Prometheus text exposition.
+
+Counters and fixed-bucket histograms keep one shard of plain Python ints per
+thread, so recording a value never takes a lock or contends with other
+request threads; shards are only summed when ``/metrics`` is scraped.
+Gauges are callbacks evaluated at scrape time.
+
+Every gunicorn worker process has its own registry, so each scrape reports
+the worker that served it.
+"""
+import threading
+from bisect import bisect_left
+
+# Seconds, from tens of microseconds (matching) to tens of seconds (4K CNN)
+DEFAULT_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class _Sharded:
+    """Per-thread list of slots, registered once per thread"""
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._shards = []
+        self._register_lock = threading.Lock()
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = [0] * self._size
+            with self._register_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def totals(self):
+        with self._register_lock:
+            shards = list(self._shards)
+        return [sum(values) for values in zip(*shards)] if shards else [0] * self._size
+
+
+class Counter:
+    """Monotonic counter"""
+
+    def __init__(self, labels=()):
+        self.labels = labels
+        self._slots = _Sharded(1)
+
+    def inc(self, amount=1):
+        self._slots.shard()[0] += amount
+
+    def value(self):
+        return self._slots.totals()[0]
+
+
+class Histogram:
+    """Fixed-bucket histogram; observe() is a bisect and two list increments"""
+
+    def __init__(self, labels=(), buckets=DEFAULT_BUCKETS):
+        self.labels = labels
+        self.bounds = tuple(buckets)
+        # One slot per bucket, one for +Inf, then the running sum
+        self._slots = _Sharded(len(self.bounds) + 2)
+
+    def observe(self, value):
+        shard = self._slots.shard()
+        shard[bisect_left(self.bounds, value)] += 1
+        shard[-1] += value
+
+    def snapshot(self):
+        """Return (cumulative bucket counts incl. +Inf, sum)"""
+        totals = self._slots.totals()
+        cumulative = []
+        running = 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1]
+
+
+class Family:
+    """A named metric with one child per label combination"""
+
+    def __init__(self, name, help_text, kind, label_names=(), **options):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label_names = tuple(label_names)
+        self._options = options
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child_class = Histogram if self.kind == "histogram" else Counter
+                    child = child_class(tuple(zip(self.label_names, values)), **self._options)
+                    self._children[values] = child
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for child in list(self._children.values()):
+            if self.kind == "counter":
+                lines.append(f"{self.name}{_format_labels(child.labels)} {child.value()}")
+                continue
+            cumulative, total = child.snapshot()
+            for bound, count in zip(child.bounds + ("+Inf",), cumulative):
+                labels = child.labels + (("le", bound),)
+                lines.append(f"{self.name}_bucket{_format_labels(labels)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(child.labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(child.labels)} {cumulative[-1]}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time; the callback may return
+    a number or a dict mapping label-value tuples to numbers"""
+
+    def __init__(self, name, help_text, callback, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.label_names = tuple(label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        value = self.callback()
+        if isinstance(value, dict):
+            for label_values, v in value.items():
+                lines.append(f"{self.name}{_format_labels(tuple(zip(self.label_names, label_values)))} {v}")
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    """Collects metrics and renders them in Prometheus text format"""
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, label_names=()):
+        family = Family(name, help_text, "counter", label_names)
+        self._metrics.append(family)
+        return family
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        family = Family(name, help_text, "histogram", label_names, buckets=buckets)
+        self._metrics.append(family)
+        return family
+
+    def gauge(self, name, help_text, callback, label_names=()):
+        gauge = Gauge(name, help_text, callback, label_names)
+        self._metrics.append(gauge)
+        return gauge
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
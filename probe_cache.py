@@ -0,0 +1,122 @@
+"""
+LRU cache of scans (face boxes, encodings, thumbnail) for repeated frames.
+
+Edge cameras often resend a frame: a static scene, or a retry after a
+timeout. Entries are keyed by a BLAKE2 hash of the raw upload together with
+the detection options, so an exact resend skips decoding, detection and
+encoding. With ``perceptual=True`` a frame that differs only by sensor or
+JPEG noise hits too: a 256-bit difference hash (dHash) of a reduced-size
+grey decode is compared with the cached frames' within ``max_distance``
+bits. Small changes - a person stepping into a corner of the frame - can
+stay under that threshold, which is why it is off by default.
+
+Each entry also keeps the gallery match of its scan, tagged with the gallery
+version and match parameters. A resent frame is not even re-matched until
+the gallery changes; any enrollment, delete or rename bumps the version, and
+the match is recomputed while the scan is still reused.
+"""
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+import cv2
+import numpy as np
+
+HASH_SIDE = 16
+
+# outcome is "hit", "near_hit" (perceptual) or "miss"
+Probe = namedtuple("Probe", ["key", "params", "phash", "outcome"])
+
+
+def perceptual_hash(img_bytes):
+    """Return (difference hash, reduced shape) of an image, or None"""
+    gray = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        return None
+    small = cv2.resize(gray, (HASH_SIDE + 1, HASH_SIDE), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small[:, 1:] > small[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big'), gray.shape
+
+
+class CacheEntry:
+    """A cached scan and the last gallery match made from it"""
+
+    __slots__ = ("scan", "params", "phash", "match")
+
+    def __init__(self, scan, params, phash):
+        self.scan = scan
+        self.params = params
+        self.phash = phash
+        # (match key, indices, distances) or None; see server.identify_scans
+        self.match = None
+
+    def match_for(self, key):
+        """
+        Return (indices, distances) of the last match if it was made under key.
+
+        Concurrent requests replace the match at any time, so it is read once.
+        """
+        match = self.match
+        if match is None or match[0] != key:
+            return None
+        return match[1:]
+
+    def keep_match(self, key, indices, distances):
+        """Keep a fresh match; returns whether it replaced an older one"""
+        replaced = self.match is not None
+        self.match = (key, indices, distances)
+        return replaced
+
+
+class ProbeCache:
+    """Bounded LRU map from uploaded images to their scans"""
+
+    def __init__(self, max_entries=256, perceptual=False, max_distance=4):
+        self.max_entries = max_entries
+        self.perceptual = perceptual
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def lookup(self, img_bytes, params):
+        """
+        Return (probe, entry) for an upload scanned with params.
+
+        ``entry`` is None on a miss; pass the probe to ``store()`` with the
+        scan once it is made.
+        """
+        if not self.max_entries:
+            return Probe(None, params, None, "miss"), None
+        digest = hashlib.blake2b(img_bytes, digest_size=16)
+        digest.update(repr(params).encode('utf-8'))
+        key = digest.digest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return Probe(key, params, entry.phash, "hit"), entry
+
+        phash = perceptual_hash(img_bytes) if self.perceptual else None
+        if phash is not None:
+            with self._lock:
+                for other_key, entry in reversed(self._entries.items()):
+                    if (entry.phash is not None and entry.params == params and entry.phash[1] == phash[1]
+                            and bin(entry.phash[0] ^ phash[0]).count('1') <= self.max_distance):
+                        self._entries.move_to_end(other_key)
+                        return Probe(key, params, phash, "near_hit"), entry
+        return Probe(key, params, phash, "miss"), None
+
+    def store(self, probe, scan):
+        """Cache the scan made for a missed probe; returns its entry"""
+        entry = CacheEntry(scan, probe.params, probe.phash)
+        if probe.key is None:
+            return entry
+        with self._lock:
+            self._entries[probe.key] = entry
+            self._entries.move_to_end(probe.key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,258 @@
+"""
+Durable history of identify results in SQLite.
+
+Results are appended to a queue on the request path and written by a
+background thread in batches, one transaction per batch, so a request never
+waits on disk. The database runs in WAL mode, so every gunicorn worker can
+write to the same file while others read, and all workers see one history.
+
+Besides the ``results`` table (indexed by time) the log keeps
+
+* ``result_faces`` - one row per recognised name, indexed for name filters
+* ``counters``     - running totals, updated in the same transaction as the
+  rows they count, so aggregates never scan the history
+
+Only the newest ``keep_thumbnails`` results keep their thumbnail; older rows
+keep their metadata. A result is visible to queries once its batch has been
+written, normally within ``flush_interval`` seconds.
+
+A batch that fails to write because the database is busy (another worker
+held the write lock past the timeout) or full is retried a few times with
+backoff. Results are only dropped when the queue is full or every retry
+failed; ``dropped`` counts them by reason and each drop is logged.
+"""
+import base64
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    result_id TEXT NOT NULL UNIQUE,
+    ts REAL NOT NULL,
+    timestamp TEXT NOT NULL,
+    result TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    image_size TEXT NOT NULL,
+    face_count INTEGER NOT NULL,
+    faces TEXT NOT NULL,
+    thumbnail BLOB
+);
+CREATE INDEX IF NOT EXISTS results_ts ON results (ts);
+CREATE TABLE IF NOT EXISTS result_faces (
+    result INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS result_faces_name ON result_faces (name, result);
+CREATE TABLE IF NOT EXISTS counters (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters VALUES ('results', 0), ('faces', 0);
+"""
+
+# Attempts at writing a batch before it is dropped, and the wait before the
+# first retry (doubled for each one after)
+WRITE_ATTEMPTS = 4
+WRITE_RETRY_DELAY = 0.5
+
+COLUMNS = "id, result_id, timestamp, result, confidence, image_size, face_count, faces, thumbnail"
+
+
+def parse_time(value):
+    """Parse epoch seconds or an ISO 8601 timestamp to epoch seconds"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+class ResultLog:
+    """SQLite result history with batched background writes"""
+
+    def __init__(self, path, batch_size=64, flush_interval=0.2, max_pending=10000, keep_thumbnails=1000,
+                 logger=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.keep_thumbnails = keep_thumbnails
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._local = threading.local()
+        self._pending = {"results": 0, "faces": 0}
+        self._pending_lock = threading.Lock()
+        self.logger = logger or logging.getLogger(__name__)
+        # Results never written, by reason
+        self.dropped = {"queue_full": 0, "write_error": 0}
+        self._pruned_up_to = 0
+
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, name="result-log", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL makes NORMAL safe against corruption; a crash may lose the last batch
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def append(self, entry, thumbnail=None):
+        """Queue a result for writing; never blocks the caller"""
+        try:
+            self._queue.put_nowait((entry, thumbnail))
+        except queue.Full:
+            with self._pending_lock:
+                self.dropped["queue_full"] += 1
+            self.logger.warning("Result log queue full, dropped result %s", entry["id"])
+            return
+        with self._pending_lock:
+            self._pending["results"] += 1
+            self._pending["faces"] += entry["face_count"]
+
+    def queued(self):
+        """Number of results waiting to be written"""
+        return self._queue.qsize()
+
+    def close(self, timeout=5.0):
+        """Write everything queued so far and stop the writer"""
+        self._queue.put(None)
+        self._writer.join(timeout)
+
+    def _write_loop(self):
+        conn = self._connect()
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                pass
+            if None in batch:
+                running = False
+                batch = [item for item in batch if item is not None]
+            if not batch:
+                continue
+            try:
+                self._write_with_retry(conn, batch)
+            except sqlite3.Error as e:
+                with self._pending_lock:
+                    self.dropped["write_error"] += len(batch)
+                self.logger.error("Error writing result log, dropped %d results: %s", len(batch), e)
+            with self._pending_lock:
+                self._pending["results"] -= len(batch)
+                self._pending["faces"] -= sum(entry["face_count"] for entry, _ in batch)
+        conn.close()
+
+    def _write_with_retry(self, conn, batch):
+        """Write a batch, retrying while the database is locked or out of space"""
+        delay = WRITE_RETRY_DELAY
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                return self._write(conn, batch)
+            except sqlite3.OperationalError as e:
+                # The failed transaction was rolled back, so the batch is written whole or not at all
+                if attempt == WRITE_ATTEMPTS:
+                    raise
+                self.logger.warning("Error writing result log (attempt %d of %d), retrying: %s",
+                                    attempt, WRITE_ATTEMPTS, e)
+                time.sleep(delay)
+                delay *= 2
+
+    def _write(self, conn, batch):
+        pruned_up_to = self._pruned_up_to
+        with conn:
+            faces = 0
+            for entry, thumbnail in batch:
+                cursor = conn.execute(
+                    "INSERT INTO results (result_id, ts, timestamp, result, confidence, image_size, "
+                    "face_count, faces, thumbnail) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (entry["id"], parse_time(entry["timestamp"]), entry["timestamp"], entry["result"],
+                     entry["confidence"], entry["image_size"], entry["face_count"],
+                     json.dumps(entry["faces"]), thumbnail)
+                )
+                conn.executemany(
+                    "INSERT INTO result_faces (result, name) VALUES (?, ?)",
+                    [(cursor.lastrowid, name) for name in set(entry["faces"])]
+                )
+                faces += entry["face_count"]
+            conn.execute("UPDATE counters SET value = value + ? WHERE key = 'results'", (len(batch),))
+            conn.execute("UPDATE counters SET value = value + ? WHERE key = 'faces'", (faces,))
+
+            # Drop thumbnails that fell out of the newest keep_thumbnails rows
+            last_id = cursor.lastrowid
+            prune_to = last_id - self.keep_thumbnails
+            if prune_to > pruned_up_to:
+                conn.execute(
+                    "UPDATE results SET thumbnail = NULL WHERE id > ? AND id <= ?",
+                    (pruned_up_to, prune_to)
+                )
+                pruned_up_to = prune_to
+        # Only once committed: a rolled back prune is done again by the retry
+        self._pruned_up_to = pruned_up_to
+
+    def totals(self):
+        """Return (results, faces detected) over the whole history"""
+        counters = dict(self._reader().execute("SELECT key, value FROM counters"))
+        with self._pending_lock:
+            return (counters.get("results", 0) + self._pending["results"],
+                    counters.get("faces", 0) + self._pending["faces"])
+
+    def query(self, since=None, until=None, name=None, cursor=None, limit=20):
+        """
+        Return (entries, next_cursor), newest first.
+
+        ``since``/``until`` are epoch seconds (until is exclusive), ``name``
+        keeps results in which that person (or "Unknown") was seen, and
+        ``cursor`` is the next_cursor of the previous page.
+        """
+        where = []
+        params = []
+        if since is not None:
+            where.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("ts < ?")
+            params.append(until)
+        if name is not None:
+            where.append("id IN (SELECT result FROM result_faces WHERE name = ?)")
+            params.append(name)
+        if cursor is not None:
+            where.append("id < ?")
+            params.append(int(cursor))
+        sql = f"SELECT {COLUMNS} FROM results"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+
+        rows = self._reader().execute(sql, params).fetchall()
+        entries = [self._entry(row) for row in rows]
+        next_cursor = str(rows[-1][0]) if len(rows) == limit else None
+        return entries, next_cursor
+
+    @staticmethod
+    def _entry(row):
+        _, result_id, timestamp, result, confidence, image_size, face_count, faces, thumbnail = row
+        return {
+            "id": result_id,
+            "result": result,
+            "confidence": confidence,
+            "image_size": image_size,
+            "timestamp": timestamp,
+            "face_count": face_count,
+            "faces": json.loads(faces),
+            "thumbnail": None if thumbnail is None else base64.b64encode(thumbnail).decode('ascii'),
+        }
@@ -0,0 +1,60 @@
+"""
+In-memory cache of the images uploaded with recent identify results.
+
+Results and their thumbnails live in the result log; the uploaded images are
+only kept here, under a byte budget, and served on demand. Once the budget
+is exceeded the oldest images are dropped first.
+"""
+import secrets
+import threading
+from collections import OrderedDict
+
+
+def image_content_type(img_bytes):
+    """Guess the content type of an uploaded image from its first bytes"""
+    if bytes(img_bytes[:8]) == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    return 'image/jpeg'
+
+
+def new_result_id():
+    """Random id for a result, never reused across workers or restarts"""
+    return secrets.token_hex(8)
+
+
+class ResultStore:
+    """Byte-budgeted cache of result images, oldest dropped first"""
+
+    def __init__(self, max_image_bytes=64 * 1024 * 1024):
+        self.max_image_bytes = max_image_bytes
+        self._lock = threading.Lock()
+        # result id -> (image bytes, content type), oldest first
+        self._images = OrderedDict()
+        self._image_bytes = 0
+
+    def add(self, result_id, image):
+        """Keep a result's uploaded image while it fits the budget"""
+        if len(image) > self.max_image_bytes:
+            return
+        # Own the bytes: the upload buffer may be reused by the caller
+        image = bytes(image)
+        with self._lock:
+            self._images[result_id] = (image, image_content_type(image))
+            self._image_bytes += len(image)
+            while self._image_bytes > self.max_image_bytes:
+                _, (dropped, _) = self._images.popitem(last=False)
+                self._image_bytes -= len(dropped)
+
+    def image(self, result_id):
+        """Return (bytes, content type) of a result's full image, or None"""
+        return self._images.get(result_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "images": len(self._images),
+                "image_bytes": self._image_bytes,
+            }
+
+    def __len__(self):
+        return len(self._images)
@@ -1,48 +1,313 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, request, jsonify, render_template_string, g
+import admission
 import base64
-import cv2
 import numpy as np
 from datetime import datetime
 import json
 import os
+import atexit
+import threading
+import time
 import face_recognition
 
+import bulk_import
+import encoding_store
+import inference
+import metrics
+import shared_gallery
+from gallery import ENCODING_DIM, Gallery, best_per_person, match_centroids
+from admission import AdmissionController, Overloaded
+from inference import InferencePool, InferenceTimeout, PoolBusy
+from matchers import create_matcher
+from probe_cache import ProbeCache
+from events import EventBroker, format_event
+from face_thumbnails import KnownFaceThumbnails
+from result_log import ResultLog, parse_time
+from result_store import ResultStore, new_result_id
+from shared_gallery import SharedGallery
+from stream import DEFAULT_STREAM_OPTIONS, FramePipeline, StreamProcessor, mjpeg_frames
+from werkzeug.exceptions import RequestEntityTooLarge
+
 app = Flask(__name__)
 
-# Store recent results in memory (in production, use a database)
-recent_results = []
-MAX_RESULTS = 50
+# Result history with thumbnails, in SQLite shared by every worker. The
+# uploaded images are only kept in this worker's memory, up to a byte budget,
+# and served from /api/results/<id>/image.
+RESULT_DB = os.environ.get("FACE_RESULT_DB", "results.db")
+RESULT_THUMBNAILS_KEPT = int(os.environ.get("FACE_RESULT_THUMBNAILS", "1000"))
+result_log = ResultLog(RESULT_DB, keep_thumbnails=RESULT_THUMBNAILS_KEPT, logger=app.logger)
+atexit.register(result_log.close)
+RESULT_IMAGE_BUDGET = int(os.environ.get("FACE_RESULT_IMAGE_MB", "64")) * 1024 * 1024
+result_images = ResultStore(RESULT_IMAGE_BUDGET)
+# Results per page of /api/results: by default, and at most
+DASHBOARD_RESULTS = 20
+MAX_RESULTS_PAGE = 200
+
+# Dashboard thumbnails, made by the inference worker from the decoded frame
+THUMBNAIL_OPTIONS = inference.ThumbnailOptions(
+    int(os.environ.get("FACE_THUMBNAIL_SIDE", "480")),
+    int(os.environ.get("FACE_THUMBNAIL_QUALITY", "75")),
+    os.environ.get("FACE_THUMBNAIL_BOXES", "1") != "0"
+)
+# How long browsers may cache a result image; ids are never reused
+RESULT_IMAGE_MAX_AGE = 3600
 
-# Store known faces
-known_face_encodings = []
-known_face_names = []
+# Live dashboard updates over Server-Sent Events. Every open stream holds one
+# server thread, so keep the client limit below the gunicorn thread count;
+# refused dashboards fall back to polling.
+SSE_MAX_CLIENTS = int(os.environ.get("FACE_SSE_MAX_CLIENTS", "4"))
+SSE_MAX_PENDING = 32
+SSE_KEEPALIVE_SECONDS = 15
+event_broker = EventBroker(max_pending=SSE_MAX_PENDING, max_clients=SSE_MAX_CLIENTS)
 
 # Directory to store known faces
 KNOWN_FACES_DIR = "known_faces"
 os.makedirs(KNOWN_FACES_DIR, exist_ok=True)
 
+# Store known faces. By default every worker process maps the same gallery
+# from FACE_GALLERY_DIR (see shared_gallery); FACE_SHARED_GALLERY=0 keeps a
+# private copy per process. Spawned inference processes re-import this
+# module as __mp_main__ and never touch the gallery.
+SHARED_GALLERY = os.environ.get("FACE_SHARED_GALLERY", "1") != "0" and __name__ != '__mp_main__'
+if SHARED_GALLERY:
+    gallery = SharedGallery(
+        os.environ.get("FACE_GALLERY_DIR") or shared_gallery.default_directory(KNOWN_FACES_DIR)
+    )
+else:
+    gallery = Gallery()
+
+# Serialises changes to the known_faces directory and its encoding cache,
+# across workers when they share the gallery
+enroll_lock = gallery.write_lock if SHARED_GALLERY else threading.Lock()
+
+# Dashboard thumbnails of the known faces, rebuilt on gallery changes
+known_face_thumbnails = KnownFaceThumbnails(KNOWN_FACES_DIR)
+
+# Gallery search backend: "exact" brute force, "ivf" (approximate, for
+# 100k+ identities) or "int8" (brute force over int8 codes of the gallery,
+# re-ranking the QUANT_RERANK closest rows exactly). nprobe trades recall for
+# latency and can also be set per /identify request.
+MATCHER = os.environ.get("FACE_MATCHER", "exact")
+IVF_NLIST = int(os.environ.get("FACE_IVF_NLIST", "0"))
+IVF_NPROBE = int(os.environ.get("FACE_IVF_NPROBE", "8"))
+QUANT_RERANK = int(os.environ.get("FACE_QUANT_RERANK", "32"))
+
+matcher_options = {}
+if MATCHER == "ivf":
+    matcher_options = {"nlist": IVF_NLIST, "nprobe": IVF_NPROBE}
+elif MATCHER == "int8":
+    matcher_options = {"rerank": QUANT_RERANK}
+matcher = create_matcher(
+    MATCHER, os.path.join(KNOWN_FACES_DIR, encoding_store.STORE_DIRNAME), **matcher_options
+)
+
+# How a face is matched to people with several samples: "min" takes the
+# closest sample of anyone (through the matcher above); "centroid" shortlists
+# the CENTROID_SHORTLIST people with the closest mean encoding and re-ranks
+# on their samples, so the cost stays close to O(people).
+MATCH_STRATEGY = os.environ.get("FACE_MATCH_STRATEGY", "min")
+CENTROID_SHORTLIST = int(os.environ.get("FACE_CENTROID_SHORTLIST", "8"))
+
+# Most candidates a request may ask for per face with top_k; the matcher
+# sizes its result arrays (and the rows it ranks) by it
+MAX_TOP_K = int(os.environ.get("FACE_MAX_TOP_K", "10"))
+
+# Face detector: "hog" (CPU) or "cnn" (GPU); /identify/batch runs the CNN
+# detector on whole batches of same-sized frames. Detection can run on a
+# downscaled copy of the frame (see inference.DetectOptions); every setting
+# can be overridden per request with the model, upsample, scale, min_face,
+# max_side and decode_side params. Large JPEGs are decoded at 1/2, 1/4 or
+# 1/8 size while their longer side stays at least DECODE_SIDE pixels (0
+# always decodes at full size); set min_face to keep small faces findable.
+DETECTION_MODEL = os.environ.get("FACE_DETECTION_MODEL", "hog")
+DETECTION_UPSAMPLE = int(os.environ.get("FACE_DETECTION_UPSAMPLE", "1"))
+DETECTION_MIN_FACE = int(os.environ.get("FACE_DETECTION_MIN_FACE", "0"))
+DETECTION_MAX_SIDE = int(os.environ.get("FACE_DETECTION_MAX_SIDE", "0"))
+DECODE_SIDE = int(os.environ.get("FACE_DECODE_SIDE", "1920"))
+
+# Request bodies larger than MAX_UPLOAD_MB are answered with 413 before they
+# are read. Video streams are not limited, and import archives may be up to
+# MAX_IMPORT_MB.
+MAX_UPLOAD_BYTES = int(float(os.environ.get("FACE_MAX_UPLOAD_MB", "16")) * 1024 * 1024)
+MAX_IMPORT_BYTES = int(float(os.environ.get("FACE_MAX_IMPORT_MB", "2048")) * 1024 * 1024)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+UPLOAD_LIMITS = {"identify_stream": None, "import_faces": MAX_IMPORT_BYTES}
+
+# Most images accepted by one /identify/batch request
+MAX_BATCH_IMAGES = int(os.environ.get("FACE_MAX_BATCH_IMAGES", "32"))
+
+# Most faces accepted by one /identify/crops or /identify/encodings request;
+# these come from edge devices that detect (and encode) faces themselves
+MAX_REQUEST_FACES = int(os.environ.get("FACE_MAX_REQUEST_FACES", "64"))
+
+# Video streams posted to /identify/stream are processed on the request
+# thread, detecting every STREAM_DETECT_EVERY frames and tracking faces in
+# between (see stream.StreamOptions); at most MAX_STREAMS run at once.
+MAX_STREAMS = int(os.environ.get("FACE_MAX_STREAMS", "2"))
+STREAM_DETECT_EVERY = int(os.environ.get("FACE_STREAM_DETECT_EVERY", "10"))
+stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+# Archives posted to /faces/import are imported in a background thread (see
+# bulk_import), one at a time per worker, sharing the inference pool with
+# live requests
+import_slot = threading.Lock()
+
+# Decoding, detection and encoding run in this pool so a slow frame never
+# ties up the thread serving /health or the dashboard. FACE_INFERENCE_WORKERS
+# processes (0 = FACE_INFERENCE_THREADS threads in this process); at most
+# FACE_INFERENCE_QUEUE more requests wait before new ones get 429.
+inference_pool = InferencePool(
+    workers=int(os.environ.get("FACE_INFERENCE_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    threads=int(os.environ.get("FACE_INFERENCE_THREADS", "4")),
+    max_queue=int(os.environ.get("FACE_INFERENCE_QUEUE", "16")),
+    timeout=float(os.environ.get("FACE_INFERENCE_TIMEOUT", "30")),
+)
+
+# Admission control (see admission.py): /identify and /identify/batch are
+# served at the best quality tier predicted to finish within LATENCY_TARGET
+# seconds, and refused with 503 when even the cheapest tier would not.
+# 0 serves everything at full quality.
+LATENCY_TARGET = float(os.environ.get("FACE_LATENCY_TARGET", "2.0"))
+admission_control = AdmissionController(inference_pool.concurrency, LATENCY_TARGET)
+
+# Scans of recently identified uploads, so a resent frame skips decoding,
+# detection and encoding, and is not re-matched until the gallery changes.
+# FACE_PROBE_CACHE_PERCEPTUAL=1 also reuses the scan of a near-identical
+# frame (at most FACE_PROBE_CACHE_DISTANCE of 256 hash bits differ).
+probe_cache = ProbeCache(
+    int(os.environ.get("FACE_PROBE_CACHE_SIZE", "256")),
+    perceptual=os.environ.get("FACE_PROBE_CACHE_PERCEPTUAL", "0") == "1",
+    max_distance=int(os.environ.get("FACE_PROBE_CACHE_DISTANCE", "4")),
+)
+
+# Content types /identify and /add_face accept as a bare image body
+RAW_IMAGE_TYPES = ('image/jpeg', 'image/png', 'application/octet-stream')
+# Read size for raw bodies from servers whose input stream has no readinto()
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+# Hot-path metrics, exposed in Prometheus format at /metrics
+metrics_registry = metrics.Registry()
+STAGE_SECONDS = metrics_registry.histogram(
+    "face_stage_seconds", "Time spent in each stage of the identify pipeline", ["stage"]
+)
+PIPELINE_STAGES = ("parse", "base64", "hash", "decode", "convert", "resize", "detect", "encode", "thumbnail", "match", "store")
+stage_histograms = {stage: STAGE_SECONDS.labels(stage) for stage in PIPELINE_STAGES}
+REQUEST_SECONDS = metrics_registry.histogram(
+    "face_http_request_seconds", "HTTP request latency", ["endpoint"]
+)
+REQUESTS_TOTAL = metrics_registry.counter(
+    "face_http_requests_total", "HTTP requests served", ["endpoint", "status"]
+)
+IMAGES_TOTAL = metrics_registry.counter("face_images_processed_total", "Images run through detection").labels()
+FACES_TOTAL = metrics_registry.counter("face_faces_detected_total", "Faces detected").labels()
+PROBE_CACHE_LOOKUPS = metrics_registry.counter(
+    "face_probe_cache_lookups_total", "Probe cache lookups by outcome (hit, near_hit, miss)", ["outcome"]
+)
+PROBE_CACHE_REMATCHES = metrics_registry.counter(
+    "face_probe_cache_rematches_total", "Cached scans matched again after a gallery change"
+).labels()
+QUALITY_REQUESTS = metrics_registry.counter(
+    "face_quality_tier_requests_total", "Identify requests by quality tier served (or shed)", ["tier"]
+)
+STREAM_FRAMES = metrics_registry.counter(
+    "face_stream_frames_total", "Stream frames processed, by whether faces were detected or tracked", ["mode"]
+)
+
+def inference_task_counts():
+    stats = inference_pool.stats()
+    return {(state,): stats[state] for state in ("in_flight", "queued", "capacity")}
+
+metrics_registry.gauge("face_inference_tasks", "Inference tasks by state", inference_task_counts, ["state"])
+metrics_registry.gauge("face_gallery_encodings", "Live encodings in the gallery", lambda: len(gallery))
+metrics_registry.gauge("face_gallery_people", "Enrolled people", lambda: gallery.snapshot().person_count)
+metrics_registry.gauge("face_probe_cache_entries", "Scans held in the probe cache", lambda: len(probe_cache))
+metrics_registry.gauge("face_result_log_queued", "Results waiting to be written to the log", result_log.queued)
+metrics_registry.gauge(
+    "face_result_log_dropped", "Results never written to the log, by reason (queue_full, write_error)",
+    lambda: {(reason,): count for reason, count in result_log.dropped.items()}, ["reason"]
+)
+metrics_registry.gauge("face_sse_clients", "Connected live dashboards", lambda: event_broker.stats()["clients"])
+metrics_registry.gauge(
+    "face_sse_dropped_events", "Events dropped for slow live dashboards",
+    lambda: event_broker.stats()["dropped"]
+)
+metrics_registry.gauge(
+    "face_result_image_bytes", "Bytes of result images kept in memory",
+    lambda: result_images.stats()["image_bytes"]
+)
+
+def observe_stage(stage, seconds):
+    """Record the time one pipeline stage took"""
+    stage_histograms[stage].observe(seconds)
+
+def encode_face_file(path):
+    """Return the first face encoding found in an image file, or None"""
+    image = face_recognition.load_image_file(path)
+    encodings = face_recognition.face_encodings(image)
+    if encodings:
+        print(f"  ✓ Encoded face: {os.path.basename(path)}")
+        return encodings[0]
+    return None
+
 def load_known_faces():
-    """Load known faces from the known_faces directory"""
-    global known_face_encodings, known_face_names
-    
-    known_face_encodings = []
-    known_face_names = []
-    
+    """Load known faces from the known_faces directory, reusing cached encodings"""
     print("Loading known faces...")
-    for filename in os.listdir(KNOWN_FACES_DIR):
-        if filename.endswith(('.jpg', '.jpeg', '.png')):
-            path = os.path.join(KNOWN_FACES_DIR, filename)
-            image = face_recognition.load_image_file(path)
-            encodings = face_recognition.face_encodings(image)
-            
-            if encodings:
-                known_face_encodings.append(encodings[0])
-                # Use filename without extension as person's name
-                name = os.path.splitext(filename)[0]
-                known_face_names.append(name)
-                print(f"  ✓ Loaded face: {name}")
+    with enroll_lock:
+        names, encodings, stats = encoding_store.sync(KNOWN_FACES_DIR, encode_face_file)
+        gallery.replace(names, encodings)
+        matcher.rebuild(gallery.snapshot())
+    publish_gallery_change()
+    
+    print(f"  Reused {stats['reused']} cached, encoded {stats['encoded']}, "
+          f"removed {stats['removed']}")
+    print(f"Total known faces loaded: {len(gallery)}")
+
+def init_gallery():
+    """Load known faces at app startup, unless another worker already has"""
+    if SHARED_GALLERY and not gallery.created:
+        print(f"Attached to shared gallery in {gallery.directory}: {len(gallery)} known faces")
+        matcher.rebuild(gallery.snapshot())
+        return
+    load_known_faces()
+
+def publish_gallery_change():
+    """Tell live dashboards that the known faces changed"""
+    event_broker.publish("gallery", {
+        "version": gallery.version,
+        "known_faces_count": len(gallery.names())
+    })
+
+def face_files(name):
+    """Return the image files in KNOWN_FACES_DIR that belong to name"""
+    return [
+        filename for filename in encoding_store.list_face_images(KNOWN_FACES_DIR)
+        if encoding_store.name_for_file(filename) == name
+    ]
+
+def renamed_file(filename, new_name):
+    """Map name.jpg -> new_name.jpg and name/sample.jpg -> new_name/sample.jpg"""
+    directory, basename = os.path.split(filename)
+    if directory:
+        return f"{new_name}/{basename}"
+    return new_name + os.path.splitext(basename)[1]
+
+def remove_empty_person_dir(name):
+    """Drop a person's sample directory once its last image is gone"""
+    path = os.path.join(KNOWN_FACES_DIR, name)
+    if os.path.isdir(path) and not os.listdir(path):
+        os.rmdir(path)
+
+def match_known_faces(known, face_encodings, top_k=1, nprobe=None):
+    """Return (rows, distances) of the top_k distinct people for each encoding"""
+    if MATCH_STRATEGY == "centroid":
+        return match_centroids(known, face_encodings, tolerance=0.6, top_k=top_k,
+                               shortlist=CENTROID_SHORTLIST)
     
-    print(f"Total known faces loaded: {len(known_face_names)}")
+    # Ask for enough rows that top_k distinct people survive de-duplication
+    match_indices, match_distances = matcher.search(
+        known, face_encodings, tolerance=0.6, top_k=top_k * max(1, known.max_samples), nprobe=nprobe
+    )
+    return best_per_person(known, match_indices, match_distances, top_k)
 
 # HTML Template for the web interface
 HTML_TEMPLATE = """
@@ -151,6 +416,7 @@ HTML_TEMPLATE = """
             border-radius: 10px;
             margin-bottom: 15px;
             box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
+            cursor: zoom-in;
         }
         
         .result-info {
@@ -458,57 +724,145 @@ HTML_TEMPLATE = """
     
     <script>
         let uploadedImage = null;
+        let knownFacesVersion = null;
+        
+        // Latest dashboard state: a snapshot from /api/results or the stream,
+        // with streamed results applied on top
+        let dashboard = null;
         
         // Fetch and update dashboard data
         function updateDashboard() {
             fetch('/api/results')
+                .then(response => response.json())
+                .then(renderDashboard)
+                .catch(error => console.error('Error updating dashboard:', error));
+        }
+        
+        function renderDashboard(data) {
+            dashboard = data;
+            if (data.results && data.results.length > 0) {
+                // Update stats
+                document.getElementById('totalImages').textContent = data.total;
+                document.getElementById('knownFaces').textContent = data.known_faces_count || 0;
+                document.getElementById('facesDetected').textContent = data.total_faces_detected || 0;
+                
+                // Update latest result
+                const latest = data.results[0];
+                const latestImage = document.getElementById('latestImage');
+                if (latest.thumbnail && latestImage.dataset.resultId !== latest.id) {
+                    latestImage.dataset.resultId = latest.id;
+                    latestImage.src = 'data:image/jpeg;base64,' + latest.thumbnail;
+                    // Full-size image, fetched only when asked for
+                    latestImage.onclick = () => window.open('/api/results/' + latest.id + '/image');
+                }
+                document.getElementById('latestResult').textContent = latest.result;
+                document.getElementById('latestFaceCount').textContent = latest.face_count || 0;
+                
+                // Display face names
+                const facesDiv = document.getElementById('latestFaces');
+                facesDiv.innerHTML = '';
+                if (latest.faces && latest.faces.length > 0) {
+                    latest.faces.forEach(face => {
+                        const badge = document.createElement('span');
+                        badge.className = face === 'Unknown' ? 'face-badge unknown' : 'face-badge';
+                        badge.textContent = face;
+                        facesDiv.appendChild(badge);
+                    });
+                }
+                
+                const confidence = (latest.confidence * 100).toFixed(1);
+                document.getElementById('latestConfidence').style.width = confidence + '%';
+                document.getElementById('latestConfidence').textContent = confidence + '%';
+                document.getElementById('latestTime').textContent = 
+                    new Date(latest.timestamp).toLocaleString();
+                document.getElementById('latestSize').textContent = latest.image_size;
+                
+                // Update table
+                const tbody = document.getElementById('resultsBody');
+                tbody.innerHTML = '';
+                data.results.forEach(item => {
+                    const row = tbody.insertRow();
+                    row.insertCell(0).textContent = new Date(item.timestamp).toLocaleTimeString();
+                    row.insertCell(1).textContent = item.result;
+                    row.insertCell(2).textContent = item.face_count || 0;
+                });
+            }
+            
+            // Update known faces grid
+            updateKnownFaces(data.gallery_version);
+        }
+        
+        // Add one streamed result to the current state
+        function applyResult(event) {
+            if (!dashboard || dashboard.results.some(item => item.id === event.result.id)) {
+                return;
+            }
+            dashboard.results = [event.result].concat(dashboard.results).slice(0, 20);
+            dashboard.total = event.total;
+            dashboard.total_faces_detected = event.total_faces_detected;
+            renderDashboard(dashboard);
+        }
+        
+        function applyGallery(event) {
+            if (!dashboard) {
+                return;
+            }
+            dashboard.known_faces_count = event.known_faces_count;
+            dashboard.gallery_version = event.version;
+            document.getElementById('knownFaces').textContent = event.known_faces_count;
+            updateKnownFaces(event.version);
+        }
+        
+        // Live updates over Server-Sent Events; fall back to polling when the
+        // browser lacks EventSource or the server turns the stream away
+        function connectStream() {
+            if (!window.EventSource) {
+                startPolling();
+                return;
+            }
+            const source = new EventSource('/api/stream');
+            source.addEventListener('snapshot', e => {
+                stopPolling();
+                renderDashboard(JSON.parse(e.data));
+            });
+            source.addEventListener('result', e => applyResult(JSON.parse(e.data)));
+            source.addEventListener('gallery', e => applyGallery(JSON.parse(e.data)));
+            source.onerror = () => {
+                // The browser reconnects by itself unless the stream was
+                // refused; then poll, and try the stream again later
+                if (source.readyState === EventSource.CLOSED) {
+                    startPolling();
+                    setTimeout(connectStream, 30000);
+                }
+            };
+        }
+        
+        let pollTimer = null;
+        
+        function startPolling() {
+            if (pollTimer === null) {
+                updateDashboard();
+                pollTimer = setInterval(updateDashboard, 2000);
+            }
+        }
+        
+        function stopPolling() {
+            if (pollTimer !== null) {
+                clearInterval(pollTimer);
+                pollTimer = null;
+            }
+        }
+        
+        // Fetch the known faces only when the gallery version changed; the
+        // browser revalidates with If-None-Match, so unchanged faces cost a 304
+        function updateKnownFaces(version) {
+            if (version === knownFacesVersion) {
+                return;
+            }
+            fetch('/api/known_faces')
                 .then(response => response.json())
                 .then(data => {
-                    if (data.results && data.results.length > 0) {
-                        // Update stats
-                        document.getElementById('totalImages').textContent = data.total;
-                        document.getElementById('knownFaces').textContent = data.known_faces_count || 0;
-                        document.getElementById('facesDetected').textContent = data.total_faces_detected || 0;
-                        
-                        // Update latest result
-                        const latest = data.results[0];
-                        if (latest.image) {
-                            document.getElementById('latestImage').src = 'data:image/jpeg;base64,' + latest.image;
-                        }
-                        document.getElementById('latestResult').textContent = latest.result;
-                        document.getElementById('latestFaceCount').textContent = latest.face_count || 0;
-                        
-                        // Display face names
-                        const facesDiv = document.getElementById('latestFaces');
-                        facesDiv.innerHTML = '';
-                        if (latest.faces && latest.faces.length > 0) {
-                            latest.faces.forEach(face => {
-                                const badge = document.createElement('span');
-                                badge.className = face === 'Unknown' ? 'face-badge unknown' : 'face-badge';
-                                badge.textContent = face;
-                                facesDiv.appendChild(badge);
-                            });
-                        }
-                        
-                        const confidence = (latest.confidence * 100).toFixed(1);
-                        document.getElementById('latestConfidence').style.width = confidence + '%';
-                        document.getElementById('latestConfidence').textContent = confidence + '%';
-                        document.getElementById('latestTime').textContent = 
-                            new Date(latest.timestamp).toLocaleString();
-                        document.getElementById('latestSize').textContent = latest.image_size;
-                        
-                        // Update table
-                        const tbody = document.getElementById('resultsBody');
-                        tbody.innerHTML = '';
-                        data.results.forEach(item => {
-                            const row = tbody.insertRow();
-                            row.insertCell(0).textContent = new Date(item.timestamp).toLocaleTimeString();
-                            row.insertCell(1).textContent = item.result;
-                            row.insertCell(2).textContent = item.face_count || 0;
-                        });
-                    }
-                    
-                    // Update known faces grid
+                    knownFacesVersion = version;
                     if (data.known_faces && data.known_faces.length > 0) {
                         const grid = document.getElementById('knownFacesGrid');
                         grid.innerHTML = '';
@@ -523,7 +877,7 @@ HTML_TEMPLATE = """
                         });
                     }
                 })
-                .catch(error => console.error('Error updating dashboard:', error));
+                .catch(error => console.error('Error updating known faces:', error));
         }
         
         // Handle file selection
@@ -626,46 +980,147 @@ HTML_TEMPLATE = """
             });
         }
         
-        // Initial update and set interval
-        updateDashboard();
-        setInterval(updateDashboard, 2000);
+        // Initial snapshot and live updates
+        connectStream();
     </script>
 </body>
 </html>
 """
 
-def identify_image(image):
+def read_into_buffer(stream, length):
+    """Read up to length bytes from stream into one preallocated buffer"""
+    buf = bytearray(length)
+    view = memoryview(buf)
+    # gunicorn's request body has no readinto(); read it in chunks instead
+    readinto = getattr(stream, 'readinto', None)
+    received = 0
+    while received < length:
+        if readinto is not None:
+            n = readinto(view[received:])
+        else:
+            chunk = stream.read(min(UPLOAD_CHUNK_SIZE, length - received))
+            view[received:received + len(chunk)] = chunk
+            n = len(chunk)
+        if not n:
+            break
+        received += n
+    return view[:received]
+
+def read_body():
+    """Read a raw request body, failing with RequestEntityTooLarge past the upload limit"""
+    limit = request.max_content_length
+    if limit is not None:
+        # A chunked body is cut off at the stream's limit rather than failing,
+        # so read one byte more to tell a body of exactly the limit from a cut one
+        request.max_content_length = limit + 1
+    data = request.get_data(cache=False)
+    if limit is not None and len(data) > limit:
+        raise RequestEntityTooLarge()
+    return data
+
+def upload_buffer(upload):
+    """Return the contents of a multipart file upload as one buffer"""
+    stream = upload.stream
+    stream.seek(0, os.SEEK_END)
+    length = stream.tell()
+    stream.seek(0)
+    return read_into_buffer(stream, length)
+
+def read_image_upload():
     """
-    Identify faces in the image
+    Return (image bytes, params) for the request's image.
+    
+    Three body formats are accepted:
+    - raw image/jpeg, image/png or application/octet-stream, with params in
+      the query string; the body is read straight into the decode buffer
+    - multipart/form-data with an "image" file and params as form fields
+    - JSON {"image": base64, ...}
+    
+    Image bytes are None when the request carries no image.
     """
-    # Convert BGR to RGB (face_recognition uses RGB)
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    start = time.perf_counter()
+    if request.mimetype in RAW_IMAGE_TYPES:
+        if request.content_length is None:
+            img_bytes = read_body() or None
+        else:
+            img_bytes = read_into_buffer(request.stream, request.content_length) or None
+        observe_stage("parse", time.perf_counter() - start)
+        return img_bytes, request.args
+    
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        img_bytes = upload_buffer(upload) if upload else None
+        observe_stage("parse", time.perf_counter() - start)
+        return img_bytes, request.values
     
-    # Find all face locations and encodings
-    face_locations = face_recognition.face_locations(rgb_image)
-    face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
+    data = request.get_json()
+    observe_stage("parse", time.perf_counter() - start)
+    if not data or 'image' not in data:
+        return None, data or {}
     
+    start = time.perf_counter()
+    img_bytes = base64.b64decode(data['image'])
+    observe_stage("base64", time.perf_counter() - start)
+    return img_bytes, data
+
+def detect_options(params=None):
+    """Build detection options from the configured defaults and request params"""
+    params = params or {}
+    model = params.get('model', DETECTION_MODEL)
+    if model not in ("hog", "cnn"):
+        raise ValueError("model must be 'hog' or 'cnn'")
+    upsample = int(params.get('upsample', DETECTION_UPSAMPLE))
+    if not 0 <= upsample <= 3:
+        raise ValueError("upsample must be between 0 and 3")
+    scale = params.get('scale')
+    if scale is not None:
+        scale = float(scale)
+        if not 0 < scale <= 1:
+            raise ValueError("scale must be in (0, 1]")
+    min_face = int(params.get('min_face', DETECTION_MIN_FACE)) or None
+    max_side = int(params.get('max_side', DETECTION_MAX_SIDE)) or None
+    decode_side = int(params.get('decode_side', DECODE_SIDE)) or None
+    return inference.DetectOptions(model, upsample, scale, min_face, max_side, decode_side)
+
+def match_params(params=None):
+    """Return (top_k, nprobe) from request params"""
+    params = params or {}
+    try:
+        top_k = int(params.get('top_k', 1))
+    except (TypeError, ValueError):
+        raise ValueError("top_k must be an integer")
+    if not 1 <= top_k <= MAX_TOP_K:
+        raise ValueError(f"top_k must be between 1 and {MAX_TOP_K}")
+    nprobe = params.get('nprobe')
+    if nprobe is not None:
+        try:
+            nprobe = int(nprobe)
+        except (TypeError, ValueError):
+            raise ValueError("nprobe must be an integer")
+        if nprobe < 1:
+            raise ValueError("nprobe must be at least 1")
+    return top_k, nprobe
+
+def describe_faces(scan, known, match_indices, match_distances):
+    """Build the result for one image from its scan and gallery matches"""
+    face_locations = scan.locations
     face_names = []
+    candidates = []
     confidence = 0.0
     
-    # Loop through each face found
-    for face_encoding in face_encodings:
+    for indices, distances in zip(match_indices, match_distances):
         name = "Unknown"
         face_confidence = 0.0
         
-        if len(known_face_encodings) > 0:
-            # See if the face matches any known face
-            matches = face_recognition.compare_faces(known_face_encodings, face_encoding, tolerance=0.6)
-            face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
-            
-            if len(face_distances) > 0:
-                best_match_index = np.argmin(face_distances)
-                
-                if matches[best_match_index]:
-                    name = known_face_names[best_match_index]
-                    face_confidence = 1 - face_distances[best_match_index]
+        if indices[0] >= 0:
+            name = known.names[indices[0]]
+            face_confidence = float(1 - distances[0])
         
         face_names.append(name)
+        candidates.append([
+            {"name": known.names[i], "distance": float(d)}
+            for i, d in zip(indices, distances) if i >= 0
+        ])
         confidence = max(confidence, face_confidence)
     
     # Generate result message
@@ -682,17 +1137,258 @@ def identify_image(image):
         unknown_count = len(face_names) - known_count
         result = f"{len(face_locations)} faces: {known_count} known, {unknown_count} unknown"
     
-    height, width = image.shape[:2]
+    # Crops and client encodings come without their frame
+    image_size = "-"
+    if scan.shape is not None:
+        height, width = scan.shape[:2]
+        image_size = f"{width}x{height}"
     
     return {
         "result": result,
         "confidence": confidence if confidence > 0 else 0.5,
-        "image_size": f"{width}x{height}",
+        "image_size": image_size,
         "timestamp": datetime.now().isoformat(),
         "face_count": len(face_locations),
-        "faces": face_names
+        "faces": face_names,
+        "candidates": candidates,
+        "detection_scale": round(scan.scale, 4),
+        "timings": {stage: round(ms, 2) for stage, ms in scan.timings.items()}
     }
 
+def stream_options(params):
+    """Build stream options from the configured defaults and request params"""
+    detect_every = int(params.get('detect_every', STREAM_DETECT_EVERY))
+    if detect_every < 1:
+        raise ValueError("detect_every must be at least 1")
+    motion = float(params.get('motion', DEFAULT_STREAM_OPTIONS.motion_threshold))
+    if not 0 <= motion <= 1:
+        raise ValueError("motion must be between 0 and 1")
+    return DEFAULT_STREAM_OPTIONS._replace(detect_every=detect_every, motion_threshold=motion)
+
+def match_stream_faces(encodings):
+    """Return (name, confidence) for each face encoding of a stream"""
+    start = time.perf_counter()
+    known = gallery.snapshot()
+    match_indices, match_distances = match_known_faces(known, encodings)
+    observe_stage("match", time.perf_counter() - start)
+    return [
+        (known.names[indices[0]], float(1 - distances[0])) if indices[0] >= 0 else ("Unknown", 0.0)
+        for indices, distances in zip(match_indices, match_distances)
+    ]
+
+def identify_scans(scans, top_k=1, nprobe=None, entries=None):
+    """
+    Match the faces of several scanned images in one gallery pass
+    
+    entries optionally holds each scan's probe cache entry (or None): their
+    last match is reused while the gallery version is unchanged, and fresh
+    matches are kept in them.
+    """
+    # Match every face against one consistent view of the gallery in a single
+    # batched pass, even if /add_face or a delete lands while this request is
+    # running; deleted rows never match
+    for scan in scans:
+        for stage, ms in scan.timings.items():
+            observe_stage(stage, ms / 1000)
+    # Scans served from the probe cache did not run through detection
+    detected = [scan for scan in scans if "detect" in scan.timings]
+    FACES_TOTAL.inc(sum(len(scan.locations) for scan in detected))
+    IMAGES_TOTAL.inc(len(detected))
+    
+    start = time.perf_counter()
+    known = gallery.snapshot()
+    entries = entries or [None] * len(scans)
+    match_key = (known.version, top_k, nprobe)
+    # Each entry's match is read once: another request may replace it meanwhile
+    cached = [None if entry is None else entry.match_for(match_key) for entry in entries]
+    unmatched = [i for i, match in enumerate(cached) if match is None]
+    match_indices, match_distances = match_known_faces(
+        known, [e for i in unmatched for e in scans[i].encodings], top_k=top_k, nprobe=nprobe
+    )
+    observe_stage("match", time.perf_counter() - start)
+    
+    matches = {}
+    offset = 0
+    for i in unmatched:
+        end = offset + len(scans[i].locations)
+        matches[i] = (match_indices[offset:end], match_distances[offset:end])
+        offset = end
+        if entries[i] is not None and entries[i].keep_match(match_key, *matches[i]):
+            PROBE_CACHE_REMATCHES.inc()
+    
+    results = []
+    for i, scan in enumerate(scans):
+        indices, distances = matches[i] if i in matches else cached[i]
+        results.append(describe_faces(scan, known, indices, distances))
+    return results
+
+def lookup_scan(img_bytes, options, thumbnail=THUMBNAIL_OPTIONS):
+    """Look an upload up in the probe cache; returns (probe, entry, hash_ms)"""
+    start = time.perf_counter()
+    probe, entry = probe_cache.lookup(img_bytes, (options, thumbnail))
+    PROBE_CACHE_LOOKUPS.labels(probe.outcome).inc()
+    return probe, entry, (time.perf_counter() - start) * 1000
+
+def cached_scan(entry, hash_ms):
+    """The scan of a cache hit; only the lookup shows in its timings"""
+    return entry.scan._replace(timings={"hash": hash_ms})
+
+def cache_scan(probe, scan, hash_ms):
+    """Keep a fresh scan in the probe cache; returns (scan, entry)"""
+    scan = scan._replace(timings=dict(scan.timings, hash=hash_ms))
+    if scan.shape is None:
+        return scan, None
+    return scan, probe_cache.store(probe, scan)
+
+def identify_images(images, top_k=1, nprobe=None):
+    """
+    Identify faces in several images, matching all of them in one gallery pass
+    """
+    return identify_scans(inference.scan_images(images, detect_options()), top_k=top_k, nprobe=nprobe)
+
+def identify_image(image, top_k=1, nprobe=None):
+    """
+    Identify faces in the image
+    """
+    return identify_images([image], top_k=top_k, nprobe=nprobe)[0]
+
+def busy_response(error):
+    """429 telling the client when to retry"""
+    response = jsonify({
+        "status": "error",
+        "message": str(error)
+    })
+    g.quality = "shed"
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
+def too_large_response(limit):
+    """413 for a request body over its endpoint's limit"""
+    return jsonify({
+        "status": "error",
+        "message": f"Request body too large (limit {limit // (1024 * 1024)} MB)"
+    }), 413
+
+def admit_request(images=1, degradable=True):
+    """Admit an identify request; returns its admission ticket or raises Overloaded"""
+    try:
+        ticket = admission_control.admit(images, degradable)
+    except Overloaded:
+        QUALITY_REQUESTS.labels("shed").inc()
+        raise
+    QUALITY_REQUESTS.labels(ticket.tier.name).inc()
+    return ticket
+
+def overloaded_response(error):
+    """503 for a request shed because no quality tier would meet the latency target"""
+    g.quality = "shed"
+    response = jsonify({
+        "status": "error",
+        "message": str(error),
+        "quality": "shed"
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+def timeout_response(error):
+    """504 for a request whose inference ran past its timeout"""
+    return jsonify({
+        "status": "error",
+        "message": str(error)
+    }), 504
+
+def store_result(result, scan, img_bytes):
+    """Keep a result, its thumbnail and the uploaded image (if any) for the dashboard"""
+    start = time.perf_counter()
+    result_entry = {
+        "id": new_result_id(),
+        "result": result["result"],
+        "confidence": result["confidence"],
+        "image_size": result["image_size"],
+        "timestamp": result["timestamp"],
+        "face_count": result["face_count"],
+        "faces": result["faces"],
+        "thumbnail": base64.b64encode(scan.thumbnail).decode('ascii') if scan.thumbnail else None
+    }
+    
+    # Written to the log in the background
+    result_log.append(result_entry, scan.thumbnail)
+    if img_bytes is not None:
+        result_images.add(result_entry["id"], img_bytes)
+    total, total_faces = result_log.totals()
+    event_broker.publish("result", {
+        "result": result_entry,
+        "total": total,
+        "total_faces_detected": total_faces
+    })
+    observe_stage("store", time.perf_counter() - start)
+    return result_entry
+
+def dashboard_snapshot(results=None, next_cursor=None):
+    """Everything the dashboard shows, except the known faces' images"""
+    if results is None:
+        results, next_cursor = result_log.query(limit=DASHBOARD_RESULTS)
+    total, total_faces = result_log.totals()
+    # Known faces with images are listed by /api/known_faces; the version
+    # tells the dashboard when to fetch that again
+    return {
+        "status": "success",
+        "total": total,
+        "total_faces_detected": total_faces,
+        "known_faces_count": len(gallery.names()),
+        "gallery_version": gallery.version,
+        "results": results,
+        "next_cursor": next_cursor
+    }
+
+def result_response(result, top_k):
+    """The public part of a result returned to API clients"""
+    response = {
+        "status": "success",
+        "result": result["result"],
+        "confidence": result["confidence"],
+        "image_size": result["image_size"],
+        "timestamp": result["timestamp"],
+        "face_count": result["face_count"],
+        "faces": result["faces"],
+        "detection_scale": result["detection_scale"],
+        "timings": result["timings"]
+    }
+    if top_k > 1:
+        response["candidates"] = result["candidates"]
+    return response
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.before_request
+def limit_request_size():
+    # Reject a declared oversized body before reading any of it; chunked
+    # bodies raise RequestEntityTooLarge once they pass the limit
+    limit = UPLOAD_LIMITS.get(request.endpoint, MAX_UPLOAD_BYTES)
+    request.max_content_length = limit
+    if limit is not None and request.content_length is not None and request.content_length > limit:
+        return too_large_response(limit)
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(error):
+    return too_large_response(request.max_content_length or MAX_UPLOAD_BYTES)
+
+@app.after_request
+def record_request_metrics(response):
+    if 'quality' in g:
+        response.headers['X-Quality-Tier'] = g.quality
+    endpoint = request.endpoint or "unmatched"
+    REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - g.request_start)
+    REQUESTS_TOTAL.labels(endpoint, str(response.status_code)).inc()
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics for this worker process"""
+    return metrics_registry.render(), 200, {'Content-Type': metrics_registry.content_type}
+
 @app.route('/')
 def index():
     """Serve the web dashboard"""
@@ -700,93 +1396,572 @@ def index():
 
 @app.route('/identify', methods=['POST'])
 def identify():
-    """Receive image, process it, and return results"""
+    """
+    Receive image (JSON base64, raw image body or multipart), process it, and return results.
+    
+    Under load the image is scanned at a lower quality tier (see admission);
+    the response's quality field and X-Quality-Tier header name it.
+    """
+    ticket = None
     try:
-        data = request.get_json()
+        img_bytes, params = read_image_upload()
         
-        if 'image' not in data:
+        if img_bytes is None:
             return jsonify({
                 "status": "error",
                 "message": "No image provided"
             }), 400
         
-        # Decode base64 image
-        img_base64 = data['image']
-        img_bytes = base64.b64decode(img_base64)
+        try:
+            options = detect_options(params)
+            top_k, nprobe = match_params(params)
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
         
-        # Convert to numpy array
-        nparr = np.frombuffer(img_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        ticket = admit_request()
+        g.quality = ticket.tier.name
+        options, thumbnail = admission.degrade(options, THUMBNAIL_OPTIONS, ticket.tier)
+        
+        # Decode, detect and encode in the inference pool, unless this
+        # image was scanned recently
+        probe, entry, hash_ms = lookup_scan(img_bytes, options, thumbnail)
+        if entry is None:
+            scan = inference_pool.run(inference.analyze, img_bytes, options, False, thumbnail)
+            ticket.observe([scan])
+            scan, entry = cache_scan(probe, scan, hash_ms)
+        else:
+            scan = cached_scan(entry, hash_ms)
         
-        if image is None:
+        if scan.shape is None:
             return jsonify({
                 "status": "error",
                 "message": "Failed to decode image"
             }), 400
         
-        # Identify faces
-        result = identify_image(image)
+        # Identify faces, optionally listing the closest top_k known faces
+        result = identify_scans([scan], top_k=top_k, nprobe=nprobe, entries=[entry])[0]
         
-        # Store result with image
-        result_entry = {
-            "result": result["result"],
-            "confidence": result["confidence"],
-            "image_size": result["image_size"],
-            "timestamp": result["timestamp"],
-            "face_count": result["face_count"],
-            "faces": result["faces"],
-            "image": img_base64
-        }
-        
-        recent_results.insert(0, result_entry)
-        if len(recent_results) > MAX_RESULTS:
-            recent_results.pop()
+        # Store result with its thumbnail and image
+        store_result(result, scan, img_bytes)
         
         # Return response
-        response = {
-            "status": "success",
-            "result": result["result"],
-            "confidence": result["confidence"],
-            "image_size": result["image_size"],
-            "timestamp": result["timestamp"],
-            "face_count": result["face_count"],
-            "faces": result["faces"]
-        }
+        response = result_response(result, top_k)
+        response["quality"] = ticket.tier.name
         
         print(f"Processed image: {result['result']}")
         
         return jsonify(response), 200
         
+    except Overloaded as e:
+        return overloaded_response(e)
+    except PoolBusy as e:
+        return busy_response(e)
+    except InferenceTimeout as e:
+        return timeout_response(e)
+    except RequestEntityTooLarge:
+        return too_large_response(request.max_content_length)
     except Exception as e:
         print(f"Error processing request: {e}")
         return jsonify({
             "status": "error",
             "message": str(e)
         }), 500
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+@app.route('/identify/batch', methods=['POST'])
+def identify_batch():
+    """
+    Identify faces in several images at once.
+    
+    Accepts JSON {"images": [base64, ...]} or multipart/form-data with one
+    or more "image" files. Results come back in request order; an image
+    that fails to decode gets an error entry instead of failing the batch.
+    The whole batch is served at one quality tier (see admission).
+    """
+    ticket = None
+    try:
+        if request.files:
+            uploads = request.files.getlist('image')
+            raw_images = [upload_buffer(upload) for upload in uploads]
+            params = request.values
+            encoded = [None] * len(raw_images)
+        else:
+            data = request.get_json()
+            if not data or not isinstance(data.get('images'), list):
+                return jsonify({
+                    "status": "error",
+                    "message": "No images provided"
+                }), 400
+            encoded = data['images']
+            raw_images = None
+            params = data
+        
+        if not encoded:
+            return jsonify({
+                "status": "error",
+                "message": "No images provided"
+            }), 400
+        
+        if len(encoded) > MAX_BATCH_IMAGES:
+            return jsonify({
+                "status": "error",
+                "message": f"At most {MAX_BATCH_IMAGES} images per batch"
+            }), 400
+        
+        buffers = []
+        errors = {}
+        for i in range(len(encoded)):
+            try:
+                buffers.append(raw_images[i] if raw_images is not None else base64.b64decode(encoded[i]))
+            except Exception as e:
+                buffers.append(b'')
+                errors[i] = str(e)
+        
+        try:
+            options = detect_options(params)
+            top_k, nprobe = match_params(params)
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+        
+        ticket = admit_request(len(buffers))
+        g.quality = ticket.tier.name
+        options, thumbnail = admission.degrade(options, THUMBNAIL_OPTIONS, ticket.tier)
+        
+        # Images scanned recently come from the probe cache
+        lookups = [lookup_scan(img_bytes, options, thumbnail) for img_bytes in buffers]
+        scans = [None if entry is None else cached_scan(entry, hash_ms) for _, entry, hash_ms in lookups]
+        entries = [entry for _, entry, _ in lookups]
+        missed = [i for i, entry in enumerate(entries) if entry is None]
+        
+        # Decode, detect and encode the rest in the inference pool: the CNN
+        # detector takes them all in one task, otherwise they are split into
+        # one chunk per worker
+        if missed:
+            if options.model == "cnn":
+                chunk_size = len(missed)
+            else:
+                chunk_size = -(-len(missed) // inference_pool.concurrency)
+            chunks = [missed[i:i + chunk_size] for i in range(0, len(missed), chunk_size)]
+            chunk_scans = inference_pool.run_many(
+                inference.analyze_batch,
+                [([buffers[i] for i in chunk], options, thumbnail) for chunk in chunks]
+            )
+            for chunk, chunk_result in zip(chunks, chunk_scans):
+                if isinstance(chunk_result, Exception):
+                    chunk_result = [chunk_result] * len(chunk)
+                ticket.observe(chunk_result)
+                for i, scan in zip(chunk, chunk_result):
+                    if isinstance(scan, Exception):
+                        scans[i] = scan
+                    else:
+                        probe, _, hash_ms = lookups[i]
+                        scans[i], entries[i] = cache_scan(probe, scan, hash_ms)
+        
+        for i, scan in enumerate(scans):
+            if isinstance(scan, Exception):
+                errors.setdefault(i, str(scan))
+            elif scan.shape is None:
+                errors.setdefault(i, "Failed to decode image")
+        
+        results = iter(identify_scans(
+            [scan for i, scan in enumerate(scans) if i not in errors],
+            top_k=top_k, nprobe=nprobe,
+            entries=[entry for i, entry in enumerate(entries) if i not in errors]
+        ))
+        
+        responses = []
+        for i in range(len(encoded)):
+            if i in errors:
+                responses.append({"status": "error", "message": errors[i]})
+                continue
+            result = next(results)
+            store_result(result, scans[i], buffers[i])
+            responses.append(result_response(result, top_k))
+        
+        print(f"Processed batch: {len(encoded) - len(errors)} images, {len(errors)} errors")
+        
+        return jsonify({
+            "status": "success",
+            "count": len(responses),
+            "quality": ticket.tier.name,
+            "results": responses
+        }), 200
+        
+    except Overloaded as e:
+        return overloaded_response(e)
+    except PoolBusy as e:
+        return busy_response(e)
+    except InferenceTimeout as e:
+        return timeout_response(e)
+    except RequestEntityTooLarge:
+        return too_large_response(request.max_content_length)
+    except Exception as e:
+        print(f"Error processing batch: {e}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+def parse_boxes(value, count):
+    """Face boxes of count crops from JSON: null or a list of [top, right, bottom, left] or null"""
+    if value is None:
+        return None
+    boxes = json.loads(value) if isinstance(value, str) else value
+    if not isinstance(boxes, list) or len(boxes) != count:
+        raise ValueError(f"boxes must list one box (or null) per crop, {count} in all")
+    for box in boxes:
+        if box is not None and not (
+            isinstance(box, list) and len(box) == 4 and all(isinstance(v, int) for v in box)
+        ):
+            raise ValueError("Each box must be [top, right, bottom, left] in crop pixels")
+    return boxes
+
+def read_crops():
+    """
+    Return (crop buffers, boxes, params) of an /identify/crops request.
+    
+    A raw image body is one crop (box in the query string as
+    top,right,bottom,left); multipart takes one or more "crop" files and a
+    JSON "boxes" field; JSON is {"crops": [base64, ...], "boxes": [...]}.
+    """
+    if request.mimetype in RAW_IMAGE_TYPES:
+        img_bytes, params = read_image_upload()
+        crops = [img_bytes] if img_bytes is not None else []
+        box = params.get('box')
+        boxes = [[int(v) for v in box.split(',')]] if box else None
+        return crops, parse_boxes(boxes, len(crops)), params
+    
+    if request.mimetype == 'multipart/form-data':
+        crops = [upload_buffer(upload) for upload in request.files.getlist('crop')]
+        return crops, parse_boxes(request.form.get('boxes'), len(crops)), request.values
+    
+    data = request.get_json(silent=True) or {}
+    crops = data.get('crops') or []
+    if not isinstance(crops, list):
+        raise ValueError("crops must be a list of base64 images")
+    start = time.perf_counter()
+    crops = [base64.b64decode(crop) for crop in crops]
+    observe_stage("base64", time.perf_counter() - start)
+    return crops, parse_boxes(data.get('boxes'), len(crops)), data
+
+def read_encodings():
+    """
+    Return (encodings, params) of an /identify/encodings request.
+    
+    The body is either application/octet-stream, N * 128 little-endian
+    float32 values (float64 with ?dtype=float64), or JSON
+    {"encodings": [[128 numbers], ...]}.
+    """
+    start = time.perf_counter()
+    if request.mimetype == 'application/octet-stream':
+        params = request.args
+        dtype = params.get('dtype', 'float32')
+        if dtype not in ('float32', 'float64'):
+            raise ValueError("dtype must be float32 or float64")
+        data = read_body()
+        row_bytes = ENCODING_DIM * np.dtype(dtype).itemsize
+        if len(data) % row_bytes:
+            raise ValueError(f"Body must be a whole number of {ENCODING_DIM}-d {dtype} encodings")
+        encodings = np.frombuffer(data, dtype=np.dtype(dtype).newbyteorder('<')).reshape(-1, ENCODING_DIM)
+    else:
+        params = request.get_json(silent=True) or {}
+        try:
+            encodings = np.asarray(params.get('encodings', []), dtype=np.float32)
+        except (TypeError, ValueError):
+            raise ValueError("encodings must be a list of number lists")
+        if encodings.size and (encodings.ndim != 2 or encodings.shape[1] != ENCODING_DIM):
+            raise ValueError(f"Each encoding must have {ENCODING_DIM} numbers")
+        encodings = encodings.reshape(-1, ENCODING_DIM)
+    if not np.isfinite(encodings).all():
+        raise ValueError("Encodings must be finite")
+    observe_stage("parse", time.perf_counter() - start)
+    return encodings.astype(np.float32, copy=False), params
+
+def identify_faces(scan, params, top_k, nprobe):
+    """Match a scan of crops or client encodings, store and return the response"""
+    result = identify_scans([scan], top_k=top_k, nprobe=nprobe)[0]
+    if str(params.get('store', True)).lower() not in ('false', '0'):
+        store_result(result, scan, None)
+    return result_response(result, top_k)
+
+def face_count_error(count):
+    """400 for a crops or encodings request without faces or with too many"""
+    if count == 0:
+        return jsonify({
+            "status": "error",
+            "message": "No faces provided"
+        }), 400
+    if count > MAX_REQUEST_FACES:
+        return jsonify({
+            "status": "error",
+            "message": f"At most {MAX_REQUEST_FACES} faces per request"
+        }), 400
+    return None
+
+@app.route('/identify/crops', methods=['POST'])
+def identify_crops():
+    """
+    Identify faces cropped out of a frame by the client, skipping detection.
+    
+    Each crop holds one face: the whole crop, or its box when given. All
+    crops are treated as the faces of one frame. Optional params: top_k,
+    nprobe, and store=false to keep the result out of the history.
+    
+    Crops are encoded in the inference pool, so under load they are shed
+    like frames (see admission); with no detection to degrade, the ones
+    admitted are served at full quality.
+    """
+    ticket = None
+    try:
+        try:
+            crops, boxes, params = read_crops()
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": f"Invalid crops: {e}"
+            }), 400
+        
+        error = face_count_error(len(crops))
+        if error:
+            return error
+        
+        try:
+            top_k, nprobe = match_params(params)
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+        
+        ticket = admit_request(degradable=False)
+        g.quality = ticket.tier.name
+        try:
+            scan = inference_pool.run(inference.encode_crops, crops, boxes)
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+        
+        response = identify_faces(scan, params, top_k, nprobe)
+        response["quality"] = ticket.tier.name
+        
+        print(f"Processed crops: {response['result']}")
+        
+        return jsonify(response), 200
+        
+    except Overloaded as e:
+        return overloaded_response(e)
+    except PoolBusy as e:
+        return busy_response(e)
+    except InferenceTimeout as e:
+        return timeout_response(e)
+    except RequestEntityTooLarge:
+        return too_large_response(request.max_content_length)
+    except Exception as e:
+        print(f"Error processing crops: {e}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+@app.route('/identify/encodings', methods=['POST'])
+def identify_encodings():
+    """
+    Match face encodings computed by the client against the gallery.
+    
+    Nothing is decoded or encoded, so this costs a gallery match and
+    little more. Optional params: top_k, nprobe, and store=false to keep
+    the result out of the history. With no inference pool work there is
+    nothing for admission control to degrade or shed: always full quality.
+    """
+    try:
+        try:
+            encodings, params = read_encodings()
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": f"Invalid encodings: {e}"
+            }), 400
+        
+        error = face_count_error(len(encodings))
+        if error:
+            return error
+        
+        try:
+            top_k, nprobe = match_params(params)
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+        
+        scan = inference.Scan(None, [None] * len(encodings), encodings, None, {}, 1.0, None)
+        response = identify_faces(scan, params, top_k, nprobe)
+        g.quality = admission.QUALITY_TIERS[0].name
+        response["quality"] = g.quality
+        
+        print(f"Processed encodings: {response['result']}")
+        
+        return jsonify(response), 200
+        
+    except RequestEntityTooLarge:
+        return too_large_response(request.max_content_length)
+    except Exception as e:
+        print(f"Error processing encodings: {e}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route('/identify/stream', methods=['POST'])
+def identify_stream():
+    """
+    Identify the faces in a video stream.
+    
+    The body is an MJPEG stream (multipart/x-mixed-replace) or JPEG frames
+    sent back to back, e.g. with chunked transfer encoding. Faces are
+    detected every detect_every frames or on motion and tracked in between;
+    a face is only encoded and matched when its track is new or was lost.
+    Once the body ends, returns every track with its identity plus frame
+    counts and throughput.
+    
+    Streams run in their request thread rather than the inference pool and
+    are bounded by MAX_STREAMS instead of admission control: one beyond
+    that is shed, the others are served at full quality.
+    """
+    if not stream_slots.acquire(blocking=False):
+        g.quality = "shed"
+        response = jsonify({
+            "status": "error",
+            "message": "Too many streams in progress",
+            "quality": "shed"
+        })
+        response.headers['Retry-After'] = "5"
+        return response, 503
+    g.quality = admission.QUALITY_TIERS[0].name
+    try:
+        processor = StreamProcessor(
+            match_stream_faces, stream_options(request.args), detect_options(request.args),
+            version=lambda: gallery.version
+        )
+        pipeline = FramePipeline(mjpeg_frames(request.stream))
+        try:
+            for image in pipeline:
+                processor.process(image)
+        finally:
+            pipeline.close()
+        
+        stats = dict(processor.stats.report(), undecodable_frames=pipeline.undecodable)
+        STREAM_FRAMES.labels("detect").inc(stats["detect_frames"])
+        STREAM_FRAMES.labels("track").inc(stats["tracked_frames"])
+        tracks = processor.summary()
+        print(f"Processed stream: {stats['frames']} frames, {len(tracks)} tracks, "
+              f"{stats['fps_per_core']} fps per core")
+        
+        return jsonify({
+            "status": "success",
+            "quality": g.quality,
+            "tracks": tracks,
+            "stats": stats
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        print(f"Error processing stream: {e}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+    finally:
+        stream_slots.release()
+
+def enroll_scan(name, scan, replace=False):
+    """
+    Enroll the single face of an /add_face scan; returns the person's sample count.
+    
+    The image is saved to the known_faces directory and the encoding we
+    already have is added, instead of re-encoding the whole directory. A
+    person's first image is {name}.jpg; further samples go to {name}/ unless
+    replace asks to drop the existing ones.
+    """
+    encoding = scan.encodings[0]
+    with enroll_lock:
+        store = encoding_store.EncodingStore(KNOWN_FACES_DIR)
+        existing_files = face_files(name)
+        if replace:
+            for existing_file in existing_files:
+                os.remove(os.path.join(KNOWN_FACES_DIR, existing_file))
+                store.delete(existing_file)
+            remove_empty_person_dir(name)
+            existing_files = []
+        
+        filename = f"{name}.jpg"
+        if filename in existing_files:
+            os.makedirs(os.path.join(KNOWN_FACES_DIR, name), exist_ok=True)
+            filename = f"{name}/{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jpg"
+        
+        with open(os.path.join(KNOWN_FACES_DIR, filename), 'wb') as f:
+            f.write(scan.jpeg)
+        store.put(filename, name, encoding)
+        if replace:
+            gallery.update(name, encoding)
+        else:
+            gallery.add(name, encoding)
+        matcher.sync(gallery.snapshot())
+        samples = gallery.sample_count(name)
+    publish_gallery_change()
+    return samples
 
 @app.route('/add_face', methods=['POST'])
 def add_face():
-    """Add a new face to known faces"""
+    """Add a new face to known faces (JSON base64, raw image body or multipart)"""
     try:
-        data = request.get_json()
+        img_bytes, params = read_image_upload()
         
-        if 'image' not in data or 'name' not in data:
+        if img_bytes is None or 'name' not in params:
             return jsonify({
                 "status": "error",
                 "message": "Image and name required"
             }), 400
         
-        name = data['name'].strip()
-        img_base64 = data['image']
+        name = params['name'].strip()
+        
+        if not encoding_store.is_valid_name(name):
+            return jsonify({
+                "status": "error",
+                "message": "Invalid name"
+            }), 400
+        
+        # Decode the image and check that it holds exactly one face in the
+        # inference pool; the worker hands back the image re-encoded as JPEG
+        scan = inference_pool.run(inference.analyze, img_bytes, inference.DEFAULT_OPTIONS, True)
         
-        # Decode image
-        img_bytes = base64.b64decode(img_base64)
-        nparr = np.frombuffer(img_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if scan.shape is None:
+            return jsonify({
+                "status": "error",
+                "message": "Failed to decode image"
+            }), 400
         
-        # Check if face exists
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        face_encodings = face_recognition.face_encodings(rgb_image)
+        face_encodings = scan.encodings
         
         if len(face_encodings) == 0:
             return jsonify({
@@ -800,21 +1975,23 @@ def add_face():
                 "message": "Multiple faces detected. Please use image with single face"
             }), 400
         
-        # Save image to known_faces directory
-        filename = f"{name}.jpg"
-        filepath = os.path.join(KNOWN_FACES_DIR, filename)
-        cv2.imwrite(filepath, image)
-        
-        # Reload known faces
-        load_known_faces()
+        replace = str(params.get('replace', False)).lower() in ('true', '1')
+        samples = enroll_scan(name, scan, replace)
         
-        print(f"Added new face: {name}")
+        print(f"Added face sample {samples} for: {name}")
         
         return jsonify({
             "status": "success",
-            "message": f"Face '{name}' added successfully"
+            "message": f"Face '{name}' added successfully",
+            "samples": samples
         }), 200
         
+    except PoolBusy as e:
+        return busy_response(e)
+    except InferenceTimeout as e:
+        return timeout_response(e)
+    except RequestEntityTooLarge:
+        return too_large_response(request.max_content_length)
     except Exception as e:
         print(f"Error adding face: {e}")
         return jsonify({
@@ -822,55 +1999,373 @@ def add_face():
             "message": str(e)
         }), 500
 
+@app.route('/faces/<name>', methods=['DELETE'])
+def delete_face(name):
+    """Remove a known face and its images"""
+    try:
+        if not encoding_store.is_valid_name(name):
+            return jsonify({
+                "status": "error",
+                "message": "Invalid name"
+            }), 400
+        
+        with enroll_lock:
+            filenames = face_files(name)
+            if not filenames and name not in gallery:
+                return jsonify({
+                    "status": "error",
+                    "message": f"Face '{name}' not found"
+                }), 404
+            
+            store = encoding_store.EncodingStore(KNOWN_FACES_DIR)
+            for filename in filenames:
+                os.remove(os.path.join(KNOWN_FACES_DIR, filename))
+                store.delete(filename)
+            remove_empty_person_dir(name)
+            gallery.remove(name)
+            matcher.sync(gallery.snapshot())
+        publish_gallery_change()
+        
+        print(f"Deleted face: {name}")
+        
+        return jsonify({
+            "status": "success",
+            "message": f"Face '{name}' deleted successfully"
+        }), 200
+        
+    except Exception as e:
+        print(f"Error deleting face: {e}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route('/faces/<name>', methods=['PATCH'])
+def rename_face(name):
+    """Rename a known face"""
+    try:
+        data = request.get_json()
+        
+        if not data or 'name' not in data:
+            return jsonify({
+                "status": "error",
+                "message": "New name required"
+            }), 400
+        
+        new_name = data['name'].strip()
+        if not encoding_store.is_valid_name(name) or not encoding_store.is_valid_name(new_name):
+            return jsonify({
+                "status": "error",
+                "message": "Invalid name"
+            }), 400
+        
+        with enroll_lock:
+            filenames = face_files(name)
+            if not filenames and name not in gallery:
+                return jsonify({
+                    "status": "error",
+                    "message": f"Face '{name}' not found"
+                }), 404
+            if new_name != name and (face_files(new_name) or new_name in gallery):
+                return jsonify({
+                    "status": "error",
+                    "message": f"Face '{new_name}' already exists"
+                }), 409
+            
+            store = encoding_store.EncodingStore(KNOWN_FACES_DIR)
+            for filename in filenames:
+                new_filename = renamed_file(filename, new_name)
+                new_path = os.path.join(KNOWN_FACES_DIR, new_filename)
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                os.rename(os.path.join(KNOWN_FACES_DIR, filename), new_path)
+                store.rename(filename, new_filename, new_name)
+            remove_empty_person_dir(name)
+            gallery.rename(name, new_name)
+        publish_gallery_change()
+        
+        print(f"Renamed face: {name} -> {new_name}")
+        
+        return jsonify({
+            "status": "success",
+            "message": f"Face '{name}' renamed to '{new_name}'"
+        }), 200
+        
+    except Exception as e:
+        print(f"Error renaming face: {e}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+def run_bulk_import(source, archive_path, dedupe_distance):
+    """Import an uploaded archive into the gallery; runs in a background thread"""
+    def scan_images(buffers):
+        while True:
+            try:
+                return inference_pool.run_many(
+                    inference.analyze, [(buf, inference.DEFAULT_OPTIONS, True) for buf in buffers]
+                )
+            except PoolBusy as e:
+                time.sleep(e.retry_after)
+    
+    def enroll(items):
+        for _, name, encoding in items:
+            gallery.add(name, encoding)
+        matcher.sync(gallery.snapshot())
+        publish_gallery_change()
+    
+    try:
+        importer = bulk_import.BulkImporter(
+            KNOWN_FACES_DIR, scan_images, dedupe_distance, lock=enroll_lock, on_enroll=enroll,
+            chunk_size=inference_pool.concurrency
+        )
+        report = importer.run(source)
+        print(f"Import {report['import_id']} enrolled {report['enrolled']} of {report['images']} images")
+    except Exception as e:
+        print(f"Error importing faces: {e}")
+    finally:
+        source.close()
+        os.remove(archive_path)
+        import_slot.release()
+
+@app.route('/faces/import', methods=['POST'])
+def import_faces():
+    """
+    Start a bulk import of a zip or tar archive of face photos.
+    
+    The archive is the multipart "archive" file, laid out like known_faces/;
+    dedupe_distance is optional. Answers 202 with the import id: progress
+    and the final report are at GET /faces/import/<id>. Posting the same
+    archive again resumes an interrupted import.
+    """
+    try:
+        upload = request.files.get('archive')
+        if not upload:
+            return jsonify({
+                "status": "error",
+                "message": "Archive required"
+            }), 400
+        try:
+            dedupe_distance = float(request.form.get('dedupe_distance', bulk_import.DEDUPE_DISTANCE))
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": f"Invalid dedupe_distance: {e}"
+            }), 400
+        
+        if not import_slot.acquire(blocking=False):
+            return jsonify({
+                "status": "error",
+                "message": "An import is already running"
+            }), 409
+        try:
+            imports_dir = os.path.dirname(bulk_import.import_paths(KNOWN_FACES_DIR, "upload")[0])
+            os.makedirs(imports_dir, exist_ok=True)
+            archive_path = os.path.join(imports_dir, f"upload-{os.getpid()}-{threading.get_ident()}")
+            upload.save(archive_path)
+            try:
+                source = bulk_import.ImportSource(archive_path, upload.filename)
+            except (ValueError, OSError):
+                os.remove(archive_path)
+                import_slot.release()
+                return jsonify({
+                    "status": "error",
+                    "message": "Archive must be a zip or tar file"
+                }), 400
+            import_id = source.import_id()
+            bulk_import.begin_import(KNOWN_FACES_DIR, import_id)
+            threading.Thread(
+                target=run_bulk_import, args=(source, archive_path, dedupe_distance),
+                name=f"import-{import_id}", daemon=True
+            ).start()
+        except BaseException:
+            import_slot.release()
+            raise
+        
+        print(f"Started import {import_id}: {len(source.images)} images")
+        
+        return jsonify({
+            "status": "accepted",
+            "import_id": import_id,
+            "images": len(source.images),
+            "status_url": f"/faces/import/{import_id}"
+        }), 202
+        
+    except RequestEntityTooLarge:
+        return too_large_response(request.max_content_length)
+    except Exception as e:
+        print(f"Error starting import: {e}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route('/faces/import/<import_id>', methods=['GET'])
+def get_import(import_id):
+    """Progress of a bulk import, or its report once it has finished or failed"""
+    try:
+        status = None
+        if import_id.isalnum():
+            status = bulk_import.import_status(KNOWN_FACES_DIR, import_id)
+        if status is None:
+            return jsonify({
+                "status": "error",
+                "message": f"Import '{import_id}' not found"
+            }), 404
+        
+        return jsonify(dict(status, status="success", import_id=import_id)), 200
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
 @app.route('/api/results', methods=['GET'])
 def get_results():
-    """Get recent results for dashboard"""
+    """
+    Get recent results for dashboard, newest first.
+    
+    Optional query parameters: since and until (ISO 8601 or epoch seconds,
+    until exclusive), name (results in which that person was seen, or
+    "Unknown"), limit, and cursor (next_cursor of the previous page).
+    Totals always cover the whole history.
+    """
     try:
-        total = len(recent_results)
-        total_faces = sum(r.get('face_count', 0) for r in recent_results)
-        
-        # Get known faces with images
-        known_faces_list = []
-        for name in known_face_names:
-            img_path = os.path.join(KNOWN_FACES_DIR, f"{name}.jpg")
-            if os.path.exists(img_path):
-                with open(img_path, 'rb') as f:
-                    img_data = base64.b64encode(f.read()).decode('utf-8')
-                    known_faces_list.append({
-                        "name": name,
-                        "image": f"data:image/jpeg;base64,{img_data}"
-                    })
+        try:
+            since = request.args.get('since')
+            until = request.args.get('until')
+            limit = int(request.args.get('limit', DASHBOARD_RESULTS))
+            cursor = request.args.get('cursor')
+            if cursor is not None:
+                int(cursor)
+            if not 1 <= limit <= MAX_RESULTS_PAGE:
+                raise ValueError(f"limit must be between 1 and {MAX_RESULTS_PAGE}")
+            results, next_cursor = result_log.query(
+                since=parse_time(since) if since else None,
+                until=parse_time(until) if until else None,
+                name=request.args.get('name'),
+                cursor=cursor,
+                limit=limit
+            )
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": f"Invalid query: {e}"
+            }), 400
         
+        return jsonify(dashboard_snapshot(results, next_cursor)), 200
+    except Exception as e:
         return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route('/api/stream', methods=['GET'])
+def stream_results():
+    """
+    Server-Sent Events stream of dashboard updates.
+    
+    Starts with a "snapshot" event (the /api/results payload), then sends a
+    "result" event per new result and a "gallery" event per known-faces
+    change. A client reconnecting with Last-Event-ID gets the events it
+    missed instead, and a client too slow to keep up gets a new snapshot.
+    """
+    subscribed = event_broker.subscribe(request.headers.get('Last-Event-ID', type=int))
+    if subscribed is None:
+        response = jsonify({
+            "status": "error",
+            "message": "Too many live clients, poll /api/results instead"
+        })
+        response.headers['Retry-After'] = str(SSE_KEEPALIVE_SECONDS)
+        return response, 503
+    subscription, missed = subscribed
+    
+    def generate():
+        try:
+            # Reconnect delay for the browser, in milliseconds
+            yield "retry: 3000\n\n"
+            if missed is None:
+                yield format_event("snapshot", dashboard_snapshot())
+            elif missed:
+                yield "".join(missed)
+            while True:
+                messages, resync = subscription.drain(SSE_KEEPALIVE_SECONDS)
+                if resync:
+                    yield format_event("snapshot", dashboard_snapshot())
+                elif messages:
+                    yield "".join(messages)
+                else:
+                    # Comment line; also how a closed connection is noticed
+                    yield ": keep-alive\n\n"
+        finally:
+            event_broker.unsubscribe(subscription)
+    
+    return app.response_class(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/known_faces', methods=['GET'])
+def get_known_faces():
+    """Known people with a thumbnail each; answers 304 when unchanged"""
+    try:
+        # Read the version first: if the gallery changes meanwhile, the
+        # listing is rebuilt again on the next call
+        version = gallery.version
+        faces, etag = known_face_thumbnails.listing(gallery.names(), version)
+        
+        response = jsonify({
             "status": "success",
-            "total": total,
-            "total_faces_detected": total_faces,
-            "known_faces_count": len(known_face_names),
-            "known_faces": known_faces_list,
-            "results": recent_results[:20]
-        }), 200
+            "version": version,
+            "count": len(faces),
+            "known_faces": faces
+        })
+        response.set_etag(etag)
+        # Cache, but revalidate every time
+        response.cache_control.no_cache = True
+        response.headers['X-Gallery-Version'] = str(version)
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": str(e)
         }), 500
 
+@app.route('/api/results/<result_id>/image', methods=['GET'])
+def get_result_image(result_id):
+    """Full-size image of a recent result, while it is still kept in memory"""
+    image = result_images.image(result_id)
+    if image is None:
+        return jsonify({
+            "status": "error",
+            "message": "Image not available"
+        }), 404
+    
+    img_bytes, content_type = image
+    response = app.response_class(img_bytes, mimetype=content_type)
+    response.set_etag(result_id)
+    response.cache_control.private = True
+    response.cache_control.max_age = RESULT_IMAGE_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
     return jsonify({
         "status": "ok",
-        "known_faces": len(known_face_names)
+        "known_faces": len(gallery),
+        "inference": inference_pool.stats(),
+        "admission": admission_control.stats()
     }), 200
 
+# Load known faces on startup, also when gunicorn imports the app
+if __name__ != '__mp_main__':
+    init_gallery()
+
 if __name__ == '__main__':
     print("=" * 60)
     print("Starting Face Recognition Server")
-    print("=" * 60)
-    
-    # Load known faces on startup
-    load_known_faces()
-    
     print("=" * 60)
     print(f"Web Dashboard: http://0.0.0.0:5000")
     print(f"API Endpoint: http://0.0.0.0:5000/identify")
@@ -879,7 +2374,7 @@ if __name__ == '__main__':
     print("=" * 60)
     print("\nTo add known faces:")
     print("1. Place images in 'known_faces/' folder")
-    print("2. Name format: PersonName.jpg")
+    print("2. Name format: PersonName.jpg, or several images in PersonName/")
     print("3. Or use the web interface to add faces")
     print("=" * 60)
     
@@ -0,0 +1,358 @@
+"""
+Gallery shared by every worker process through memory-mapped files.
+
+Each gunicorn worker used to hold its own copy of the gallery and only saw
+the enrollments it served itself. ``SharedGallery`` keeps the gallery's
+arrays (encodings, squared norms, tombstones, person ids and centroids) in
+memory-mapped files in one directory, on ``/dev/shm`` by default:
+
+* ``segment-<n>/``  - one ``.npy`` file per array, plus ``names.json`` with
+  the row names as of the reset that started the current log
+* ``log-<n>.jsonl`` - changes since that reset: add, update, remove, rename
+* ``control``       - current segment, log and log length, guarded by a
+  sequence counter so a reader never sees a half-written update
+* ``lock``          - flock()ed by the process changing the gallery
+* ``members``       - share-locked by every attached process; if nobody
+  holds it, the files are left over from an earlier run and are discarded
+
+A process changing the gallery takes the lock, catches up with the log,
+writes the arrays in place exactly as ``Gallery`` does and appends the change
+to the log. The other processes notice the longer log on their next
+``snapshot()`` (one read of the control block) and replay it against their
+Python bookkeeping only - names, person index and row lists - because the
+arrays already hold the change. Enrollments are therefore visible to every
+worker at once, the matrix exists once whatever the worker count, and
+snapshots are zero-copy views of the mapped files.
+
+Growing past capacity, compaction and ``replace()`` write a new segment, and
+a reset also starts a new log. Old files are unlinked straight away; a
+worker still matching against them keeps its mapping until it catches up.
+A change that fails before it is committed is backed out: the writer
+reloads the committed state, and a segment it had started is removed.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from gallery import ENCODING_DIM, INITIAL_CAPACITY, Gallery
+
+CONTROL_FILE = "control"
+LOCK_FILE = "lock"
+MEMBERS_FILE = "members"
+NAMES_FILE = "names.json"
+
+# attribute -> (dtype, shape of one element); rows first, then people
+ROW_ARRAYS = {
+    "_buffer": (np.float32, (ENCODING_DIM,)),
+    "_sq_norms": (np.float32, ()),
+    "_active": (np.bool_, ()),
+    "_person_ids": (np.intp, ()),
+}
+PERSON_ARRAYS = {
+    "_centroids": (np.float32, (ENCODING_DIM,)),
+    "_centroid_sq_norms": (np.float32, ()),
+    "_centroid_sums": (np.float64, (ENCODING_DIM,)),
+    "_sample_counts": (np.intp, ()),
+}
+
+
+def default_directory(faces_dir):
+    """Shared-memory directory for the gallery of one known faces directory"""
+    key = hashlib.sha1(os.path.abspath(faces_dir).encode('utf-8')).hexdigest()[:12]
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"face-gallery-{key}")
+
+
+class ProcessLock:
+    """Re-entrant lock held across threads and processes (flock on a file)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._open()
+        # A forked child must not share the parent's lock
+        os.register_at_fork(after_in_child=self._open)
+
+    def _open(self):
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+
+class SharedGallery(Gallery):
+    """Gallery whose arrays live in memory-mapped files shared by processes"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._version = 0
+        self._replaying = False
+        # Held while changing the gallery; callers may hold it around a
+        # sequence of changes that must not interleave with other workers
+        self.write_lock = ProcessLock(os.path.join(directory, LOCK_FILE))
+        self._segment = 0
+        self._log = 0
+        self._applied = 0
+        self._seen = None
+        self._new_log = False
+
+        with self.write_lock:
+            self._control = self._open_control()
+            self._members = os.open(os.path.join(directory, MEMBERS_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(self._members, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.created = True
+            except BlockingIOError:
+                self.created = False
+            if self.created:
+                # Nobody else is attached: start over with an empty gallery
+                self._remove_files(keep=None)
+                self._reset([], np.empty((0, ENCODING_DIM)))
+                self._commit({"op": "replace"})
+            fcntl.flock(self._members, fcntl.LOCK_SH)
+            with self._lock:
+                self._refresh()
+
+    def _open_control(self):
+        path = os.path.join(self.directory, CONTROL_FILE)
+        with open(path, 'ab') as f:
+            if f.tell() < 32:
+                f.write(bytes(32 - f.tell()))
+        return np.memmap(path, dtype=np.uint64, mode='r+', shape=(4,))
+
+    def _read_control(self):
+        """Return (segment, log, log length) as last published by a writer"""
+        control = self._control
+        while True:
+            seq = int(control[0])
+            if not seq & 1:
+                state = (int(control[1]), int(control[2]), int(control[3]))
+                if int(control[0]) == seq:
+                    return state
+            time.sleep(0)
+
+    def _write_control(self, segment, log, length):
+        control = self._control
+        control[0] += 1
+        control[1:] = (segment, log, length)
+        control[0] += 1
+
+    def _segment_path(self, segment, filename=""):
+        return os.path.join(self.directory, f"segment-{segment}", filename)
+
+    def _log_path(self, log):
+        return os.path.join(self.directory, f"log-{log}.jsonl")
+
+    def _remove_files(self, keep):
+        """Unlink every segment and log except the (segment, log) in keep"""
+        kept = set() if keep is None else {f"segment-{keep[0]}", f"log-{keep[1]}.jsonl"}
+        for filename in os.listdir(self.directory):
+            if filename in kept or not filename.startswith(("segment-", "log-")):
+                continue
+            path = os.path.join(self.directory, filename)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+    # -- reading -------------------------------------------------------------
+
+    def snapshot(self):
+        """Return the current view, first catching up with other processes"""
+        if self._read_control() != self._seen:
+            with self._lock:
+                self._refresh()
+        return self._snapshot
+
+    def names(self):
+        self.snapshot()
+        return super().names()
+
+    def sample_count(self, name):
+        self.snapshot()
+        return super().sample_count(name)
+
+    def __contains__(self, name):
+        self.snapshot()
+        return super().__contains__(name)
+
+    def _refresh(self):
+        """Replay changes written by other processes; caller holds self._lock"""
+        while True:
+            state = self._read_control()
+            if state == self._seen:
+                return
+            segment, log, length = state
+            try:
+                if log != self._log:
+                    self._map_segment(segment)
+                    with open(self._segment_path(segment, NAMES_FILE)) as f:
+                        names = json.load(f)
+                    self._replay(lambda: self._reset(names, None))
+                    self._log, self._applied = log, 0
+                elif segment != self._segment:
+                    self._map_segment(segment)
+                if length > self._applied:
+                    with open(self._log_path(log), 'rb') as f:
+                        f.seek(self._applied)
+                        data = f.read(length - self._applied)
+                    self._replay(lambda: [self._apply(json.loads(line)) for line in data.splitlines()])
+                    self._applied = length
+            except FileNotFoundError:
+                # A writer replaced the segment or log meanwhile; start over
+                continue
+            self._seen = state
+            self._publish()
+            return
+
+    def _map_segment(self, segment):
+        arrays = {
+            attr: np.load(self._segment_path(segment, attr[1:] + ".npy"), mmap_mode='r+').view(np.ndarray)
+            for attr in (*ROW_ARRAYS, *PERSON_ARRAYS)
+        }
+        for attr, array in arrays.items():
+            setattr(self, attr, array)
+        self._segment = segment
+
+    def _replay(self, apply):
+        self._replaying = True
+        try:
+            apply()
+        finally:
+            self._replaying = False
+
+    def _apply(self, record):
+        op, name = record["op"], record["name"]
+        if op in ("remove", "update"):
+            self._deactivate(name)
+        if op in ("add", "update"):
+            self._append(name, None)
+        if op == "rename":
+            self._rename(name, record["to"])
+
+    # -- writing -------------------------------------------------------------
+
+    @contextmanager
+    def _change(self, record):
+        """Hold the write lock around one change and log it afterwards"""
+        with self.write_lock:
+            with self._lock:
+                self._refresh()
+            self._new_log = False
+            try:
+                yield
+                self._commit(record)
+            except BaseException:
+                self._rollback()
+                raise
+
+    def _rollback(self):
+        """Back out a change that failed before it was committed; caller holds the write lock"""
+        with self._lock:
+            # Map the committed segment again and replay its whole log
+            self._seen = self._log = None
+            self._refresh()
+        # Drop any segment the failed change had started
+        self._remove_files(keep=self._seen)
+
+    def _commit(self, record):
+        if self._new_log:
+            log, length = self._log + 1, 0
+            with open(self._segment_path(self._segment, NAMES_FILE), 'w') as f:
+                json.dump(self._names, f)
+            open(self._log_path(log), 'wb').close()
+        else:
+            log = self._log
+            line = (json.dumps(record) + "\n").encode('utf-8')
+            with open(self._log_path(log), 'ab') as f:
+                f.write(line)
+            length = self._applied + len(line)
+        with self._lock:
+            self._log, self._applied = log, length
+            self._seen = (self._segment, log, length)
+            self._write_control(*self._seen)
+        self._remove_files(keep=self._seen)
+
+    def replace(self, names, encodings):
+        with self._change({"op": "replace"}):
+            super().replace(names, encodings)
+
+    def add(self, name, encoding):
+        with self._change({"op": "add", "name": name}):
+            super().add(name, encoding)
+
+    def update(self, name, encoding):
+        with self._change({"op": "update", "name": name}):
+            super().update(name, encoding)
+
+    def remove(self, name):
+        with self._change({"op": "remove", "name": name}):
+            return super().remove(name)
+
+    def rename(self, old_name, new_name):
+        with self._change({"op": "rename", "name": old_name, "to": new_name}):
+            return super().rename(old_name, new_name)
+
+    def _reset(self, names, encodings):
+        if not self._replaying:
+            self._new_log = True
+        super()._reset(names, encodings)
+
+    def _allocate(self, capacity, person_capacity):
+        self._new_segment(capacity, person_capacity)
+
+    def _grow_rows(self, count):
+        self._new_segment(max(count * 2, INITIAL_CAPACITY), len(self._centroids), copy=True)
+
+    def _grow_people(self, people):
+        self._new_segment(len(self._buffer), max(people * 2, INITIAL_CAPACITY), copy=True)
+
+    def _new_segment(self, capacity, person_capacity, copy=False):
+        """Map a fresh segment, optionally copying the current arrays into it"""
+        segment = self._segment + 1
+        path = self._segment_path(segment)
+        # Left behind by a writer that failed or died before committing it;
+        # no reader maps a segment the control block never named
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        for arrays, size in ((ROW_ARRAYS, capacity), (PERSON_ARRAYS, person_capacity)):
+            for attr, (dtype, shape) in arrays.items():
+                # New files read as zeros: inactive rows, empty centroid sums
+                array = np.lib.format.open_memmap(
+                    self._segment_path(segment, attr[1:] + ".npy"), mode='w+',
+                    dtype=dtype, shape=(size,) + shape
+                ).view(np.ndarray)
+                if copy:
+                    old = getattr(self, attr)
+                    array[:len(old)] = old
+                setattr(self, attr, array)
+        if copy:
+            shutil.copyfile(self._segment_path(self._segment, NAMES_FILE),
+                            self._segment_path(segment, NAMES_FILE))
+        self._segment = segment
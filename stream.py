@@ -0,0 +1,488 @@
+"""
+Streaming ingest: identify the faces in a sequence of video frames.
+
+Running ``identify_image()`` on every frame decodes, detects and encodes each
+one from scratch. ``StreamProcessor`` instead
+
+* runs full detection only every ``detect_every`` frames, or sooner when
+  something moved outside the tracked faces or a track was lost,
+* follows faces between detections by template matching on a small grey
+  copy of the frame, which costs well under a millisecond per face, and
+* encodes and matches a face only when its track is new or the tracker lost
+  confidence in it; otherwise the track keeps its identity. When the gallery
+  changes, tracks are re-matched from the encodings they keep.
+
+``FramePipeline`` decodes frames on a background thread while the previous
+frame is processed. Frames come from ``mjpeg_frames()`` (an MJPEG stream over
+HTTP, or JPEGs uploaded back to back) or ``video_frames()`` (a video file or
+camera, for testing). ``StreamStats`` reports throughput per wall-clock
+second and per CPU second, i.e. frames/sec per core.
+
+``python stream.py SOURCE`` runs a video file, camera index or MJPEG URL
+against the known faces and prints the tracks and throughput.
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+import face_recognition
+import numpy as np
+
+import encoding_store
+import inference
+from gallery import Gallery, match
+
+# How frames of a stream are processed:
+# - detect_every: run full detection at least every this many frames
+# - motion_threshold: fraction of pixels outside tracked faces that must
+#   change since the last detection to trigger one early (0 disables)
+# - min_track_score: template-match score below which a track is lost, so
+#   the next frame is detected and the face re-encoded
+# - max_missed: detections a track may go unseen before it is dropped
+# - track_side: longer side of the grey frame used for tracking and motion
+StreamOptions = namedtuple("StreamOptions", [
+    "detect_every", "motion_threshold", "min_track_score", "max_missed", "track_side",
+])
+DEFAULT_STREAM_OPTIONS = StreamOptions(10, 0.02, 0.6, 2, 320)
+
+# Grey level change that counts a pixel as moved
+MOTION_PIXEL_DELTA = 25
+# Detections and tracks overlapping at least this much are the same face
+MIN_IOU = 0.3
+# Smallest face, in tracking pixels, worth a template; larger faces are
+# shrunk to TEMPLATE_SIDE, which keeps template matching cheap
+MIN_TEMPLATE_SIDE = 8
+TEMPLATE_SIDE = 32
+MAX_FRAME_BYTES = 8 * 1024 * 1024
+
+
+def mjpeg_frames(stream, chunk_size=64 * 1024, max_frame_bytes=MAX_FRAME_BYTES):
+    """
+    Yield the JPEG frames read from a file-like object.
+
+    Works on multipart/x-mixed-replace (MJPEG) bodies and on JPEGs simply
+    concatenated: frames are found by their JPEG markers, so part headers
+    and boundaries are skipped. Raises ValueError on a frame larger than
+    max_frame_bytes.
+    """
+    buf = bytearray()
+    # Offset of the current frame's image data once its headers are in, and
+    # how far that data was already searched for the end-of-image marker
+    data = -1
+    searched = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        buf += chunk
+        while True:
+            if data < 0:
+                start = buf.find(b'\xff\xd8')
+                if start < 0:
+                    # Keep a trailing 0xff: it may begin the next frame's marker
+                    del buf[:max(0, len(buf) - 1)]
+                    break
+                del buf[:start]
+                data = searched = _image_data(buf)
+            end = buf.find(b'\xff\xd9', searched) if data >= 0 else -1
+            if end < 0:
+                if data >= 0:
+                    searched = max(data, len(buf) - 1)
+                if len(buf) > max_frame_bytes:
+                    raise ValueError(f"Stream frame larger than {max_frame_bytes} bytes")
+                break
+            yield bytes(buf[:end + 2])
+            del buf[:end + 2]
+            data = -1
+
+
+def _image_data(buf):
+    """Return the offset of the image data of the JPEG starting buf, or -1 if incomplete"""
+    # Walk the marker segments up to the image data, so an EXIF thumbnail's
+    # end-of-image marker isn't taken for the frame's
+    i = 2
+    while i + 4 <= len(buf):
+        if buf[i] != 0xFF:
+            # Not a marker where one belongs; look for the end from here
+            return i
+        marker = buf[i + 1]
+        if marker == 0xFF:
+            i += 1
+        elif marker == 0xDA:
+            return i + 2
+        else:
+            i += 2 + int.from_bytes(buf[i + 2:i + 4], 'big')
+    return -1
+
+
+def video_frames(source):
+    """Yield BGR frames from a video file, camera index or stream URL"""
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video source {source!r}")
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            yield frame
+    finally:
+        capture.release()
+
+
+class FramePipeline:
+    """
+    Decodes frames on a background thread, a few frames ahead of the consumer.
+
+    ``frames`` yields encoded images or already decoded BGR arrays. With
+    ``live=True`` (a camera that won't wait) the oldest decoded frame is
+    dropped when the consumer falls behind; otherwise the reader waits.
+    """
+
+    _END = object()
+
+    def __init__(self, frames, depth=2, live=False):
+        self.live = live
+        self.dropped = 0
+        self.undecodable = 0
+        self._frames = frames
+        self._queue = queue.Queue(maxsize=depth)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="frame-decoder", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            for frame in self._frames:
+                if self._stopped:
+                    return
+                image = frame if isinstance(frame, np.ndarray) else inference.decode_image(frame)
+                if image is None:
+                    self.undecodable += 1
+                    continue
+                self._put(image)
+        except Exception as e:
+            self._put(e)
+        finally:
+            self._put(self._END)
+
+    def _put(self, item):
+        while not self._stopped:
+            if self.live and item is not self._END and self._queue.full():
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is self._END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self):
+        """Stop decoding; the source is read at most one more frame"""
+        self._stopped = True
+        self._thread.join(1.0)
+
+
+class StreamStats:
+    """Frame counts and throughput of one stream"""
+
+    def __init__(self):
+        self.frames = 0
+        self.detect_frames = 0
+        self.encodes = 0
+        self.rematches = 0
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def report(self):
+        seconds = time.perf_counter() - self._start
+        cpu_seconds = time.process_time() - self._cpu_start
+        return {
+            "frames": self.frames,
+            "detect_frames": self.detect_frames,
+            "tracked_frames": self.frames - self.detect_frames,
+            "encodes": self.encodes,
+            "rematches": self.rematches,
+            "seconds": round(seconds, 3),
+            "cpu_seconds": round(cpu_seconds, 3),
+            "fps": round(self.frames / seconds, 2) if seconds > 0 else 0.0,
+            # CPU time of the whole process, so concurrent requests inflate it
+            "fps_per_core": round(self.frames / cpu_seconds, 2) if cpu_seconds > 0 else 0.0,
+        }
+
+
+class Track:
+    """One face followed across frames"""
+
+    def __init__(self, track_id, box, frame_index):
+        self.id = track_id
+        # (top, right, bottom, left) in full-resolution pixels
+        self.box = box
+        self.name = None
+        self.confidence = 0.0
+        self.encoding = None
+        self.template = None
+        # Size of the template relative to the tracking frame
+        self.template_scale = 1.0
+        self.score = 1.0
+        self.missed = 0
+        self.first_frame = frame_index
+        self.last_frame = frame_index
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "confidence": round(self.confidence, 4),
+            "box": [int(v) for v in self.box],
+            "first_frame": self.first_frame,
+            "last_frame": self.last_frame,
+        }
+
+
+class StreamProcessor:
+    """
+    Detects, tracks and identifies faces frame by frame.
+
+    ``match(encodings)`` returns a (name, confidence) pair per encoding;
+    ``version()``, if given, returns the gallery version so tracks can be
+    re-matched when it changes.
+    """
+
+    def __init__(self, match, options=DEFAULT_STREAM_OPTIONS,
+                 detect_options=inference.DEFAULT_OPTIONS, version=None):
+        self.match = match
+        self.options = options
+        self.detect_options = detect_options
+        self.version = version
+        self.stats = StreamStats()
+        self.tracks = []
+        self.finished = []
+        self._next_id = 1
+        self._frame_index = -1
+        self._last_detect = None
+        # Grey frame and face boxes of the last detection, for motion checks
+        self._motion_ref = None
+        self._motion_boxes = []
+        self._gallery_version = version() if version else None
+
+    def process(self, image):
+        """Process one BGR frame and return the live tracks"""
+        self._frame_index += 1
+        self.stats.frames += 1
+        scale = min(1.0, self.options.track_side / max(image.shape[:2]))
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        detect = (
+            self._last_detect is None
+            or self._frame_index - self._last_detect >= self.options.detect_every
+            or self._moved(gray, scale)
+        )
+        if not detect:
+            detect = not self._follow(gray, scale)
+        if detect:
+            self._detect(image, gray, scale)
+
+        if self.version is not None:
+            version = self.version()
+            if version != self._gallery_version:
+                self._gallery_version = version
+                self._identify([t for t in self.tracks if t.encoding is not None], rematch=True)
+        for track in self.tracks:
+            if not track.missed:
+                track.last_frame = self._frame_index
+        return self.tracks
+
+    def summary(self):
+        """Every track seen so far, oldest first"""
+        return [track.summary() for track in sorted(self.finished + self.tracks, key=lambda t: t.id)]
+
+    def _moved(self, gray, scale):
+        if not self.options.motion_threshold or self._motion_ref is None:
+            return False
+        changed = cv2.absdiff(gray, self._motion_ref) > MOTION_PIXEL_DELTA
+        # Tracked faces moving is what the tracker is for, both where they
+        # are now and where they were
+        for box in self._motion_boxes + [track.box for track in self.tracks]:
+            top, right, bottom, left = _scaled_box(box, scale)
+            changed[max(0, top):bottom, max(0, left):right] = False
+        return np.count_nonzero(changed) > self.options.motion_threshold * changed.size
+
+    def _follow(self, gray, scale):
+        """Move every track to its best template match; False if one was lost"""
+        height, width = gray.shape
+        for track in self.tracks:
+            if track.template is None:
+                continue
+            top, right, bottom, left = _scaled_box(track.box, scale)
+            pad = max(bottom - top, right - left) // 2
+            y0, x0 = max(0, top - pad), max(0, left - pad)
+            window = gray[y0:min(height, bottom + pad), x0:min(width, right + pad)]
+            f = track.template_scale
+            if f < 1.0 and window.size:
+                window = cv2.resize(window, None, fx=f, fy=f, interpolation=cv2.INTER_AREA)
+            th, tw = track.template.shape
+            if window.shape[0] < th or window.shape[1] < tw:
+                track.score = 0.0
+                return False
+            result = cv2.matchTemplate(window, track.template, cv2.TM_CCOEFF_NORMED)
+            _, track.score, _, (x, y) = cv2.minMaxLoc(result)
+            if track.score < self.options.min_track_score:
+                return False
+            top, left = (y0 + y / f) / scale, (x0 + x / f) / scale
+            track.box = (int(top), int(left + tw / f / scale), int(top + th / f / scale), int(left))
+        return True
+
+    def _detect(self, image, gray, scale):
+        self.stats.detect_frames += 1
+        self._last_detect = self._frame_index
+        self._motion_ref = gray
+
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        detect_scale = inference.detection_scale(image.shape, self.detect_options)
+        small = rgb if detect_scale == 1.0 else cv2.resize(
+            rgb, None, fx=detect_scale, fy=detect_scale, interpolation=cv2.INTER_AREA
+        )
+        boxes = inference.scale_locations(face_recognition.face_locations(
+            small, number_of_times_to_upsample=self.detect_options.upsample, model=self.detect_options.model
+        ), detect_scale, image.shape)
+        self._motion_boxes = boxes
+
+        # Greedily pair detections with the tracks they overlap most
+        pairs = sorted(
+            ((_iou(box, track.box), d, t) for d, box in enumerate(boxes) for t, track in enumerate(self.tracks)),
+            reverse=True
+        )
+        detection_track = {}
+        matched_tracks = set()
+        for iou, d, t in pairs:
+            if iou < MIN_IOU:
+                break
+            if d not in detection_track and t not in matched_tracks:
+                detection_track[d] = t
+                matched_tracks.add(t)
+
+        stale = []
+        tracks = []
+        for t, track in enumerate(self.tracks):
+            if t in matched_tracks:
+                tracks.append(track)
+                continue
+            track.missed += 1
+            (tracks if track.missed <= self.options.max_missed else self.finished).append(track)
+
+        for d, box in enumerate(boxes):
+            if d in detection_track:
+                track = self.tracks[detection_track[d]]
+                # Still confidently the same face: keep its identity
+                if track.score < self.options.min_track_score or track.encoding is None:
+                    stale.append(track)
+            else:
+                track = Track(self._next_id, box, self._frame_index)
+                self._next_id += 1
+                tracks.append(track)
+                stale.append(track)
+            track.box = box
+            track.missed = 0
+            track.score = 1.0
+            track.template, track.template_scale = _template(gray, box, scale)
+        self.tracks = tracks
+        self._identify(stale, rgb=rgb)
+
+    def _identify(self, tracks, rgb=None, rematch=False):
+        if not tracks:
+            return
+        if not rematch:
+            encodings = face_recognition.face_encodings(rgb, [track.box for track in tracks])
+            for track, encoding in zip(tracks, encodings):
+                track.encoding = encoding
+            self.stats.encodes += len(tracks)
+        else:
+            self.stats.rematches += len(tracks)
+        for track, (name, confidence) in zip(tracks, self.match([track.encoding for track in tracks])):
+            track.name = name
+            track.confidence = confidence
+
+
+def _scaled_box(box, scale):
+    top, right, bottom, left = box
+    return int(top * scale), int(right * scale), int(bottom * scale), int(left * scale)
+
+
+def _template(gray, box, scale):
+    """Return (template, its scale) for the face at box, or (None, 1.0)"""
+    top, right, bottom, left = _scaled_box(box, scale)
+    template = gray[max(0, top):bottom, max(0, left):right]
+    if min(template.shape) < MIN_TEMPLATE_SIDE:
+        return None, 1.0
+    f = min(1.0, TEMPLATE_SIDE / max(template.shape))
+    if f < 1.0:
+        return cv2.resize(template, None, fx=f, fy=f, interpolation=cv2.INTER_AREA), f
+    return template.copy(), f
+
+
+def _iou(a, b):
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    union = (a[2] - a[0]) * (a[1] - a[3]) + (b[2] - b[0]) * (b[1] - b[3]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("source", help="video file, camera index or MJPEG URL")
+    parser.add_argument("--faces-dir", default="known_faces")
+    parser.add_argument("--detect-every", type=int, default=DEFAULT_STREAM_OPTIONS.detect_every)
+    parser.add_argument("--live", action="store_true", help="drop frames when falling behind")
+    args = parser.parse_args()
+
+    def encode_face_file(path):
+        encodings = face_recognition.face_encodings(face_recognition.load_image_file(path))
+        return encodings[0] if encodings else None
+
+    gallery = Gallery()
+    gallery.replace(*encoding_store.sync(args.faces_dir, encode_face_file)[:2])
+    print(f"Loaded {len(gallery)} known faces from {os.path.abspath(args.faces_dir)}")
+
+    def match_faces(encodings):
+        known = gallery.snapshot()
+        indices, distances = match(known, encodings)
+        return [(known.names[i[0]], float(1 - d[0])) if i[0] >= 0 else ("Unknown", 0.0)
+                for i, d in zip(indices, distances)]
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    processor = StreamProcessor(match_faces, DEFAULT_STREAM_OPTIONS._replace(detect_every=args.detect_every))
+    pipeline = FramePipeline(video_frames(source), live=args.live)
+    try:
+        for image in pipeline:
+            processor.process(image)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.close()
+    for track in processor.summary():
+        print(track)
+    print(dict(processor.stats.report(), dropped_frames=pipeline.dropped))
+
+
+if __name__ == '__main__':
+    main()
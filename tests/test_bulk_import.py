@@ -0,0 +1,130 @@
+"""Tests for bulk_import: outcomes, the report, failures and resuming."""
+import os
+
+import numpy as np
+import pytest
+
+import bulk_import
+import encoding_store
+import inference
+
+
+def fake_scan(buffer):
+    """
+    A Scan described by the image's text: "undecodable", or "faces:" then
+    a comma-separated value per face (the face's encoding is that value / 10
+    in every component, so different values are far apart)
+    """
+    text = buffer.decode('utf-8')
+    if text == "undecodable":
+        return inference.Scan(None, [], [], None, {}, 1.0, None)
+    values = [float(v) for v in text.partition(':')[2].split(',') if v]
+    encodings = [np.full(128, v / 10) for v in values]
+    return inference.Scan((8, 8, 3), [(0, 8, 8, 0)] * len(encodings), encodings, buffer, {}, 1.0, None)
+
+
+def fake_scanner(buffers):
+    return [fake_scan(buffer) for buffer in buffers]
+
+
+def make_source(root, images):
+    for path, text in images.items():
+        os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+        with open(os.path.join(root, path), 'w') as f:
+            f.write(text)
+    return bulk_import.ImportSource(str(root))
+
+
+@pytest.fixture
+def faces_dir(tmp_path):
+    path = tmp_path / "known_faces"
+    path.mkdir()
+    return str(path)
+
+
+def test_import_enrolls_and_rejects(tmp_path, faces_dir):
+    source = make_source(tmp_path / "photos", {
+        "alice.jpg": "faces:1",
+        "bob/1.jpg": "faces:2",
+        "bob/2.jpg": "faces:2",
+        "carol.jpg": "faces:",
+        "dave.jpg": "faces:3,4",
+        "eve.jpg": "undecodable",
+        "x\\y.jpg": "faces:5",
+        ".hidden.jpg": "faces:6",
+    })
+    report = bulk_import.BulkImporter(faces_dir, fake_scanner, chunk_size=2).run(source)
+
+    assert report["status"] == "done"
+    assert report["images"] == 7
+    assert report["enrolled"] == 2
+    assert report["rejected"] == {
+        "duplicate": 1, "no_face": 1, "multiple_faces": 1, "undecodable": 1, "invalid_name": 1
+    }
+    duplicate = next(r for r in report["rejections"] if r["outcome"] == "duplicate")
+    assert duplicate["image"] == "bob/2.jpg" and duplicate["duplicate_of"] == "bob.jpg"
+
+    assert encoding_store.list_face_images(faces_dir) == ["alice.jpg", "bob.jpg"]
+    entries, matrix = encoding_store.EncodingStore(faces_dir).load()
+    assert {filename: entry["name"] for filename, entry in entries.items()} == {
+        "alice.jpg": "alice", "bob.jpg": "bob"
+    }
+    np.testing.assert_allclose(matrix[entries["bob.jpg"]["row"]], np.full(128, 0.2))
+    assert bulk_import.import_status(faces_dir, report["import_id"])["state"] == "done"
+
+
+def test_import_dedupes_against_enrolled_faces(tmp_path, faces_dir):
+    first = make_source(tmp_path / "first", {"alice.jpg": "faces:1"})
+    bulk_import.BulkImporter(faces_dir, fake_scanner).run(first)
+
+    second = make_source(tmp_path / "second", {"alice.jpg": "faces:1", "alice/2.jpg": "faces:7"})
+    report = bulk_import.BulkImporter(faces_dir, fake_scanner).run(second)
+
+    assert report["enrolled"] == 1
+    assert report["rejected"] == {"duplicate": 1}
+    # alice.jpg is taken, so her new sample goes into her directory
+    assert encoding_store.list_face_images(faces_dir) == ["alice.jpg", "alice/2.jpg"]
+
+
+def test_failed_import_is_reported_and_resumes(tmp_path, faces_dir):
+    source = make_source(tmp_path / "photos", {
+        "alice.jpg": "faces:1", "bob.jpg": "faces:2", "carol.jpg": "faces:3"
+    })
+    calls = []
+
+    def failing_scanner(buffers):
+        calls.append(len(buffers))
+        if len(calls) == 2:
+            raise inference.InferenceTimeout("Processing took longer than 30s")
+        return fake_scanner(buffers)
+
+    with pytest.raises(inference.InferenceTimeout):
+        bulk_import.BulkImporter(faces_dir, failing_scanner, chunk_size=1).run(source)
+
+    status = bulk_import.import_status(faces_dir, source.import_id())
+    assert status["state"] == "failed"
+    assert status["report"]["error"] == "Processing took longer than 30s"
+    assert status["report"]["processed"] == 1
+
+    # Running it again skips the image already imported and clears the failure
+    report = bulk_import.BulkImporter(faces_dir, fake_scanner, chunk_size=1).run(source)
+    assert report["status"] == "done"
+    assert report["resumed"] == 1
+    assert report["enrolled"] == 3
+    assert bulk_import.import_status(faces_dir, source.import_id())["state"] == "done"
+
+
+def test_scan_errors_are_retried(tmp_path, faces_dir):
+    source = make_source(tmp_path / "photos", {"alice.jpg": "faces:1", "bob.jpg": "faces:2"})
+
+    def flaky_scanner(buffers):
+        return [RuntimeError("worker died") if b"2" in buffer else fake_scan(buffer) for buffer in buffers]
+
+    report = bulk_import.BulkImporter(faces_dir, flaky_scanner).run(source)
+    assert report["enrolled"] == 1
+    assert report["rejected"] == {"error": 1}
+
+    report = bulk_import.BulkImporter(faces_dir, fake_scanner).run(source)
+    assert report["resumed"] == 1
+    assert report["enrolled"] == 2
+    assert report["rejected"] == {}
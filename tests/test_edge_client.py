@@ -0,0 +1,66 @@
+"""Tests for the edge client's retries on a busy server."""
+import email.utils
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import edge_client
+from edge_client import EdgeClient, retry_after_seconds
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("3", 3.0),
+    ("0.5", 0.5),
+    ("-2", 0.0),
+    ("Wed, 21 Oct 2015 07:28:00 GMT", 0.0),
+    ("soon", None),
+    ("inf", None),
+    ("", None),
+    (None, None),
+])
+def test_retry_after_values(value, expected):
+    assert retry_after_seconds(value) == expected
+
+
+def test_retry_after_date_in_the_future():
+    value = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < retry_after_seconds(value) <= 30
+
+
+def test_busy_server_is_retried(monkeypatch):
+    monkeypatch.setattr(edge_client, "RETRY_BACKOFF_SECONDS", 0.01)
+    retry_after = iter(["Wed, 21 Oct 2015 07:28:00 GMT", "not a date"])
+
+    class BusyOnce(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            value = next(retry_after, None)
+            status, body = (503, {"status": "error"}) if value else (200, {"status": "success"})
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            if value:
+                self.send_header("Retry-After", value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BusyOnce)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = EdgeClient(f"http://127.0.0.1:{server.server_address[1]}",
+                        edge_client.DEFAULT_EDGE_OPTIONS._replace(mode="frames"))
+    try:
+        status, response = client.post("/identify", b"jpeg", "image/jpeg")
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+    assert status == 200 and response["status"] == "success"
+    assert client.stats["retries"] == 2
@@ -0,0 +1,113 @@
+"""Tests for encoding_store: the journal round-trip and sync folding it into the matrix."""
+import os
+
+import numpy as np
+
+import encoding_store
+from encoding_store import EncodingStore
+
+
+def encoding(value):
+    return np.full(128, value, dtype=np.float64)
+
+
+def write_image(faces_dir, filename, data=b"jpeg"):
+    path = os.path.join(faces_dir, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_journal_round_trip(tmp_path):
+    faces_dir = str(tmp_path)
+    for filename in ("alice.jpg", "bob/1.jpg", "bob/2.jpg", "carol.jpg"):
+        write_image(faces_dir, filename)
+    store = EncodingStore(faces_dir)
+    store.put("alice.jpg", "alice", encoding(0.1))
+    store.put_many([("bob/1.jpg", "bob", encoding(0.2)), ("bob/2.jpg", "bob", encoding(0.3))])
+    store.put("carol.jpg", "carol", None)
+    store.delete("bob/1.jpg")
+    store.rename("alice.jpg", "alicia.jpg", "alicia")
+
+    entries, matrix = EncodingStore(faces_dir).load()
+    assert sorted(entries) == ["alicia.jpg", "bob/2.jpg", "carol.jpg"]
+    assert entries["alicia.jpg"]["name"] == "alicia"
+    assert entries["carol.jpg"]["row"] == -1
+    assert entries["bob/2.jpg"]["size"] == os.path.getsize(os.path.join(faces_dir, "bob/2.jpg"))
+    np.testing.assert_array_equal(matrix[entries["alicia.jpg"]["row"]], encoding(0.1))
+    np.testing.assert_array_equal(matrix[entries["bob/2.jpg"]["row"]], encoding(0.3))
+
+
+def test_torn_journal_line_is_ignored(tmp_path):
+    faces_dir = str(tmp_path)
+    write_image(faces_dir, "alice.jpg")
+    store = EncodingStore(faces_dir)
+    store.put("alice.jpg", "alice", encoding(0.1))
+    with open(store.journal_path, 'a') as f:
+        f.write('{"op": "put", "file": "bob.jpg", "si')
+
+    entries, matrix = store.load()
+    assert list(entries) == ["alice.jpg"]
+    assert matrix.shape == (1, 128)
+
+
+def test_corrupt_cache_loads_empty(tmp_path):
+    store = EncodingStore(str(tmp_path))
+    os.makedirs(store.store_dir)
+    with open(store.index_path, 'w') as f:
+        f.write("{not json")
+
+    entries, matrix = store.load()
+    assert entries == {} and matrix.shape == (0, 128)
+
+
+def test_sync_folds_journal_into_matrix(tmp_path):
+    faces_dir = str(tmp_path)
+    encoded = []
+
+    def encode_file(path):
+        encoded.append(os.path.relpath(path, faces_dir))
+        with open(path, 'rb') as f:
+            data = f.read()
+        return None if data == b"no face" else encoding(len(data) / 100)
+
+    write_image(faces_dir, "alice.jpg", b"a")
+    write_image(faces_dir, "bob/1.jpg", b"bb")
+    names, matrix, stats = encoding_store.sync(faces_dir, encode_file)
+    assert names == ["alice", "bob"]
+    assert stats == {"reused": 0, "encoded": 2, "removed": 0}
+
+    # Enrolled through the journal since: reused by the next sync, not re-encoded
+    store = EncodingStore(faces_dir)
+    write_image(faces_dir, "bob/2.jpg", b"bbb")
+    write_image(faces_dir, "carol.jpg", b"no face")
+    store.put_many([("bob/2.jpg", "bob", encoding(0.03)), ("carol.jpg", "carol", None)])
+    os.remove(os.path.join(faces_dir, "alice.jpg"))
+    store.delete("alice.jpg")
+    encoded.clear()
+
+    names, matrix, stats = encoding_store.sync(faces_dir, encode_file)
+    assert encoded == []
+    # The journal already accounts for alice
+    assert stats == {"reused": 3, "encoded": 0, "removed": 0}
+    assert names == ["bob", "bob"]
+    np.testing.assert_array_equal(matrix, [encoding(0.02), encoding(0.03)])
+    assert not os.path.exists(store.journal_path)
+    entries, saved = store.load()
+    assert sorted(entries) == ["bob/1.jpg", "bob/2.jpg", "carol.jpg"]
+    np.testing.assert_array_equal(saved, matrix)
+
+    # Only the file that changed on disk is encoded again; one deleted
+    # without the store's knowledge is dropped
+    write_image(faces_dir, "bob/1.jpg", b"bbbbb")
+    os.remove(os.path.join(faces_dir, "carol.jpg"))
+    names, matrix, stats = encoding_store.sync(faces_dir, encode_file)
+    assert encoded == ["bob/1.jpg"]
+    assert stats == {"reused": 1, "encoded": 1, "removed": 1}
+    np.testing.assert_array_equal(matrix, [encoding(0.05), encoding(0.03)])
+
+    # Nothing changed: the saved matrix is served as is
+    names, unchanged, stats = encoding_store.sync(faces_dir, encode_file)
+    assert stats == {"reused": 2, "encoded": 0, "removed": 0}
+    assert isinstance(unchanged, np.memmap)
+    np.testing.assert_array_equal(unchanged, matrix)
@@ -0,0 +1,34 @@
+"""Tests for InferencePool timeouts and slot accounting."""
+import time
+
+import pytest
+
+import inference
+
+
+def test_batch_timeout_covers_the_whole_batch():
+    pool = inference.InferencePool(workers=0, threads=1, timeout=0.3)
+    try:
+        # Each task alone fits the timeout; the batch run one at a time does not
+        start = time.monotonic()
+        with pytest.raises(inference.InferenceTimeout):
+            pool.run_many(time.sleep, [(0.2,)] * 4)
+        assert time.monotonic() - start < 0.5
+
+        # Tasks still queued were cancelled, so their slots come back quickly
+        deadline = time.monotonic() + 1.0
+        while pool.stats()["in_flight"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert pool.stats()["in_flight"] == 0
+    finally:
+        pool.shutdown()
+
+
+def test_batch_returns_errors_in_order():
+    pool = inference.InferencePool(workers=0, threads=2, timeout=5)
+    try:
+        results = pool.run_many(lambda x: 1 / x, [(1,), (0,), (4,)])
+        assert results[0] == 1 and results[2] == 0.25
+        assert isinstance(results[1], ZeroDivisionError)
+    finally:
+        pool.shutdown()
@@ -0,0 +1,55 @@
+"""Tests for the IVF matcher's persisted centroids."""
+import os
+import threading
+
+import numpy as np
+
+from gallery import Gallery
+from matchers import IVF_FILE, IVFMatcher
+
+
+def gallery_snapshot(people=64):
+    gallery = Gallery()
+    rng = np.random.default_rng(0)
+    for i in range(people):
+        vector = rng.normal(size=128)
+        gallery.add(f"p{i}", (vector / np.linalg.norm(vector)).astype(np.float32))
+    return gallery.snapshot()
+
+
+def test_workers_saving_centroids_at_once(tmp_path):
+    snapshot = gallery_snapshot()
+    # Like gunicorn workers starting together: same directory, same seed
+    matchers = [IVFMatcher(str(tmp_path), nlist=4) for _ in range(8)]
+    errors = []
+    start = threading.Barrier(len(matchers))
+
+    def rebuild(matcher):
+        try:
+            start.wait()
+            for _ in range(5):
+                matcher._save_centroids(matcher._train(snapshot.encodings[:snapshot.count], 4))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=rebuild, args=(m,)) for m in matchers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors, errors[0]
+    assert os.listdir(tmp_path) == [IVF_FILE]
+    assert IVFMatcher(str(tmp_path), nlist=4)._load_centroids().shape == (4, 128)
+
+
+def test_failed_save_is_not_fatal(tmp_path):
+    # The store directory can't be created: a file is in the way
+    blocked = tmp_path / "blocked"
+    blocked.write_bytes(b"")
+    matcher = IVFMatcher(str(blocked / "store"), nlist=4)
+    snapshot = gallery_snapshot()
+
+    matcher.rebuild(snapshot)
+    indices, _ = matcher.search(snapshot, snapshot.encodings[:1], nprobe=4)
+    assert indices[0, 0] == 0
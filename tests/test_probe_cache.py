@@ -0,0 +1,100 @@
+"""Tests for ProbeCache: hits, eviction and invalidating matches on gallery changes."""
+import cv2
+import numpy as np
+
+from gallery import Gallery, match
+from probe_cache import ProbeCache
+
+PARAMS = (("hog", 1), (96, 75))
+
+
+def encoding(i):
+    vector = np.random.default_rng(i).normal(size=128)
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+
+def jpeg(quality=90, shift=0):
+    """A smooth test frame; quality and a small brightness shift add noise only"""
+    y, x = np.mgrid[0:240, 0:320]
+    image = np.stack([x * 255 // 320, y * 255 // 240, (x + y) * 255 // 560], axis=-1) + shift
+    ok, data = cv2.imencode(".jpg", image.clip(0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return data.tobytes()
+
+
+def test_hit_needs_same_bytes_and_params():
+    cache = ProbeCache(max_entries=4)
+    probe, entry = cache.lookup(b"frame", PARAMS)
+    assert probe.outcome == "miss" and entry is None
+    stored = cache.store(probe, "scan")
+
+    probe, entry = cache.lookup(b"frame", PARAMS)
+    assert probe.outcome == "hit" and entry is stored and entry.scan == "scan"
+    assert cache.lookup(b"frame", (("cnn", 1), (96, 75)))[0].outcome == "miss"
+    assert cache.lookup(b"other frame", PARAMS)[0].outcome == "miss"
+
+
+def test_least_recently_used_is_evicted():
+    cache = ProbeCache(max_entries=2)
+    for frame in (b"a", b"b"):
+        cache.store(cache.lookup(frame, PARAMS)[0], frame)
+    # Touching "a" leaves "b" as the oldest
+    assert cache.lookup(b"a", PARAMS)[0].outcome == "hit"
+    cache.store(cache.lookup(b"c", PARAMS)[0], b"c")
+
+    assert len(cache) == 2
+    assert cache.lookup(b"b", PARAMS)[0].outcome == "miss"
+    assert cache.lookup(b"a", PARAMS)[0].outcome == "hit"
+    assert cache.lookup(b"c", PARAMS)[0].outcome == "hit"
+
+
+def test_disabled_cache_never_hits():
+    cache = ProbeCache(max_entries=0)
+    entry = cache.store(cache.lookup(b"frame", PARAMS)[0], "scan")
+    assert entry.scan == "scan"
+    assert cache.lookup(b"frame", PARAMS)[0].outcome == "miss"
+    assert len(cache) == 0
+
+
+def test_perceptual_hit_on_a_recompressed_frame():
+    cache = ProbeCache(max_entries=4, perceptual=True)
+    stored = cache.store(cache.lookup(jpeg(90), PARAMS)[0], "scan")
+
+    probe, entry = cache.lookup(jpeg(70, shift=2), PARAMS)
+    assert probe.outcome == "near_hit" and entry is stored
+    # Detection options still have to match
+    assert cache.lookup(jpeg(70, shift=2), (("cnn", 1), (96, 75)))[0].outcome == "miss"
+    assert ProbeCache(max_entries=4).lookup(jpeg(70, shift=2), PARAMS)[0].outcome == "miss"
+
+
+def test_match_is_kept_until_the_gallery_changes():
+    gallery = Gallery()
+    gallery.add("alice", encoding(1))
+    gallery.add("bob", encoding(2))
+    cache = ProbeCache()
+    entry = cache.store(cache.lookup(b"frame", PARAMS)[0], "scan")
+
+    # As server.identify_scans keys it
+    known = gallery.snapshot()
+    key = (known.version, 1, None)
+    assert entry.match_for(key) is None
+    indices, distances = match(known, [encoding(2)])
+    assert not entry.keep_match(key, indices, distances)
+    cached_indices, _ = entry.match_for(key)
+    assert known.names[cached_indices[0, 0]] == "bob"
+    # Other match parameters are matched afresh
+    assert entry.match_for((known.version, 2, None)) is None
+
+    for change in (lambda: gallery.add("carol", encoding(3)),
+                   lambda: gallery.rename("bob", "robert"),
+                   lambda: gallery.remove("alice")):
+        change()
+        known = gallery.snapshot()
+        stale_key, key = key, (known.version, 1, None)
+        assert stale_key != key
+        assert entry.match_for(key) is None
+        indices, distances = match(known, [encoding(2)])
+        assert entry.keep_match(key, indices, distances)
+        assert entry.match_for(key)[0] is indices
+        assert entry.match_for(stale_key) is None
+
+    assert known.names[entry.match_for(key)[0][0, 0]] == "robert"
@@ -0,0 +1,106 @@
+"""Tests for ResultLog: batched writes, retries and dropped results."""
+import logging
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import result_log
+from result_log import ResultLog
+
+
+def entry(i, faces=("alice",)):
+    return {
+        "id": f"r{i}", "timestamp": "2026-01-01T00:00:00", "result": "Recognized: alice",
+        "confidence": 0.9, "image_size": "8x8", "face_count": len(faces), "faces": list(faces),
+    }
+
+
+@pytest.fixture(autouse=True)
+def quick_retries(monkeypatch):
+    monkeypatch.setattr(result_log, "WRITE_RETRY_DELAY", 0.01)
+
+
+def failing_writes(monkeypatch, failures, error=sqlite3.OperationalError("database is locked")):
+    """Make the next `failures` batch writes raise error"""
+    write = ResultLog._write
+    calls = []
+
+    def flaky_write(self, conn, batch):
+        calls.append(len(batch))
+        if len(calls) <= failures:
+            raise error
+        return write(self, conn, batch)
+
+    monkeypatch.setattr(ResultLog, "_write", flaky_write)
+    return calls
+
+
+def test_results_are_written_and_counted(tmp_path):
+    log = ResultLog(str(tmp_path / "results.db"))
+    for i in range(3):
+        log.append(entry(i, faces=("alice", "bob")))
+    log.close()
+
+    results, _ = log.query(name="bob")
+    assert [r["id"] for r in results] == ["r2", "r1", "r0"]
+    assert log.totals() == (3, 6)
+
+
+def test_locked_database_is_retried(tmp_path, monkeypatch, caplog):
+    calls = failing_writes(monkeypatch, failures=result_log.WRITE_ATTEMPTS - 1)
+    log = ResultLog(str(tmp_path / "results.db"))
+    log.append(entry(1))
+    with caplog.at_level(logging.WARNING):
+        log.close()
+
+    assert len(calls) == result_log.WRITE_ATTEMPTS
+    assert log.totals() == (1, 1)
+    assert log.dropped == {"queue_full": 0, "write_error": 0}
+    assert "retrying" in caplog.text
+
+
+def test_batch_is_dropped_after_last_attempt(tmp_path, monkeypatch, caplog):
+    calls = failing_writes(monkeypatch, failures=100, error=sqlite3.OperationalError("database or disk is full"))
+    log = ResultLog(str(tmp_path / "results.db"), flush_interval=1.0)
+    log.append(entry(1))
+    log.append(entry(2))
+    with caplog.at_level(logging.WARNING):
+        log.close()
+
+    assert len(calls) == result_log.WRITE_ATTEMPTS
+    assert log.dropped == {"queue_full": 0, "write_error": 2}
+    # Dropped results no longer count as pending
+    assert log.totals() == (0, 0)
+    assert "dropped 2 results" in caplog.text
+
+
+def test_other_errors_are_not_retried(tmp_path, monkeypatch):
+    calls = failing_writes(monkeypatch, failures=1, error=sqlite3.IntegrityError("UNIQUE constraint failed"))
+    log = ResultLog(str(tmp_path / "results.db"))
+    log.append(entry(1))
+    log.close()
+
+    assert calls == [1]
+    assert log.dropped["write_error"] == 1
+
+
+def test_full_queue_drops_and_logs(tmp_path, monkeypatch, caplog):
+    release = threading.Event()
+    write = ResultLog._write
+    monkeypatch.setattr(ResultLog, "_write", lambda self, conn, batch: release.wait() and write(self, conn, batch))
+    log = ResultLog(str(tmp_path / "results.db"), batch_size=1, max_pending=1)
+    # The writer takes the first result and waits, the second fills the queue
+    log.append(entry(0))
+    while log.queued():
+        time.sleep(0.001)
+    log.append(entry(1))
+    with caplog.at_level(logging.WARNING):
+        log.append(entry(2))
+    release.set()
+    log.close()
+
+    assert log.dropped["queue_full"] == 1
+    assert "dropped result r2" in caplog.text
+    assert log.totals() == (2, 2)
@@ -0,0 +1,147 @@
+"""Tests for SharedGallery: attached galleries, a reader racing a writer, failed changes."""
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from gallery import INITIAL_CAPACITY, match
+from shared_gallery import SharedGallery
+
+
+def encoding(i):
+    """Person i's encoding; any two are about 1.4 apart"""
+    vector = np.random.default_rng(i).normal(size=128)
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+
+def segments(directory):
+    return sorted(f for f in os.listdir(directory) if f.startswith("segment-"))
+
+
+def assert_consistent(snapshot):
+    """Every live row of a snapshot holds its person's encoding"""
+    assert len(snapshot.names) == snapshot.count
+    for row in np.flatnonzero(snapshot.active):
+        name = snapshot.names[row]
+        np.testing.assert_array_equal(snapshot.encodings[row], encoding(int(name[1:])))
+
+
+def test_changes_are_visible_to_every_attached_gallery(tmp_path):
+    writer = SharedGallery(str(tmp_path))
+    reader = SharedGallery(str(tmp_path))
+    assert writer.created and not reader.created
+
+    writer.add("p1", encoding(1))
+    writer.add("p2", encoding(2))
+    assert reader.names() == ["p1", "p2"]
+
+    reader.rename("p2", "p3")
+    reader.remove("p1")
+    writer.add("p3", encoding(2))
+    assert writer.names() == ["p3"]
+    assert writer.sample_count("p3") == reader.sample_count("p3") == 2
+    assert len(reader) == 2
+
+    indices, _ = match(reader.snapshot(), [encoding(2)])
+    assert reader.snapshot().names[indices[0, 0]] == "p3"
+
+
+def test_reader_races_grow_and_compaction(tmp_path):
+    writer = SharedGallery(str(tmp_path))
+    reader = SharedGallery(str(tmp_path))
+    done = threading.Event()
+    errors = []
+    versions = []
+
+    def read():
+        try:
+            while not done.is_set():
+                snapshot = reader.snapshot()
+                assert_consistent(snapshot)
+                if snapshot.count:
+                    name = snapshot.names[-1]
+                    indices, _ = match(snapshot, [encoding(int(name[1:]))], tolerance=0.01)
+                    if snapshot.active[-1]:
+                        assert snapshot.names[indices[0, 0]] == name
+                versions.append(snapshot.version)
+        except Exception as e:
+            errors.append(e)
+
+    def let_reader_catch_up():
+        """Wait until the reader has taken a snapshot after the last change"""
+        seen = len(versions)
+        while len(versions) < seen + 2 and thread.is_alive():
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    try:
+        # Grows past capacity a few times, then compacts, then grows again
+        for i in range(5 * INITIAL_CAPACITY):
+            writer.add(f"p{i}", encoding(i))
+            if i % 16 == 0:
+                let_reader_catch_up()
+        for i in range(4 * INITIAL_CAPACITY):
+            writer.remove(f"p{i}")
+            if i % 16 == 0:
+                let_reader_catch_up()
+        for i in range(5 * INITIAL_CAPACITY, 6 * INITIAL_CAPACITY):
+            writer.add(f"p{i}", encoding(i))
+    finally:
+        done.set()
+        thread.join()
+
+    assert not errors, errors[0]
+    # The reader kept up with the writer rather than finishing first
+    assert len(set(versions)) > 10
+    expected = [f"p{i}" for i in range(4 * INITIAL_CAPACITY, 6 * INITIAL_CAPACITY)]
+    assert reader.names() == expected
+    assert len(reader) == len(expected)
+    assert_consistent(reader.snapshot())
+    # Compaction dropped the tombstones
+    assert reader.snapshot().count < 5 * INITIAL_CAPACITY
+    assert len(segments(tmp_path)) == 1
+
+
+def test_failed_change_is_rolled_back(tmp_path, monkeypatch):
+    writer = SharedGallery(str(tmp_path))
+    reader = SharedGallery(str(tmp_path))
+    for i in range(INITIAL_CAPACITY):
+        writer.add(f"p{i}", encoding(i))
+    committed = segments(tmp_path)
+
+    def fail(record):
+        raise OSError("No space left on device")
+
+    # The next add grows into a new segment, then fails to commit
+    with monkeypatch.context() as patch:
+        patch.setattr(writer, "_commit", fail)
+        with pytest.raises(OSError):
+            writer.add("p1000", encoding(1000))
+
+    assert "p1000" not in writer
+    assert len(writer.names()) == INITIAL_CAPACITY
+    assert segments(tmp_path) == committed
+    assert_consistent(writer.snapshot())
+
+    writer.add("p1000", encoding(1000))
+    assert reader.sample_count("p1000") == 1
+    assert_consistent(reader.snapshot())
+
+
+def test_leftover_segment_is_replaced(tmp_path):
+    writer = SharedGallery(str(tmp_path))
+    for i in range(INITIAL_CAPACITY):
+        writer.add(f"p{i}", encoding(i))
+    # As left by a writer that died while growing, before its commit
+    orphan = tmp_path / f"segment-{writer._segment + 1}"
+    orphan.mkdir()
+    (orphan / "encodings.npy").write_bytes(b"torn")
+
+    writer.add(f"p{INITIAL_CAPACITY}", encoding(INITIAL_CAPACITY))
+
+    reader = SharedGallery(str(tmp_path))
+    assert len(reader) == INITIAL_CAPACITY + 1
+    assert_consistent(reader.snapshot())
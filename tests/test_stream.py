@@ -0,0 +1,97 @@
+"""Tests for stream ingest: splitting MJPEG bodies and the frame decode pipeline."""
+import io
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from stream import FramePipeline, mjpeg_frames
+
+
+def jpeg(value):
+    ok, data = cv2.imencode(".jpg", np.full((16, 16, 3), value, dtype=np.uint8))
+    return data.tobytes()
+
+
+def with_thumbnail(frame):
+    """The frame with an APP1 segment holding a JPEG of its own, like an EXIF thumbnail"""
+    thumbnail = jpeg(200)
+    segment = b'\xff\xe1' + (len(thumbnail) + 2).to_bytes(2, 'big') + thumbnail
+    return frame[:2] + segment + frame[2:]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+def test_multipart_body_is_split_into_frames(chunk_size):
+    frames = [jpeg(10), with_thumbnail(jpeg(20)), jpeg(30)]
+    body = b"".join(
+        b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(frame) + frame + b"\r\n"
+        for frame in frames
+    ) + b"--frame--\r\n"
+
+    assert list(mjpeg_frames(io.BytesIO(body), chunk_size=chunk_size)) == frames
+
+
+def test_concatenated_jpegs_are_split_into_frames():
+    frames = [jpeg(v) for v in (10, 20, 30)]
+    assert list(mjpeg_frames(io.BytesIO(b"".join(frames)), chunk_size=5)) == frames
+    # A frame cut off by the end of the body is not yielded
+    cut = b"".join(frames)[:-10]
+    assert list(mjpeg_frames(io.BytesIO(cut), chunk_size=5)) == frames[:2]
+
+
+def test_oversized_frame_is_rejected():
+    frame = jpeg(10)
+    with pytest.raises(ValueError):
+        list(mjpeg_frames(io.BytesIO(frame * 2), chunk_size=16, max_frame_bytes=len(frame) // 2))
+
+
+def test_pipeline_decodes_in_order_and_counts_undecodable():
+    pipeline = FramePipeline([jpeg(10), b"not a jpeg", jpeg(200), np.zeros((4, 4, 3), np.uint8)])
+    images = list(pipeline)
+
+    assert [image.shape for image in images] == [(16, 16, 3), (16, 16, 3), (4, 4, 3)]
+    assert abs(int(images[1][0, 0, 0]) - 200) <= 2
+    assert pipeline.undecodable == 1 and pipeline.dropped == 0
+
+
+def test_live_pipeline_drops_oldest_frames():
+    frames = [np.full((2, 2, 3), i, dtype=np.uint8) for i in range(10)]
+    pipeline = FramePipeline(frames, depth=2, live=True)
+    # The consumer is stalled until every frame was read
+    wait_for(lambda: pipeline.dropped == 8)
+
+    assert [int(image[0, 0, 0]) for image in pipeline] == [8, 9]
+
+
+def test_source_error_reaches_consumer():
+    def frames():
+        yield jpeg(10)
+        raise OSError("connection reset")
+
+    pipeline = FramePipeline(frames())
+    with pytest.raises(OSError):
+        list(pipeline)
+
+
+def test_close_stops_reading_the_source():
+    read = []
+
+    def frames():
+        for i in range(100):
+            read.append(i)
+            yield np.zeros((2, 2, 3), np.uint8)
+
+    pipeline = FramePipeline(frames(), depth=2)
+    next(iter(pipeline))
+    pipeline.close()
+
+    assert not pipeline._thread.is_alive()
+    assert len(read) < 10